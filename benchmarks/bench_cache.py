@@ -0,0 +1,90 @@
+"""
+SmartCache 淘汰策略基准：缓存填满后，set/get 延迟应不随容量增长
+另测字节计量：get_stats 报告的 memory_bytes 与 tracemalloc 实测的偏差，以及压缩前后的占用
+用法：python benchmarks/bench_cache.py [--sizes 1000 5000 20000 100000] [--ops 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router.cache import SmartCache  # noqa: E402
+from router.eviction import POLICIES  # noqa: E402
+
+
+def bench(policy: str, size: int, ops: int) -> tuple:
+    cache = SmartCache(max_size=size, default_ttl=3600, policy=policy)
+    for i in range(size):
+        cache.set(f"warm:{i}", "x")
+
+    rng = random.Random(42)
+    # 满载状态下写入新 key，每次都会触发淘汰
+    keys = [f"new:{i}" for i in range(ops)]
+    t0 = time.perf_counter()
+    for key in keys:
+        cache.set(key, "x")
+    set_us = (time.perf_counter() - t0) / ops * 1e6
+
+    # 80% 读热点，20% 读随机（含未命中）
+    hot = keys[-max(1, size // 10):]
+    lookups = [rng.choice(hot) if rng.random() < 0.8 else f"warm:{rng.randrange(size)}"
+               for _ in range(ops)]
+    t0 = time.perf_counter()
+    for key in lookups:
+        cache.get(key)
+    get_us = (time.perf_counter() - t0) / ops * 1e6
+    return set_us, get_us
+
+
+def bench_memory(compression: str, entries: int = 2000) -> tuple:
+    """答案长度混合（短句到 ~8KB），返回 (报告字节, 实测字节, 压缩条数, 平均 get 微秒)"""
+    rng = random.Random(7)
+    words = ["cache", "router", "model", "token", "缓存", "模型", "def", "return", "latency", "请求"]
+    cache = SmartCache(max_size=entries, policy="lru", compression=compression)
+    cache.set("warmup", "x" * 10000)  # 压缩器上下文是一次性开销，不算进条目
+    cache.clear()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    values = [" ".join(rng.choice(words) for _ in range(rng.choice([5, 50, 500, 1500])))
+              for _ in range(entries)]
+    for i, value in enumerate(values):
+        cache.set(f"key:{i}", value)
+    del values, value  # 原文只剩缓存引用时（未压缩的条目），实测才等于缓存占用
+    measured = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for i in range(entries):
+        cache.get(f"key:{i}")
+    get_us = (time.perf_counter() - t0) / entries * 1e6
+    stats = cache.get_stats()
+    return stats["memory_bytes"], measured, stats["compressed_items"], get_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 100000])
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--policies", nargs="+", default=sorted(POLICIES))
+    args = parser.parse_args()
+
+    print(f"{'policy':<10}{'max_size':>10}{'set(us)':>10}{'get(us)':>10}")
+    for policy in args.policies:
+        for size in args.sizes:
+            set_us, get_us = bench(policy, size, args.ops)
+            print(f"{policy:<10}{size:>10}{set_us:>10.2f}{get_us:>10.2f}")
+
+    print(f"\n{'compression':<12}{'reported':>12}{'measured':>12}{'error':>8}{'compressed':>12}{'get(us)':>10}")
+    for compression in ["none", "zlib", "zstd"]:
+        reported, measured, compressed, get_us = bench_memory(compression)
+        error = (reported - measured) / measured
+        print(f"{compression:<12}{reported:>12,}{measured:>12,}{error:>8.1%}{compressed:>12}{get_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
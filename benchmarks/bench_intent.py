@@ -0,0 +1,72 @@
+"""
+意图识别基准：合成正则单遍匹配 vs 旧版逐条 re.search
+用法：python benchmarks/bench_intent.py [--repeat 200]
+同时校验两种实现在所有样本上的结果一致
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router.intent_classifier import IntentRouter  # noqa: E402
+
+
+class LegacyIntentRouter(IntentRouter):
+    """旧实现：每个意图的每条模式各 re.search 一次"""
+
+    def predict(self, text: str) -> str:
+        text_lower = text.lower()
+        for intent, patterns in self.intent_patterns.items():
+            for pattern in patterns:
+                if re.search(pattern, text_lower, re.I):
+                    return intent
+        return "general"
+
+
+PASTED_CODE = "\n".join(
+    f"    value_{i} = compute(value_{i - 1}, weight={i}) if flag else None  # step {i}"
+    for i in range(1, 400)
+)
+
+SAMPLES = {
+    "short_general": "what's the weather like tomorrow",
+    "short_medical": "我头疼得厉害，需要去医院吗",
+    "long_general": "tell me a story about a dragon and a knight. " * 200,
+    "long_chinese": "今天的天气非常好，我们一起去公园散步吧，顺便聊聊最近的生活。" * 200,
+    "pasted_code": "why does this crash?\n" + PASTED_CODE,
+    "code_then_medical": PASTED_CODE + "\nalso my doctor says I need rest",
+}
+
+
+def bench(router: IntentRouter, text: str, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        router.predict(text)
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    new, legacy = IntentRouter(), LegacyIntentRouter()
+    print(f"{'sample':<20}{'chars':>8}{'intent':>10}{'legacy(us)':>12}{'new(us)':>10}{'speedup':>9}")
+    for name, text in SAMPLES.items():
+        expected = legacy.predict(text)
+        assert new.predict(text) == expected, f"{name}: {new.predict(text)} != {expected}"
+        old_us = bench(legacy, text, args.repeat)
+        new_us = bench(new, text, args.repeat)
+        print(f"{name:<20}{len(text):>8}{expected:>10}{old_us:>12.1f}{new_us:>10.1f}{old_us / new_us:>8.1f}x")
+
+    texts = list(SAMPLES.values()) * 50
+    t0 = time.perf_counter()
+    new.predict_batch(texts)
+    print(f"predict_batch({len(texts)} texts): {(time.perf_counter() - t0) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
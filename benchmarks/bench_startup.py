@@ -0,0 +1,112 @@
+"""
+启动耗时基准：import main 耗时 + uvicorn 启动到 /health 可用的耗时 + 语义缓存后台就绪耗时
+用法：python benchmarks/bench_startup.py [--repeat 5] [--import-budget-ms 1500] [--startup-budget-ms 4000]
+每项取多次子进程运行的中位数；超预算，或 import main 时就加载了重依赖，退出码非 0（可直接放进 CI）
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import main 时不应加载的重依赖（应在后台或首次使用时加载）
+HEAVY_MODULES = ["faiss", "langchain_openai", "langchain_community", "langchain_core", "openai"]
+
+IMPORT_PROBE = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({{"ms": ms, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import() -> dict:
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, capture_output=True,
+                         text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_startup(timeout: float) -> dict:
+    """返回 {health_ms, semantic_ms}：从拉起进程到 /health 200、到语义缓存 ready"""
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"health_ms": None, "semantic_ms": None}
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - t0 < timeout:
+                try:
+                    r = client.get(f"http://127.0.0.1:{port}/health")
+                except httpx.TransportError:
+                    time.sleep(0.01)
+                    continue
+                now_ms = (time.perf_counter() - t0) * 1000
+                if result["health_ms"] is None:
+                    result["health_ms"] = now_ms
+                status = r.json().get("semantic_cache", {}).get("status")
+                if status in ("ready", "failed"):
+                    result["semantic_ms"] = now_ms
+                    result["semantic_status"] = status
+                    break
+                time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1500)
+    parser.add_argument("--startup-budget-ms", type=float, default=4000)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    import_ms = statistics.median(r["ms"] for r in imports)
+    heavy = sorted({m for r in imports for m in r["heavy"]})
+
+    startups = [measure_startup(args.timeout) for _ in range(args.repeat)]
+    health = [r["health_ms"] for r in startups if r["health_ms"] is not None]
+    semantic = [r["semantic_ms"] for r in startups if r["semantic_ms"] is not None]
+    health_ms = statistics.median(health) if len(health) == len(startups) else float("inf")
+
+    print(f"import main          : {import_ms:8.1f} ms  (budget {args.import_budget_ms:.0f} ms)")
+    print(f"spawn → /health 200  : {health_ms:8.1f} ms  (budget {args.startup_budget_ms:.0f} ms)")
+    if semantic:
+        print(f"spawn → semantic ready: {statistics.median(semantic):7.1f} ms  "
+              f"({startups[-1].get('semantic_status')})")
+    print(f"heavy modules at import: {heavy or 'none'}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import main {import_ms:.0f}ms > {args.import_budget_ms:.0f}ms")
+    if health_ms > args.startup_budget_ms:
+        failures.append(f"startup {health_ms:.0f}ms > {args.startup_budget_ms:.0f}ms")
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {heavy}")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+    print("✅ within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+共享缓存多进程校验 + 吞吐：N 个进程同时读写同一个 SQLite 缓存文件
+用法：python benchmarks/check_shared_cache.py [--workers 4] [--keys 2000] [--max-size 1000]
+校验：
+  1. 一个进程写入的 key，其他进程立即可读（跨进程命中）
+  2. TTL 到期后所有进程都读不到
+  3. 并发写入后总条数不超过 max_size（跨进程淘汰）
+  4. write_behind 模式下别的进程占着写锁时 set / get_stats 立即返回，锁释放后写入落库
+任何一项失败退出码非 0。仓库没有测试套件，这是独立的校验脚本，需手动或在 CI 里单独运行
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router.shared_cache import SQLiteCache  # noqa: E402
+
+
+def writer(path: str, worker: int, keys: int, max_size: int, barrier) -> float:
+    cache = SQLiteCache(path, max_size=max_size)
+    barrier.wait()
+    t0 = time.perf_counter()
+    for i in range(keys):
+        cache.set(f"w{worker}:{i}", [f"chunk-{worker}-{i}", "!"])
+    return keys / (time.perf_counter() - t0)
+
+
+def reader(path: str, worker: int, workers: int, barrier) -> tuple:
+    cache = SQLiteCache(path, max_size=10 ** 9)
+    barrier.wait()
+    hits = 0
+    t0 = time.perf_counter()
+    for other in range(workers):
+        for i in range(200):
+            hits += cache.get(f"shared:{other}:{i}") is not None
+    return hits, workers * 200 / (time.perf_counter() - t0)
+
+
+def seed(path: str, worker: int) -> None:
+    cache = SQLiteCache(path)
+    for i in range(200):
+        cache.set(f"shared:{worker}:{i}", f"v{worker}-{i}")
+    cache.set(f"ttl:{worker}", "short", ttl=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=2000)
+    parser.add_argument("--max-size", type=int, default=1000)
+    args = parser.parse_args()
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        ctx = mp.get_context("spawn")
+        with ctx.Pool(args.workers) as pool:
+            # 1. 各进程写自己的 key，再让每个进程读所有进程的 key
+            pool.starmap(seed, [(path, w) for w in range(args.workers)])
+            barrier = ctx.Manager().Barrier(args.workers)
+            results = pool.starmap(reader, [(path, w, args.workers, barrier) for w in range(args.workers)])
+            expected = args.workers * 200
+            for w, (hits, ops) in enumerate(results):
+                print(f"reader {w}: {hits}/{expected} cross-process hits, {ops:,.0f} get/s")
+                if hits != expected:
+                    failures.append(f"reader {w} saw {hits}/{expected} keys")
+
+            # 2. TTL 跨进程生效
+            time.sleep(1.2)
+            cache = SQLiteCache(path)
+            stale = [w for w in range(args.workers) if cache.get(f"ttl:{w}") is not None]
+            print(f"expired keys still visible: {stale or 'none'}")
+            if stale:
+                failures.append(f"ttl keys still visible: {stale}")
+
+            # 3. 并发写入 + 跨进程容量上限
+            cache.clear()
+            barrier = ctx.Manager().Barrier(args.workers)
+            rates = pool.starmap(writer, [(path, w, args.keys, args.max_size, barrier)
+                                          for w in range(args.workers)])
+            total = SQLiteCache(path, max_size=args.max_size).get_stats()["total_items"]
+            print(f"writers: {', '.join(f'{r:,.0f}' for r in rates)} set/s; "
+                  f"items after {args.workers * args.keys} sets: {total} (max_size {args.max_size})")
+            if total > args.max_size:
+                failures.append(f"{total} items > max_size {args.max_size}")
+
+        # 4. 写锁被占住时，write_behind 的 set / get_stats 不阻塞调用方
+        cache = SQLiteCache(path, max_size=10 ** 9, write_behind=True)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        t0 = time.perf_counter()
+        cache.set("behind", "v")
+        cache.get_stats()
+        blocked_ms = (time.perf_counter() - t0) * 1000
+        time.sleep(0.3)
+        holder.execute("COMMIT")
+        holder.close()
+        cache._writer.submit(lambda: None).result()  # 等写线程排空
+        visible = SQLiteCache(path).get("behind") == "v"
+        print(f"write_behind: set + get_stats under a held write lock took {blocked_ms:.2f} ms, "
+              f"visible after unlock: {visible}")
+        if blocked_ms > 50:
+            failures.append(f"write_behind set blocked {blocked_ms:.0f} ms")
+        if not visible:
+            failures.append("write_behind value not written")
+
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+    print("✅ shared cache OK")
+
+
+if __name__ == "__main__":
+    main()
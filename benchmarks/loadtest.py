@@ -0,0 +1,355 @@
+"""
+回放压测：按给定速率/并发把 JSONL 流量打到 main.app（进程内 ASGI），上游换成本地 mock 大模型服务
+- mock 服务兼容 OpenAI /chat/completions（含流式 SSE），走真实的 ChatOpenAI → 连接池 → 限流/熔断/降级链路
+  每个模型独立的延迟分布（对数正态，中位数默认取 YAML 的 latency_ms）、5xx 错误率、429 比例
+- 精确缓存 / L2 / 语义缓存都放在临时目录，不读写 data/ 下的持久化数据，每次结果可复现
+- 开环发压：按 --rate 匀速到达，--concurrency 限制在途请求数；延迟从"该到达的时刻"算起（含排队，避免协调遗漏）
+- 报告：延迟 p50/p95/p99、吞吐、精确/语义缓存命中率、降级次数（实际模型 ≠ 路由首选）、估算成本、各模型调用/错误
+
+用法：python benchmarks/loadtest.py [--file requests.jsonl] [--rate 50] [--concurrency 32] [--repeat 3]
+        [--latency-scale 0.1] [--error-rate 0.02] [--rate-429 0.02] [--mock-config mock.json]
+        [--max-p95-ms 3000] [--max-error-rate 0.05] [--min-cache-hit-rate 0.5]
+JSONL 每行取 query 字段，没有则用 title + body；可选 user_tier / temperature
+--mock-config 按模型覆盖：{"gpt-4.1": {"latency_ms": 800, "sigma": 0.3, "error_rate": 0.1, "rate_429": 0}}
+超出 --max-p95-ms / --max-error-rate 或低于 --min-cache-hit-rate 时退出码非 0（可直接放进 CI）
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# -------------------- mock 大模型服务 --------------------
+class MockModel:
+    """一个模型的行为画像 + 本次压测的调用计数"""
+
+    def __init__(self, name: str, latency_ms: float, sigma: float = 0.5, error_rate: float = 0.0,
+                 rate_429: float = 0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def latency_s(self, rng: random.Random) -> float:
+        return rng.lognormvariate(math.log(max(self.latency_ms, 1) / 1000), self.sigma)
+
+
+def completion_text(model: str, body: dict) -> str:
+    messages = body.get("messages") or [{}]
+    query = str(messages[-1].get("content", ""))
+    return f"[{model}] 模拟回答：{query[:200]}"
+
+
+def build_mock_app(models: Dict[str, MockModel], seed: int = 0) -> FastAPI:
+    """OpenAI 兼容接口，路径 /{model}/v1/chat/completions，每个模型一个 base_url"""
+    app = FastAPI()
+    rng = random.Random(seed)
+
+    @app.post("/{model}/v1/chat/completions")
+    async def completions(model: str, request: Request):
+        body = await request.json()
+        mock = models[model]
+        mock.calls += 1
+        latency = mock.latency_s(rng)
+        roll = rng.random()
+        if roll < mock.rate_429:
+            mock.throttled += 1
+            await asyncio.sleep(min(latency, 0.05))
+            return JSONResponse({"error": {"message": "mock rate limit", "type": "rate_limit_error"}},
+                                status_code=429, headers={"retry-after-ms": "50"})
+        if roll < mock.rate_429 + mock.error_rate:
+            mock.errors += 1
+            await asyncio.sleep(latency)
+            return JSONResponse({"error": {"message": "mock upstream error", "type": "server_error"}},
+                                status_code=500)
+
+        text = completion_text(model, body)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 2
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 2,
+                 "total_tokens": prompt_tokens + len(text) // 2}
+        base = {"id": f"chatcmpl-mock{mock.calls}", "created": int(time.time()), "model": model}
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return {**base, "object": "chat.completion", "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}]}
+
+        async def sse():
+            # 首 token 占总延迟的三成，其余均匀分到各块
+            chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+            await asyncio.sleep(latency * 0.3)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(latency * 0.7 / len(chunks))
+                delta = {"index": 0, "delta": {"content": chunk}, "finish_reason": None}
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [delta]})}\n\n"
+            done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+            yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [done]})}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                # 与 OpenAI 一致：最后单独一块只带 usage、choices 为空
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# -------------------- 流量 --------------------
+def load_requests(path: str, limit: Optional[int] = None) -> List[dict]:
+    """每行一个 JSON：query（或 title + body），可选 user_tier / temperature"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            query = row.get("query") or "\n".join(p for p in (row.get("title"), row.get("body")) if p)
+            if not query:
+                continue
+            items.append({"query": query, "user_id": str(row.get("user_id", "loadtest")),
+                          "user_tier": row.get("user_tier", "free"),
+                          "temperature": float(row.get("temperature", 0.0)),
+                          "max_tokens": int(row.get("max_tokens", 1000))})
+            if limit and len(items) >= limit:
+                break
+    return items
+
+
+class Result:
+    __slots__ = ("latency_ms", "status", "model", "primary", "cost")
+
+    def __init__(self, latency_ms: float, status: int, model: Optional[str], primary: Optional[str],
+                 cost: float):
+        self.latency_ms = latency_ms
+        self.status = status
+        self.model = model
+        self.primary = primary
+        self.cost = cost
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+# -------------------- 网关 --------------------
+def setup_gateway(mock_url: str, state_dir: str, verbose: bool = False):
+    """上游指向 mock；缓存和语义缓存换成临时目录里的新实例"""
+    import config.llm_config as llm_config
+    for name, spec in llm_config.MODEL_SPECS.items():
+        spec.update(base_url=f"{mock_url}/{name}/v1", api_key="mock")
+
+    import main
+    from router.cache import build_cache
+    from router.log import setup_logging
+    from router.semantic_loader import BackgroundSemanticMatcher
+
+    cfg = main.engine.config
+    if not verbose:
+        setup_logging("WARNING", cfg.logging.format)  # 逐请求的 info 日志太多
+    main.cache = build_cache(cfg.cache, state_dir)
+    # 压测离线跑，语义缓存换成进程内 hashing（阈值走 hashing_threshold，只命中近似重复）
+    semantic_cfg = cfg.semantic_cache.model_copy(update={"embedding": "hashing"})
+    main.semantic_matcher = BackgroundSemanticMatcher(
+        semantic_cfg, persist_dir=semantic_cfg.persist_dir and os.path.join(state_dir, semantic_cfg.persist_dir))
+    for name in llm_config.MODEL_SPECS:
+        llm_config.MODEL_MAP[name]  # 先建好客户端，冷启动不计入压测
+    return main
+
+
+async def replay(main, client: httpx.AsyncClient, items: List[dict], rate: float,
+                 concurrency: int) -> List[Result]:
+    """开环：第 i 条在 i / rate 秒到达；rate=0 时全部立即到达，只受并发限制"""
+    sem = asyncio.Semaphore(concurrency)
+    results: List[Result] = []
+
+    async def one(item: dict, arrival: float):
+        async with sem:
+            # 发送前按当前可用模型查一次路由首选，用于统计降级
+            intent = main.intent_cls.predict(item["query"])
+            available = main.model_svc.get_available()
+            primary = main.engine.route(available, item["user_tier"], intent, item["query"]).primary \
+                if available else None
+            try:
+                r = await client.post("/v1/chat", json=item)
+                body = r.json() if r.status_code == 200 else {}
+                status = r.status_code
+            except Exception:
+                body, status = {}, 599
+        results.append(Result((time.perf_counter() - arrival) * 1000, status, body.get("model"), primary,
+                              body.get("cost", 0.0)))
+
+    start = time.perf_counter()
+    tasks = []
+    for i, item in enumerate(items):
+        arrival = start + (i / rate if rate else 0.0)
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(item, arrival)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def report(results: List[Result], elapsed: float, models: Dict[str, MockModel]) -> dict:
+    ok = [r for r in results if r.status == 200]
+    latencies = [r.latency_ms for r in results]
+    cache_hits = sum(1 for r in ok if r.model == "cache")
+    semantic_hits = sum(1 for r in ok if r.model == "SemanticCache")
+    upstream = [r for r in ok if r.model not in ("cache", "SemanticCache")]
+    fallbacks = sum(1 for r in upstream if r.primary and r.model != r.primary)
+    n = len(results) or 1
+    summary = {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "error_rate": round(1 - len(ok) / n, 4),
+        "cache_hit_rate": round(cache_hits / n, 4),
+        "semantic_hit_rate": round(semantic_hits / n, 4),
+        "upstream_calls": sum(m.calls for m in models.values()),  # 含重试/对冲；并发相同请求被合并的不算
+        "fallbacks": fallbacks,
+        "estimated_cost": round(sum(r.cost for r in ok), 6),
+    }
+
+    print("\n📊 压测结果")
+    for key, value in summary.items():
+        print(f"  {key:<20}{value}")
+    print(f"\n  {'status':<10}{'count':>8}")
+    for status, count in sorted(Counter(r.status for r in results).items()):
+        print(f"  {status:<10}{count:>8}")
+    served = Counter(r.model for r in ok)
+    print(f"\n  {'model':<30}{'served':>8}{'calls':>8}{'5xx':>6}{'429':>6}")
+    for name in sorted(set(models) | {m for m in served if m}):
+        mock = models.get(name)
+        calls, errors, throttled = (mock.calls, mock.errors, mock.throttled) if mock else ("-", "-", "-")
+        print(f"  {name:<30}{served.get(name, 0):>8}{calls:>8}{errors:>6}{throttled:>6}")
+    return summary
+
+
+async def run(args) -> dict:
+    import config.llm_config as llm_config
+    from router.engine import RouterEngine
+
+    overrides = {}
+    if args.mock_config:
+        with open(args.mock_config, encoding="utf-8") as f:
+            overrides = json.load(f)
+    candidates = RouterEngine().config.models
+    models = {}
+    for name in llm_config.MODEL_SPECS:
+        candidate = candidates.get(name)
+        profile = {"latency_ms": (candidate.latency_ms if candidate else 1000) * args.latency_scale,
+                   "sigma": args.sigma, "error_rate": args.error_rate, "rate_429": args.rate_429}
+        profile.update(overrides.get(name, {}))
+        models[name] = MockModel(name, **profile)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(build_mock_app(models, args.seed), host="127.0.0.1", port=port,
+                                           log_level="warning", lifespan="off"))
+    server_task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    items = load_requests(args.file, args.limit) * args.repeat
+    random.Random(args.seed).shuffle(items)
+    print(f"🚀 回放 {len(items)} 条请求（rate={args.rate or '∞'}/s, concurrency={args.concurrency}），"
+          f"mock 上游 http://127.0.0.1:{port}")
+
+    # 网关的逐请求 print 很多，默认吞掉
+    gateway_log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with tempfile.TemporaryDirectory() as state_dir:
+        with gateway_log:
+            main = setup_gateway(f"http://127.0.0.1:{port}", state_dir, args.verbose)
+            await main.on_startup()
+            await main.semantic_matcher.wait_ready(timeout=30)
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=120) as client:
+                with gateway_log:
+                    start = time.perf_counter()
+                    results = await replay(main, client, items, args.rate, args.concurrency)
+                    elapsed = time.perf_counter() - start
+        finally:
+            with gateway_log:
+                await main.on_shutdown()
+            server.should_exit = True
+            await server_task
+    return report(results, elapsed, models)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=os.path.join(ROOT, "requests.jsonl"))
+    parser.add_argument("--limit", type=int, default=None, help="只取前 N 条")
+    parser.add_argument("--repeat", type=int, default=3, help="整份流量重复几遍（打乱顺序），重复的才会命中缓存")
+    parser.add_argument("--rate", type=float, default=50.0, help="到达速率（条/秒），0 表示不限")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="mock 延迟相对 YAML latency_ms 的倍数")
+    parser.add_argument("--sigma", type=float, default=0.5, help="对数正态延迟的形状参数，越大长尾越重")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--mock-config", default=None, help="按模型覆盖 mock 行为的 JSON 文件")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="显示网关日志")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=None)
+    parser.add_argument("--min-cache-hit-rate", type=float, default=None)
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.max_p95_ms is not None and summary["p95_ms"] > args.max_p95_ms:
+        failures.append(f"p95 {summary['p95_ms']}ms > {args.max_p95_ms}ms")
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        failures.append(f"error_rate {summary['error_rate']} > {args.max_error_rate}")
+    if args.min_cache_hit_rate is not None and summary["cache_hit_rate"] < args.min_cache_hit_rate:
+        failures.append(f"cache_hit_rate {summary['cache_hit_rate']} < {args.min_cache_hit_rate}")
+    if failures:
+        print("\n❌ " + "; ".join(failures))
+        sys.exit(1)
+    print("\n✅ 压测完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,75 @@
-from langchain_openai import ChatOpenAI
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional
 
 from config.env_utils import K2_API_KEY, K2_BASE_URL, OPENAI_BASE_URL, OPENAI_API_key,ALi_API_KEY,ALi_BASE_URL
-#k2大模型调用
-moon = ChatOpenAI(
-    model='kimi-k2-0711-preview',
-    temperature=0.6,
-    api_key=K2_API_KEY,
-    base_url=K2_BASE_URL,
-    # extra_body={'enable_thinking': True},
-)
-#gpt4模型调用
-gpt4 = ChatOpenAI(model="gpt-4.1",temperature=0.8,api_key=OPENAI_API_key,base_url=OPENAI_BASE_URL)
-#claud大模型调用
-claud=ChatOpenAI(model="claude-3-7-sonnet-20250219",temperature=0.8,api_key=OPENAI_API_key,
-               base_url=OPENAI_BASE_URL)
-
-#Qwen大模型调用
-qwen = ChatOpenAI(model="qwen-max-2025-01-25",temperature=0.8,api_key=ALi_API_KEY,base_url=ALi_BASE_URL)
-
-MODEL_MAP: dict[str, ChatOpenAI] = {
-    "kimi-k2-0711-preview": moon,
-    "gpt-4.1":              gpt4,
-    "claude-3-7-sonnet-20250219": claud,
-    "qwen-max-2025-01-25":  qwen,
-}
\ No newline at end of file
+from router.http_pool import HttpPool
+
+# 模型客户端参数；客户端在第一次用到时才创建（import 本模块不建任何连接）
+MODEL_SPECS: Dict[str, Dict[str, Any]] = {
+    #k2大模型调用
+    "kimi-k2-0711-preview": dict(
+        temperature=0.6,
+        api_key=K2_API_KEY,
+        base_url=K2_BASE_URL,
+        # extra_body={'enable_thinking': True},
+    ),
+    #gpt4模型调用
+    "gpt-4.1": dict(temperature=0.8, api_key=OPENAI_API_key, base_url=OPENAI_BASE_URL),
+    #claud大模型调用
+    "claude-3-7-sonnet-20250219": dict(temperature=0.8, api_key=OPENAI_API_key, base_url=OPENAI_BASE_URL),
+    #Qwen大模型调用
+    "qwen-max-2025-01-25": dict(temperature=0.8, api_key=ALi_API_KEY, base_url=ALi_BASE_URL),
+}
+
+
+class LazyModelMap(MutableMapping):
+    """
+    模型名 → ChatOpenAI，按需创建
+    同一 base_url 的客户端共用 HttpPool 里的一个 httpx.AsyncClient（连接池 / keep-alive / HTTP2）
+    """
+
+    def __init__(self, specs: Dict[str, Dict[str, Any]]):
+        self.specs = specs
+        self.pool: Optional[HttpPool] = None
+        self._clients: Dict[str, Any] = {}
+
+    def use_pool(self, pool: HttpPool) -> None:
+        """指定连接池（ModelService 启动时按 YAML 配置传入），已创建的客户端会重建"""
+        self.pool = pool
+        self._clients = {k: v for k, v in self._clients.items() if k not in self.specs}
+
+    def _build(self, name: str):
+        from langchain_openai import ChatOpenAI  # 重依赖，首次调用模型时才导入
+
+        if self.pool is None:
+            self.pool = HttpPool()
+        spec = self.specs[name]
+        return ChatOpenAI(model=name, http_async_client=self.pool.client(spec.get("base_url")), **spec)
+
+    def __getitem__(self, name: str):
+        client = self._clients.get(name)
+        if client is None:
+            if name not in self.specs:
+                raise KeyError(name)
+            client = self._clients[name] = self._build(name)
+        return client
+
+    def __setitem__(self, name: str, client) -> None:
+        self._clients[name] = client
+
+    def __delitem__(self, name: str) -> None:
+        self._clients.pop(name, None)
+        self.specs.pop(name, None)
+
+    def __contains__(self, name) -> bool:
+        return name in self.specs or name in self._clients  # 不触发创建
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.specs
+        yield from (name for name in self._clients if name not in self.specs)
+
+    def __len__(self) -> int:
+        return len(set(self.specs) | set(self._clients))
+
+
+MODEL_MAP = LazyModelMap(MODEL_SPECS)
@@ -1,99 +1,380 @@
 # main.py
+import asyncio
+import os
 import time
+from typing import Dict, List
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 
 # -------------------- 内部模块 --------------------
-from router.models import UserTier, Candidate, ChatResponse, ChatRequest
+from router.models import (UserTier, Candidate, ChatResponse, ChatRequest, RouteDecision, TokenUsage,
+                           BatchChatRequest, BatchChatResponse, BatchItemResult)
+from router.tokens import estimate_prompt_tokens
+from router.admission import AdmissionRejected, AdmissionScheduler, AdmissionTicket
 from router.intent_classifier import IntentRouter
-from router.engine import RouterEngine
+from router.engine import ContextWindowError, RouterEngine, dir_path
 from router.model_service import ModelService
-from router.cache import SmartCache, CacheKeyGenerator
+from router.cache import CacheKeyGenerator, build_cache
+from router.log import get_logger, setup_logging
+from router.metrics import (CONTENT_TYPE, COST, REGISTRY, REQUEST_SECONDS, REQUESTS, Gauge,
+                            stage_timer)
 from fastapi.responses import StreamingResponse
 
-from router.semantic_utils import SemanticMatcherFAISS
+from router.semantic_loader import BackgroundSemanticMatcher
+from router.singleflight import SingleFlight
 
 # -------------------- 初始化 --------------------
 app = FastAPI(title="智能大模型路由网关（YAML价格+真调用）", version="2.0")
 
 engine        = RouterEngine()                       # 读 YAML
+setup_logging(engine.config.logging.level, engine.config.logging.format)
+log           = get_logger(__name__)
 intent_cls    = IntentRouter()
 model_svc     = ModelService(engine.get_all_candidates(), engine)  # 注入引擎→读价格
-cache         = SmartCache(max_size=5000, default_ttl=1800)
-cache.start_cleanup_task(interval=600)               # 后台 10 分钟清一次
-# 初始化语义匹配器
-semantic_matcher = SemanticMatcherFAISS(threshold=0.95)
+cache_cfg     = engine.config.cache
+cache         = build_cache(cache_cfg, dir_path)     # 后端/淘汰策略读 YAML，sqlite 后端多 worker 共享
+cache.start_cleanup_task(interval=cache_cfg.cleanup_interval)  # 后台定期回收过期项
+# 初始化语义匹配器（向量化后端读 YAML，默认 OpenAI Embedding）
+# faiss/langchain 较重，启动后在后台线程加载，就绪前语义缓存视为未命中
+semantic_cfg     = engine.config.semantic_cache
+semantic_matcher = BackgroundSemanticMatcher(semantic_cfg,
+                                             persist_dir=semantic_cfg.persist_dir and
+                                             os.path.join(dir_path, semantic_cfg.persist_dir))
+
+@app.on_event("startup")
+async def on_startup():
+    semantic_matcher.start()   # 后台加载语义缓存，完成后启动定期快照
+    model_svc.start_warmup()   # 后台预建模型客户端
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await semantic_matcher.aclose()  # 停机前落盘，重启不丢语义缓存
+    await model_svc.aclose()         # 关闭上游连接池
+
+inflight = SingleFlight()                            # 相同请求并发合并
+admission = AdmissionScheduler(engine.config.admission)  # 上游槽位：按用户等级排队、加权公平出队
+
+# -------------------- 指标 --------------------
+def cache_layers() -> Dict[str, dict]:
+    stats = cache.get_stats()
+    return {"l1": stats["l1"], "l2": stats["l2"]} if stats["backend"] == "tiered" else {stats["backend"]: stats}
+
+REGISTRY.register(Gauge("router_cache_items", "Exact cache entries by layer", ("layer",),
+                        collect=lambda: {(k,): v["total_items"] for k, v in cache_layers().items()}))
+REGISTRY.register(Gauge("router_cache_bytes", "Exact cache size in bytes by layer", ("layer",),
+                        collect=lambda: {(k,): v.get("memory_bytes", v.get("value_bytes", 0))
+                                         for k, v in cache_layers().items()}))
+REGISTRY.register(Gauge("router_semantic_cache_entries", "Semantic cache entries",
+                        collect=lambda: {(): semantic_matcher.get_stats().get("entries", 0)}))
+REGISTRY.register(Gauge("router_circuit_open", "1 when the model's circuit breaker is open", ("model",),
+                        collect=lambda: {(name, ): int(s["state"] == "open")
+                                         for name, s in model_svc.breaker_states().items()}))
+
+REGISTRY.register(Gauge("router_admission_queued", "Requests waiting for an upstream slot by user tier",
+                        ("tier",), collect=lambda: {(t,): s["queued"]
+                                                    for t, s in admission.get_stats()["tiers"].items()}))
+REGISTRY.register(Gauge("router_admission_active", "Upstream slots in use",
+                        collect=lambda: {(): admission.active}))
+
+OUTCOMES = {"cache": "cache_hit", "SemanticCache": "semantic_hit"}
+
+def record_request(endpoint: str, intent: str, user_tier: UserTier, outcome: str, start: float) -> None:
+    REQUESTS.inc((endpoint, intent, UserTier(user_tier).value, outcome))
+    REQUEST_SECONDS.observe(time.time() - start, (endpoint, outcome))
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    带上游槽位的流式响应：响应结束时归还还没交给上游流的槽位
+    客户端在开始迭代 body 之前就断开时 body 生成器根本不会运行，只能在这里兜底
+    """
+
+    def __init__(self, content, slot: dict, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            ticket = self.slot.pop("ticket", None)
+            if ticket:
+                ticket.release()
+
+def shed(e: AdmissionRejected) -> HTTPException:
+    """准入拒绝 → 429/503 + Retry-After"""
+    return HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+REPLAY_CHUNK_CHARS = 64                              # 非流式写入的缓存按这个长度切块回放
+STREAM_MAX_TOKENS = 1000                             # 流式接口的最大输出
+
+def cached_text(value) -> str:
+    """缓存值可能是流式写入的块列表，也可能是整段文本"""
+    return "".join(value) if isinstance(value, list) else value
+
+async def replay(value):
+    """缓存命中按块回放（不 sleep）：流式写入的保持原始分块，整段文本按固定长度切块"""
+    if isinstance(value, list):
+        chunks = value
+    else:
+        chunks = [value[i:i + REPLAY_CHUNK_CHARS] for i in range(0, len(value), REPLAY_CHUNK_CHARS)]
+    for chunk in chunks:
+        yield chunk
+
+async def stream_through(chunks, query: str, user_tier: UserTier, intent: str, cache_key: str,
+                         usage: TokenUsage, ticket: AdmissionTicket = None):
+    """
+    边转发边收集，上游流正常结束才回写精确缓存（块列表）和语义缓存（整段文本），并按实际用量记花费
+    上游槽位（ticket）占到流结束为止
+    """
+    collected = []
+    try:
+        async for chunk in chunks:
+            collected.append(chunk)
+            yield chunk
+    finally:
+        if ticket:
+            ticket.release()
+    cost = model_svc.calc_cost(usage.model, usage.total_tokens)
+    COST.inc((usage.model,), cost)
+    log.info("stream_done", model=usage.model, intent=intent, input_tokens=usage.input_tokens,
+             output_tokens=usage.output_tokens, estimated=usage.estimated, cost=round(cost, 6),
+             queue_ms=round(ticket.wait * 1000, 1) if ticket else 0.0)
+    cache.set_with_intent(cache_key, collected, intent)
+    await semantic_matcher.aadd(query, "".join(collected), intent, user_tier)
+
+async def generate(query: str, user_tier: UserTier, intent: str, max_tokens: int,
+                   cache_key: str = None, decision: RouteDecision = None, bulk: bool = False):
+    """
+    选模型 → 等上游槽位 → 降级链真调用 → 回写缓存
+    返回 (模型名, 文本, 按实际用量算的花费, 排队秒数)；批量接口按厂商限并发，不排队
+    """
+    # 3. 选模型（读 YAML 价格 & 规则），熔断打开的、上下文放不下的模型不参与；批量接口已提前路由好
+    if decision is None:
+        available = model_svc.get_available()
+        if not available:
+            raise HTTPException(status_code=503, detail="no model available (circuit open or rate limited)")
+        try:
+            with stage_timer("route"):
+                decision = engine.route(available, user_tier, intent, query,  # 查决策表
+                                        tokens=estimate_prompt_tokens(query) + max_tokens)
+        except ContextWindowError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    all_candidates = [decision.primary] + decision.fallbacks
+    # 4. 真调用（价格来自 YAML）：降级链 + 对冲，慢模型超时会并行拉起下一个
+    log.debug("route", intent=intent, tier=UserTier(user_tier).value, candidates=all_candidates)
+    ticket = None if bulk else await admission.acquire(user_tier)  # 排满 / 等不到截止时间抛 AdmissionRejected
+    try:
+        with stage_timer("upstream") as timer:
+            actual_model, text, usage = await model_svc.call_with_fallback(all_candidates, query, max_tokens,
+                                                                           bulk=bulk)
+    except Exception as e:
+        log.warning("upstream_failed", intent=intent, candidates=all_candidates, error=str(e))
+        raise HTTPException(status_code=503, detail=f"all candidate models failed: {e}")
+    finally:
+        if ticket:
+            ticket.release()
+    queue_wait = ticket.wait if ticket else 0.0
+    cost = model_svc.calc_cost(actual_model, usage.total_tokens)
+    log.info("upstream_done", model=actual_model, primary=decision.primary, intent=intent,
+             tier=UserTier(user_tier).value, latency_ms=round(timer.elapsed * 1000, 1),
+             queue_ms=round(queue_wait * 1000, 1), input_tokens=usage.input_tokens,
+             output_tokens=usage.output_tokens, estimated=usage.estimated, cost=round(cost, 6))
+
+    # 5. 回写缓存
+    if cache_key:
+        #根据意图设置缓存过期时间
+        cache.set_with_intent(cache_key, text, intent)
+    await semantic_matcher.aadd(query, text, intent, user_tier)  # 按意图×等级分区，TTL 跟随意图
+    return actual_model, text, cost, queue_wait
+
 @app.post("/v1/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
     start = time.time()
 
     # 1. 意图识别
-    intent = intent_cls.predict(req.query)
+    with stage_timer("intent"):
+        intent = intent_cls.predict(req.query)
+    return await answer(req, intent, start)
+
+async def answer(req: ChatRequest, intent: str, start: float, decision: RouteDecision = None,
+                 bulk: bool = False, endpoint: str = "chat") -> ChatResponse:
+    """/v1/chat 和批量接口共用；按结果（缓存/语义/上游/失败）记请求指标和花费"""
+    try:
+        response = await _answer(req, intent, start, decision, bulk)
+    except AdmissionRejected as e:
+        record_request(endpoint, intent, req.user_tier, "shed", start)
+        raise shed(e)
+    except HTTPException:
+        record_request(endpoint, intent, req.user_tier, "error", start)
+        raise
+    outcome = OUTCOMES.get(response.model, "upstream")
+    record_request(endpoint, intent, req.user_tier, outcome, start)
+    if response.cost:
+        COST.inc((response.model,), response.cost)
+    return response
 
+async def _answer(req: ChatRequest, intent: str, start: float, decision: RouteDecision = None,
+                  bulk: bool = False) -> ChatResponse:
+    """精确缓存 → 语义缓存 → 同键合并后调上游"""
     # 2. 缓存键
     cache_key=None
     if req.temperature==0.0:
         cache_key = CacheKeyGenerator.generate_key(
            query=req.query,temperature=req.temperature,user_tier=req.user_tier)
-        hit = cache.get(cache_key)
+        with stage_timer("exact_cache"):
+            hit = await cache.aget(cache_key)  # L1 未命中时在线程里查 L2
         if hit is not None:
             return ChatResponse(
-                text=hit, model="cache", cost=0.0,
+                text=cached_text(hit), model="cache", cost=0.0,
                 latency=round(time.time() - start, 3), intent=intent)
-    semantic_hit=semantic_matcher.afind_match(req.query)
+    semantic_hit=await semantic_matcher.afind_match(req.query, intent, req.user_tier)
     if semantic_hit:
         return ChatResponse(
-            text=semantic_hit, model="SemanticCache", cost=0.0,latency=round(time.time() - start, 3))
-    # 3. 选模型（读 YAML 价格 & 规则）
-    primary = engine.select_model(
-        model_svc.get_available(), req.user_tier, intent)
-    all_candidates = [primary] + [
-        m for m in engine.select_fallback_model()
-        if m != primary  # 避免重复
-    ]
-    # 4. 真调用 + 成本（价格来自 YAML）
-    actual_model=None
-    text=None
-    print(all_candidates)   
-    for  model_name in all_candidates:
-        try:
-            text    =  await model_svc.call(model_name, req.query, req.max_tokens)
-            actual_model = model_name
-            break
-        except:
-            continue
-    print(actual_model)
-    cost    = model_svc.calc_cost(actual_model, req.max_tokens)
-    latency = time.time() - start
+            text=semantic_hit, model="SemanticCache", cost=0.0,latency=round(time.time() - start, 3),
+            intent=intent)
 
-    # 5. 回写缓存
+    # 3~5. 同一缓存键的并发请求只打一次上游，其余等结果；花费只记在领头请求上，跟随者记 0
     if cache_key:
-        #根据意图设置缓存过期时间
-        cache.set_with_intent(cache_key, text, intent)
-    cache.set(cache_key, text)
-    await semantic_matcher.aadd(req.query,text)
+        leader = []
+
+        def lead():
+            leader.append(True)
+            return generate(req.query, req.user_tier, intent, req.max_tokens, cache_key, decision, bulk)
+
+        actual_model, text, cost, queue_wait = await inflight.do(cache_key, lead)
+        if not leader:
+            cost = 0.0
+    else:
+        actual_model, text, cost, queue_wait = await generate(req.query, req.user_tier, intent, req.max_tokens,
+                                                  decision=decision, bulk=bulk)
+    latency = time.time() - start
+
     return ChatResponse(
         text=text, model=actual_model, cost=round(cost, 6),
-        latency=round(latency, 3), intent=intent)
+        latency=round(latency, 3), intent=intent, queue_ms=round(queue_wait * 1000, 1))
+
+async def run_batch(reqs: List[ChatRequest]):
+    """
+    批量：意图批量识别 → 相同缓存键去重 → 批量路由 → 并发执行（上游按厂商限并发）
+    按完成顺序逐条产出 BatchItemResult，重复的请求跟随第一条一起产出（cost 记 0）
+    """
+    start = time.time()
+    with stage_timer("intent"):
+        intents = intent_cls.predict_batch([r.query for r in reqs])
+    groups: Dict[str, List[int]] = {}
+    for i, req in enumerate(reqs):
+        # temperature > 0 每次采样都不同，不去重
+        key = CacheKeyGenerator.generate_key(query=req.query, temperature=req.temperature,
+                                             user_tier=req.user_tier) if req.temperature == 0.0 else f"#{i}"
+        groups.setdefault(key, []).append(i)
+
+    available = model_svc.get_available()  # 整批共用一份可用列表，路由查决策表
+
+    async def run(indices: List[int]):
+        req, intent = reqs[indices[0]], intents[indices[0]]
+        try:
+            decision = None
+            if available:
+                with stage_timer("route"):
+                    decision = engine.route(available, req.user_tier, intent, req.query,
+                                            tokens=estimate_prompt_tokens(req.query) + req.max_tokens)
+            return indices, await answer(req, intent, start, decision, bulk=True, endpoint="batch"), None
+        except ContextWindowError as e:
+            return indices, None, (413, str(e))
+        except HTTPException as e:
+            return indices, None, (e.status_code, str(e.detail))
+        except Exception as e:
+            return indices, None, (500, str(e))
+
+    tasks = [asyncio.ensure_future(run(indices)) for indices in groups.values()]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            indices, response, error = await fut
+            for n, index in enumerate(indices):
+                if error is not None:
+                    yield BatchItemResult(index=index, status=error[0], error=error[1], deduped=n > 0)
+                else:
+                    item = response if n == 0 else response.model_copy(update={"cost": 0.0})
+                    yield BatchItemResult(index=index, response=item, deduped=n > 0)
+    finally:
+        for task in tasks:  # 客户端中途断开，没跑完的不再继续
+            task.cancel()
+
+def check_batch(batch: BatchChatRequest) -> None:
+    max_items = engine.config.batch.max_items
+    if len(batch.requests) > max_items:
+        raise HTTPException(status_code=413, detail=f"batch too large: {len(batch.requests)} > {max_items}")
+
+@app.post("/v1/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(batch: BatchChatRequest):
+    """一次提交多条 ChatRequest，results 按完成顺序排列，index 指回原请求"""
+    check_batch(batch)
+    start = time.time()
+    results = [item async for item in run_batch(batch.requests)]
+    return BatchChatResponse(
+        results=results, unique=sum(1 for r in results if not r.deduped),
+        total_cost=round(sum(r.response.cost for r in results if r.response), 6),
+        latency=round(time.time() - start, 3))
+
+@app.post("/v1/chat/batch/stream")
+async def chat_batch_stream(batch: BatchChatRequest):
+    """NDJSON：每完成一条就输出一行 BatchItemResult"""
+    check_batch(batch)
+
+    async def lines():
+        async for item in run_batch(batch.requests):
+            yield item.model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 # -------------------- 调试/管理接口 --------------------
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式：请求/阶段/上游直方图和计数器，缓存/熔断等状态抓取时现取"""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/health")
 async def health():
     return {
         "status": "ok",
         "available_models": len(model_svc.get_available()),
-        "cache_stats": cache.get_stats()
+        "cache_stats": await cache.aget_stats(),  # sqlite / L2 的库统计在线程里刷新
+        "semantic_cache": semantic_matcher.get_stats(),
+        "inflight_stats": inflight.get_stats(),
+        "model_stats": engine.stats.snapshot(),
+        "circuit_breakers": model_svc.breaker_states(),
+        "http_pools": model_svc.pool_stats(),
+        "provider_concurrency": model_svc.provider_states(),
+        "admission": admission.get_stats()
     }
 
 @app.get("/debug/route")
-async def debug_route(query: str, user_tier: UserTier = UserTier.Free):
+async def debug_route(query: str, user_tier: UserTier = UserTier.Free, show_table: bool = False,
+                      stream: bool = False, max_tokens: int = 1000):
     intent = intent_cls.predict(query)
-    scored = [(c.name, engine.caculation_score(c,user_tier, intent))
-              for c in model_svc.get_available()]
+    available = model_svc.get_available()
+    scored = [(c.name, engine.caculation_score(c,user_tier, intent, stream))
+              for c in available]
     scored.sort(key=lambda x: x[1], reverse=True)
-    return {"query": query, "intent": intent, "scored": scored}
+    prompt_tokens = estimate_prompt_tokens(query)
+    result = {"query": query, "intent": intent, "prompt_tokens": prompt_tokens, "scored": scored}
+    if available:
+        try:
+            result["decision"] = engine.route(available, user_tier, intent, query, stream=stream,
+                                              tokens=prompt_tokens + max_tokens)
+        except ContextWindowError as e:
+            result["error"] = str(e)
+    if show_table:
+        result["decision_table"] = engine.decision_table()
+    return result
+
+@app.get("/debug/limits")
+async def debug_limits():
+    """各模型限流器状态（剩余突发量、TPM 余量、被本地拒绝次数）"""
+    return model_svc.limiter_states()
 
 @app.post("/admin/set_health")
 async def set_health(model: str, healthy: bool):
+    # 熔断器自动摘除/恢复；这里只用于人工强制摘除或立即恢复
     model_svc.set_health(model, healthy)
     return {"message": f"{model} health set to {healthy}"}
 
@@ -103,10 +384,62 @@ async def cache_clear():
     return {"message": "cache cleared"}
 @app.get("/v1/steam_chat")
 async def steam_chat(query: str, user_tier: UserTier = UserTier.Free):
-    intent=intent_cls.predict(query)
-    target_model=engine.select_model(model_svc.get_available(), user_tier, intent)
-    return StreamingResponse(model_svc.steam_call(target_model, query, 1000),
-                             media_type='text/event-stream')
+    start = time.time()
+    with stage_timer("intent"):
+        intent=intent_cls.predict(query)
+    # 与 /v1/chat（temperature=0）同一个缓存键，两个接口互相命中
+    cache_key = CacheKeyGenerator.generate_key(query=query, temperature=0.0, user_tier=user_tier)
+    with stage_timer("exact_cache"):
+        hit = await cache.aget(cache_key)
+    if hit is not None:
+        record_request("stream", intent, user_tier, "cache_hit", start)
+        return StreamingResponse(replay(hit), media_type='text/event-stream', headers={"X-Cache": "hit"})
+    semantic_hit = await semantic_matcher.afind_match(query, intent, user_tier)
+    if semantic_hit:
+        record_request("stream", intent, user_tier, "semantic_hit", start)
+        return StreamingResponse(replay(semantic_hit), media_type='text/event-stream',
+                                 headers={"X-Cache": "semantic"})
+
+    available=model_svc.get_available()
+    if not available:
+        record_request("stream", intent, user_tier, "error", start)
+        raise HTTPException(status_code=503, detail="no model available (circuit open or rate limited)")
+    # 流式按首 token 延迟打分；首字节前超时/失败沿降级链换模型；上下文放不下的模型不参与
+    try:
+        with stage_timer("route"):
+            decision = engine.route(available, user_tier, intent, query, stream=True,
+                                    tokens=estimate_prompt_tokens(query) + STREAM_MAX_TOKENS)
+    except ContextWindowError as e:
+        record_request("stream", intent, user_tier, "error", start)
+        raise HTTPException(status_code=413, detail=str(e))
+    all_candidates = [decision.primary] + decision.fallbacks
+    # 相同问题的并发流共享一个上游流；流完整结束后回写缓存
+    stream_key = CacheKeyGenerator.generate_key(query=query, user_tier=user_tier, stream=True)
+    # 只有开新上游流的请求占槽位；必须在开始响应之前拿到，拒绝时才能返回 429/503
+    slot = {}
+    if not inflight.streaming(stream_key):
+        try:
+            slot["ticket"] = await admission.acquire(user_tier)
+        except AdmissionRejected as e:
+            record_request("stream", intent, user_tier, "shed", start)
+            raise shed(e)
+    record_request("stream", intent, user_tier, "upstream", start)  # 流式只记到开始响应为止
+    usage = TokenUsage()  # 流正常结束后由 stream_with_fallback 填入实际模型和用量
+    queue_ms = round(slot["ticket"].wait * 1000, 1) if slot else 0.0
+
+    def open_stream():
+        # 槽位交给上游流，占到上游流结束为止（订阅者全部断开时上游被取消，同样归还）
+        return stream_through(model_svc.stream_with_fallback(all_candidates, query, STREAM_MAX_TOKENS, usage),
+                              query, user_tier, intent, cache_key, usage, slot.pop("ticket", None))
+
+    async def body():
+        async for chunk in inflight.stream(stream_key, open_stream):
+            if slot:  # 排队期间同一问题的流已被别人开起来，作为订阅者加入，槽位没用上就还回去
+                slot.pop("ticket").release()
+            yield chunk
+
+    return SlotStreamingResponse(body(), slot, media_type='text/event-stream',
+                                 headers={"X-Cache": "miss", "X-Queue-Ms": str(queue_ms)})
 # -------------------- 启动 --------------------
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,160 @@
+"""
+上游准入调度：全局在途上限 + 按用户等级的有界队列 + 加权公平出队
+- 有空槽位且没人排队直接放行，不进队列
+- 槽位满了按等级排队；槽位空出来时用 stride 调度选下一个等级：每个等级一个 pass 值，
+  选 pass 最小的非空队列，出队后 pass += 1/weight，长期看各等级按权重比例拿到槽位，低权重也不会饿死
+- 早拒绝：队列满 → 429；按当前队列和上游占用时间 EWMA 预估的等待超过截止时间 → 503，不白排
+  排队中过了截止时间同样 503；都带 retry_after（秒），由 API 层写进 Retry-After
+- 排队时间单独记 router_queue_wait_seconds{tier}，上游耗时仍由 router_upstream_seconds 记，两者不混
+只在单个事件循环内使用，无锁
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from router.metrics import ADMISSION_REJECTED, QUEUE_WAIT_SECONDS
+from router.models import AdmissionConfig, UserTier
+
+_SERVICE_ALPHA = 0.2  # 上游占用时间 EWMA 平滑系数
+
+
+class AdmissionRejected(RuntimeError):
+    """准入拒绝：status 429（队列满）/ 503（等不到截止时间），retry_after 为建议重试间隔（秒）"""
+
+    def __init__(self, status: int, reason: str, retry_after: int, tier: UserTier):
+        super().__init__(f"{UserTier(tier).value} tier overloaded ({reason}), retry after {retry_after}s")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一个上游槽位；wait 为排队秒数。release 可重复调用，只生效一次"""
+    __slots__ = ("_scheduler", "wait", "_start")
+
+    def __init__(self, scheduler: Optional["AdmissionScheduler"], wait: float):
+        self._scheduler = scheduler
+        self.wait = wait
+        self._start = time.monotonic()
+
+    def release(self) -> None:
+        scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.release(time.monotonic() - self._start)
+
+
+class _Waiter:
+    __slots__ = ("future", "enqueued")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class AdmissionScheduler:
+    def __init__(self, config: AdmissionConfig):
+        self.config = config
+        self.tiers = {UserTier(t): c for t, c in config.tiers.items()}
+        self._queues: Dict[UserTier, Deque[_Waiter]] = {t: deque() for t in self.tiers}
+        self._depth: Dict[UserTier, int] = {t: 0 for t in self.tiers}  # 有效排队数（超时的惰性出队）
+        self._pass: Dict[UserTier, float] = {t: 0.0 for t in self.tiers}
+        self._vtime = 0.0  # 最近一次出队的 pass，空闲后重新排队的等级从这里起步，不攒历史额度
+        self._service_s = config.service_time_ms / 1000
+        self.active = 0
+        self.admitted: Dict[UserTier, int] = {t: 0 for t in self.tiers}
+        self.rejected: Dict[UserTier, int] = {t: 0 for t in self.tiers}
+
+    # -------------------- 预估 --------------------
+    def estimate_wait(self, tier: UserTier) -> float:
+        """
+        新请求排到该等级队尾时的预计等待：按 stride 比例，轮到它之前其他等级大约出队
+        (本等级排在前面的数 + 1) × w_other / w_self 个（不超过其实际排队数）
+        """
+        if self.active < self.config.max_concurrency and not any(self._depth.values()):
+            return 0.0
+        ahead = self._depth[tier]
+        weight = self.tiers[tier].weight
+        for other, depth in self._depth.items():
+            if other != tier and depth:
+                ahead += min(depth, (ahead + 1) * self.tiers[other].weight / weight)
+        return (ahead + 1) * self._service_s / self.config.max_concurrency
+
+    def _reject(self, tier: UserTier, status: int, reason: str, wait: float) -> AdmissionRejected:
+        self.rejected[tier] += 1
+        ADMISSION_REJECTED.inc((tier.value, reason))
+        return AdmissionRejected(status, reason, max(1, math.ceil(wait)), tier)
+
+    # -------------------- 准入 / 释放 --------------------
+    async def acquire(self, tier: UserTier) -> AdmissionTicket:
+        tier = UserTier(tier)
+        if not self.config.enabled:
+            return AdmissionTicket(None, 0.0)
+        if self.active < self.config.max_concurrency and not any(self._depth.values()):
+            self.active += 1
+            self.admitted[tier] += 1
+            QUEUE_WAIT_SECONDS.observe(0.0, (tier.value,))
+            return AdmissionTicket(self, 0.0)
+
+        limits = self.tiers[tier]
+        deadline = limits.max_wait_ms / 1000
+        if self._depth[tier] >= limits.queue_size:
+            raise self._reject(tier, 429, "queue_full", self.estimate_wait(tier))
+        estimate = self.estimate_wait(tier)
+        if estimate > deadline:
+            raise self._reject(tier, 503, "deadline", estimate)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future())
+        if not self._depth[tier]:
+            self._pass[tier] = max(self._pass[tier], self._vtime)
+        self._queues[tier].append(waiter)
+        self._depth[tier] += 1
+        try:
+            wait = await asyncio.wait_for(waiter.future, deadline)
+        except asyncio.TimeoutError:
+            self._depth[tier] -= 1
+            raise self._reject(tier, 503, "deadline", self.estimate_wait(tier))
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._depth[tier] -= 1
+            else:
+                self.release(0.0)  # 槽位已分到但调用方被取消（客户端断开），转给下一个
+            raise
+        self.admitted[tier] += 1
+        QUEUE_WAIT_SECONDS.observe(wait, (tier.value,))
+        return AdmissionTicket(self, wait)
+
+    def release(self, held: float) -> None:
+        self.active -= 1
+        if held:
+            self._service_s += _SERVICE_ALPHA * (held - self._service_s)
+        self._grant()
+
+    def _grant(self) -> None:
+        while self.active < self.config.max_concurrency:
+            ready = [t for t, d in self._depth.items() if d]
+            if not ready:
+                return
+            tier = min(ready, key=lambda t: (self._pass[t], -self.tiers[t].weight))
+            queue = self._queues[tier]
+            waiter = queue.popleft()
+            while waiter.future.done():  # 已超时 / 取消的，计数在 acquire 里扣过了
+                waiter = queue.popleft()
+            self._vtime = self._pass[tier]
+            self._pass[tier] += 1 / self.tiers[tier].weight
+            self._depth[tier] -= 1
+            self.active += 1
+            waiter.future.set_result(time.monotonic() - waiter.enqueued)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.config.enabled,
+            "active": self.active,
+            "max_concurrency": self.config.max_concurrency,
+            "service_time_ms": round(self._service_s * 1000, 1),
+            "tiers": {t.value: {"queued": self._depth[t], "admitted": self.admitted[t],
+                                "rejected": self.rejected[t],
+                                "estimated_wait_ms": round(self.estimate_wait(t) * 1000, 1)}
+                      for t in self.tiers},
+        }
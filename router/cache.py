@@ -1,52 +1,78 @@
 import hashlib
+import os
+import sys
 import threading
 import time
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
-from router.models import CacheItem
+from router.compression import Compressed, compress_value, create_codec, decompress_value, value_nbytes
+from router.eviction import EvictionPolicy, TimerWheel, create_policy
+from router.log import get_logger
+from router.models import CacheConfig, CacheItem
+
+log = get_logger(__name__)
+
+# 按意图的缓存时间（秒），0 表示不缓存；精确缓存和语义缓存共用
+INTENT_TTL = {
+    "code": 3600 * 24,  # 代码问题：缓存24小时（代码很少变）
+    "general": 3600,  # 普通问题：1小时
+    "chinese": 1800,  # 中文问题：30分钟
+    "medical": 0,  # 医疗问题：不缓存（安全考虑）
+    "emergency": 0,  # 紧急情况：不缓存
+    "math": 3600 * 12,  # 数学问题：12小时
+}
+
+# 每条缓存的簿记开销（CacheItem、dict 槽位、淘汰策略和时间轮里的记录），tracemalloc 实测约 1.2KB
+_ENTRY_OVERHEAD = 1200
 
 
 class SmartCache:
-    def __init__(self,max_size:int=1000,default_ttl:int=3600):
+    def __init__(self,max_size:int=1000,default_ttl:int=3600,policy:str="lru",
+                 max_bytes:Optional[int]=None,compression:str="none",compress_threshold:int=2048):
         self.cache:Dict[str,CacheItem]={} #字典格式 只能存{str:CacheItem对象}
         self.max_size=max_size
+        self.max_bytes=max_bytes #字节预算，None 表示只按条数限制
+        self.bytes=0 #当前占用字节数，增删时增量维护
+        self.codec=create_codec(compression) #大答案压缩存放，读取时透明解压
+        self.compress_threshold=compress_threshold
+        self.compressed_items=0
         self.default_ttl=default_ttl
         self.hit_count=0
         self.miss_count=0
+        self.eviction_count=0
         self.lock=threading.RLock () #线程锁，防止多线程同时修改
+        self.policy_name=policy
+        self.policy:EvictionPolicy=create_policy(policy,max_size) #淘汰策略，O(1) 决定扔谁
+        self.timer_wheel=TimerWheel() #过期时间轮，O(1) 找到过期的菜
+
+    def _discard(self, key: str) -> None:
+        """只从字典移除并扣减字节数（调用方需持有锁）"""
+        item = self.cache.pop(key, None)
+        if item is not None:
+            self.bytes -= item.size
+            if isinstance(item.values, Compressed):
+                self.compressed_items -= 1
+
+    def _remove(self, key: str) -> None:
+        """从缓存、淘汰策略、时间轮中同时移除（调用方需持有锁）"""
+        self._discard(key)
+        self.policy.on_remove(key)
+        self.timer_wheel.cancel(key)
 
     def _cleanup(self, cleanup_size: int = 100):
         """
-        清理缓存，腾出空间
-        策略：删除最老的和最不常用的
-        类比：冰箱满了，把最旧和最没人吃的菜扔掉
+        清理过期缓存
+        容量由淘汰策略在 set 时逐条保证，这里只需推进时间轮回收到期的 key
+        类比：冰箱按过期日期分了格子，只翻到期的那几格
         """
-        if not self.cache:
-            return
-
-        print(f"🧹 缓存清理中... (当前大小: {len(self.cache)}/{self.max_size})")
-
-        # 策略1：先删除所有过期的
-        expired_keys = [k for k, v in self.cache.items() if v.is_expired()]
-        for key in expired_keys:
-            del self.cache[key]
-
-        # 如果还不够，继续清理
-        if len(self.cache) >= self.max_size:
-            # 策略2：删除最不常用的（访问次数最少的）
-            sorted_items = sorted(
-                self.cache.items(),
-                key=lambda x: (x[1].access_count, x[1].created_at)  # 按访问次数，再按创建时间
-            )
-
-            # 删除前N个
-            to_delete = min(cleanup_size, len(sorted_items))
-            for i in range(to_delete):
-                key = sorted_items[i][0]
-                del self.cache[key]
-
-        print(f"清理完成，剩余缓存: {len(self.cache)}/{self.max_size}")
+        with self.lock:
+            expired_keys = self.timer_wheel.advance(time.time())
+            for key in expired_keys:
+                self._discard(key)
+                self.policy.on_remove(key)
+        if expired_keys:
+            log.info("cache_cleanup", expired=len(expired_keys), remaining=len(self.cache), max_size=self.max_size)
 
     def get(self, key: str) -> Optional[Any]:
         """
@@ -58,6 +84,7 @@ class SmartCache:
         with self.lock:  # 加锁，保证线程安全
             if key not in self.cache:
                 self.miss_count += 1
+                self.policy.on_miss(key)
                 return None  # 缓存没有这道菜
 
             item = self.cache[key]
@@ -65,30 +92,41 @@ class SmartCache:
             # 检查是否过期
             if item.is_expired():
                 # 过期了，扔掉
-                del self.cache[key]
+                self._remove(key)
                 self.miss_count += 1
+                self.policy.on_miss(key)
                 return None  # 菜坏了，不能吃
 
             # 更新访问计数
             item.access_count += 1
+            self.policy.on_access(key)
 
             # 命中！
             self.hit_count += 1
-            return item.values  # 返回菜
+            stored = item.values
+        return decompress_value(stored)  # 返回菜（压缩过的在锁外解压）
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """异步接口（与 L2/共享缓存一致），内存读直接返回"""
+        return self.get(key)
 
     def get_cache(self,key:str):
         with self.lock:
             item=self.cache.get(key)
             if item is None:
                 self.miss_count+=1
+                self.policy.on_miss(key)
                 return None
             if item.is_expired():
-                del self.cache[key]
+                self._remove(key)
                 self.miss_count+=1
+                self.policy.on_miss(key)
                 return None
             item.access_count+=1
+            self.policy.on_access(key)
             self.hit_count+=1
-            return item.values
+            stored=item.values
+        return decompress_value(stored)
 
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """
@@ -98,64 +136,68 @@ class SmartCache:
         :param ttl: 存活时间（秒），不传则用默认值
         类比：把做好的菜放进冰箱
         """
+        # 压缩和计量放在锁外，大答案不拖住其它请求
+        stored = compress_value(value, self.codec, self.compress_threshold)
+        size = _ENTRY_OVERHEAD + sys.getsizeof(key) + value_nbytes(stored)
+        if self.max_bytes is not None and size > self.max_bytes:
+            log.warning("cache_value_too_large", key=key, size=size, max_bytes=self.max_bytes)
+            return
+
         with self.lock:  # 加锁
-            # 如果缓存满了，先清理一些空间
-            if len(self.cache) >= self.max_size:
-                self._cleanup()
+            # 交给淘汰策略决定扔谁（满了才会返回被淘汰的 key）
+            evicted = self.policy.on_insert(key)
+            for old_key in evicted:
+                if old_key != key:
+                    self._discard(old_key)
+                    self.timer_wheel.cancel(old_key)
+            self.eviction_count += len(evicted)
+            if key in evicted:
+                # W-TinyLFU 准入过滤：新 key 频率不如老 key，不入缓存
+                self._discard(key)
+                self.timer_wheel.cancel(key)
+                return
 
             # 计算过期时间
-            expire_at = time.time() + (ttl or self.default_ttl)
+            now = time.time()
+            expire_at = now + (ttl or self.default_ttl)
 
             # 创建缓存项
             item = CacheItem(
-                values=value,
+                values=stored,
                 expires_at=expire_at,
-                created_at=time.time(),
-                access_count=0
+                created_at=now,
+                access_count=0,
+                size=size
             )
 
-            # 存储
+            # 存储（覆盖旧值时先扣掉旧值的字节）
+            self._discard(key)
             self.cache[key] = item
+            self.bytes += size
+            if isinstance(stored, Compressed):
+                self.compressed_items += 1
+            self.timer_wheel.schedule(key, expire_at)
+
+            # 字节预算：条数没满但总字节超了，继续让淘汰策略挑牺牲者
+            while self.max_bytes is not None and self.bytes > self.max_bytes:
+                victim = self.policy.evict()
+                if victim is None:
+                    break
+                self._discard(victim)
+                self.timer_wheel.cancel(victim)
+                self.eviction_count += 1
 
     # ==================== 5. 缓存清理策略 ====================
     def cleanup(self, cleanup_size: int = 100):
-        """
-        清理缓存，腾出空间
-        策略：删除最老的和最不常用的
-        类比：冰箱满了，把最旧和最没人吃的菜扔掉
-        """
-        if not self.cache:
-            return
-
-        print(f"🧹 缓存清理中... (当前大小: {len(self.cache)}/{self.max_size})")
-
-        # 策略1：先删除所有过期的
-        expired_keys = [k for k, v in self.cache.items() if v.is_expired()]
-        for key in expired_keys:
-            del self.cache[key]
-
-        # 如果还不够，继续清理
-        if len(self.cache) >= self.max_size:
-            # 策略2：删除最不常用的（访问次数最少的）
-            sorted_items = sorted(
-                self.cache.items(),
-                key=lambda x: (x[1].access_count, x[1].created_at)  # 按访问次数，再按创建时间
-            )
-
-            # 删除前N个
-            to_delete = min(cleanup_size, len(sorted_items))
-            for i in range(to_delete):
-                key = sorted_items[i][0]
-                del self.cache[key]
-
-        print(f"🧹 清理完成，剩余缓存: {len(self.cache)}/{self.max_size}")
+        """手动触发清理（与后台任务相同：回收过期项）"""
+        self._cleanup(cleanup_size)
 
     # ==================== 6. 辅助方法 ====================
     def delete(self, key: str) -> bool:
         """删除指定缓存"""
         with self.lock:
             if key in self.cache:
-                del self.cache[key]
+                self._remove(key)
                 return True
             return False
 
@@ -163,7 +205,11 @@ class SmartCache:
         """清空所有缓存"""
         with self.lock:
             self.cache.clear()
-            print("🧹 缓存已清空")
+            self.bytes = 0
+            self.compressed_items = 0
+            self.policy.clear()
+            self.timer_wheel.clear()
+            log.info("cache_cleared")
 
     def exists(self, key: str) -> bool:
         """检查键是否存在（即使没过期）"""
@@ -186,37 +232,44 @@ class SmartCache:
             info = {
                 "access_count": item.access_count,
                 "created_at": datetime.fromtimestamp(item.created_at).strftime("%H:%M:%S"),
-                "expire_at": datetime.fromtimestamp(item.expire_at).strftime("%H:%M:%S"),
-                "time_until_expire": item.time_until_expire(),
+                "expire_at": datetime.fromtimestamp(item.expires_at).strftime("%H:%M:%S"),
+                "time_until_expire": item.time_until_expiration(),
                 "hit_rate": self.get_hit_rate()
             }
             return value, info
 
     # ==================== 7. 统计信息 ====================
+    async def aget_stats(self) -> Dict:
+        """异步接口（与共享缓存 / 两级缓存一致），内存统计直接返回"""
+        return self.get_stats()
+
     def get_stats(self) -> Dict:
         """获取缓存统计信息"""
         with self.lock:
             total = self.hit_count + self.miss_count
             hit_rate = self.hit_count / total if total > 0 else 0
 
-            # 统计不同过期时间的项目
-            expiring_soon = 0  # 5分钟内过期
-            expired = 0
-            for item in self.cache.values():
-                if item.is_expired():
-                    expired += 1
-                elif item.time_until_expiration() < 300:  # 5分钟
-                    expiring_soon += 1
+            # 统计不同过期时间的项目：按时间轮的桶计数，不逐条扫描（桶粒度 1 秒）
+            now = time.time()
+            expired = self.timer_wheel.count_before(now)
+            expiring_soon = self.timer_wheel.count_before(now + 300) - expired  # 5分钟内过期
 
             return {
+                "backend": "memory",
                 "total_items": len(self.cache),
                 "max_size": self.max_size,
+                "policy": self.policy_name,
+                "eviction_count": self.eviction_count,
                 "hit_count": self.hit_count,
                 "miss_count": self.miss_count,
                 "hit_rate": f"{hit_rate:.2%}",
                 "expired_items": expired,
                 "expiring_soon": expiring_soon,
-                "memory_usage": f"{len(str(self.cache)) / 1024:.2f} KB"  # 粗略估算
+                "memory_bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "memory_usage": f"{self.bytes / 1024:.2f} KB",  # 键 + 值（压缩后）+ 簿记开销
+                "compression": self.codec.name if self.codec else "none",
+                "compressed_items": self.compressed_items,
             }
 
     def get_hit_rate(self) -> float:
@@ -230,23 +283,12 @@ class SmartCache:
         根据意图设置不同的TTL
         不同问题类型，缓存时间不同
         """
-        intent_ttl = {
-            "code": 3600 * 24,  # 代码问题：缓存24小时（代码很少变）
-            "general": 3600,  # 普通问题：1小时
-            "chinese": 1800,  # 中文问题：30分钟
-            "medical": 0,  # 医疗问题：不缓存（安全考虑）
-            "emergency": 0,  # 紧急情况：不缓存
-            "math": 3600 * 12,  # 数学问题：12小时
-        }
-
-        ttl = intent_ttl.get(intent, self.default_ttl)
-        print(f"📝 设置缓存TTL: {ttl}秒")
-
+        ttl = INTENT_TTL.get(intent, self.default_ttl)
         if ttl > 0:
             self.set(key, value, ttl)
-            print(f"📝 根据意图 '{intent}' 设置缓存TTL: {ttl}秒")
+            log.debug("cache_set", key=key, intent=intent, ttl=ttl)
         else:
-            print(f"⚠️  意图 '{intent}' 不缓存")
+            log.debug("cache_skip", key=key, intent=intent)  # medical / emergency 不缓存
 
     # ==================== 9. 定期清理任务 ====================
     def start_cleanup_task(self, interval: int = 300):
@@ -262,7 +304,7 @@ class SmartCache:
 
         thread = threading.Thread(target=cleanup_worker, daemon=True)
         thread.start()
-        print(f"🔧 启动自动清理任务，每 {interval} 秒清理一次")
+        log.info("cache_cleanup_task_started", interval=interval)
 
 
 class CacheKeyGenerator:
@@ -307,4 +349,39 @@ class CacheKeyGenerator:
         """为模型调用生成专用键"""
         content = f"{model_name}:{query}:{temperature}"
         key = hashlib.md5(content.encode()).hexdigest()
-        return f"model:{model_name[:10]}:{key[:8]}"
\ No newline at end of file
+        return f"model:{model_name[:10]}:{key[:8]}"
+
+
+def build_cache(config: CacheConfig, base_dir: str = ""):
+    """
+    按配置创建精确缓存：memory → SmartCache，sqlite → 多进程共享的 SQLiteCache
+    开启 l2 时外面再包一层 TieredCache（L1 内存 + L2 磁盘）
+    """
+    if config.backend == "memory":
+        max_bytes = int(config.max_mb * 1024 * 1024) if config.max_mb else None
+        cache = SmartCache(max_size=config.max_size, default_ttl=config.default_ttl, policy=config.policy,
+                           max_bytes=max_bytes, compression=config.compression,
+                           compress_threshold=config.compress_threshold)
+    elif config.backend == "sqlite":
+        from router.shared_cache import SQLiteCache
+        cache = SQLiteCache(os.path.join(base_dir, config.sqlite_path), max_size=config.max_size,
+                            default_ttl=config.default_ttl, policy=config.policy,
+                            mmap_mb=config.sqlite_mmap_mb, compression=config.compression,
+                            compress_threshold=config.compress_threshold, write_behind=True)
+    else:
+        raise ValueError(f"Unknown cache backend '{config.backend}', choose from ['memory', 'sqlite']")
+
+    l2 = config.l2
+    if not l2.enabled:
+        return cache
+    if config.backend != "memory":
+        log.warning("cache_l2_ignored", backend=config.backend, reason="l2 only works with the memory backend")
+        return cache
+    from router.shared_cache import SQLiteCache
+    from router.tiered_cache import TieredCache
+    return TieredCache(cache, SQLiteCache(os.path.join(base_dir, l2.path), max_size=l2.max_items,
+                                          default_ttl=config.default_ttl, policy="lru",
+                                          mmap_mb=l2.mmap_mb, max_bytes=int(l2.max_mb * 1024 * 1024),
+                                          compression=config.compression,
+                                          compress_threshold=config.compress_threshold),
+                       min_ttl=l2.min_ttl, compact_interval=l2.compact_interval)
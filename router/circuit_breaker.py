@@ -0,0 +1,170 @@
+"""
+按模型的熔断器：closed → open → half_open → closed
+- closed:    正常放行；连续失败数或窗口错误率超阈值 → open
+- open:      直接拒绝，不再浪费超时；冷却时间按熔断次数指数退避
+- half_open: 冷却结束后放少量探测请求，成功则恢复，失败则再次熔断（冷却翻倍）
+"""
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Optional
+
+from router.log import get_logger
+
+log = get_logger(__name__)
+
+
+class BreakerState(str, Enum):
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 5,
+            error_rate_threshold: float = 0.5,
+            window_size: int = 20,
+            min_requests: int = 10,
+            open_timeout: float = 5.0,
+            max_open_timeout: float = 300.0,
+            half_open_max_calls: int = 1,
+            success_threshold: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+
+        self._state = BreakerState.Closed
+        self._window: Deque[int] = deque(maxlen=window_size)  # 1=失败 0=成功
+        self._consecutive_failures = 0
+        self._trips = 0  # 连续熔断次数，决定退避时长
+        self._open_until = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._forced = False  # 人工摘除，不自动恢复
+        self._lock = threading.Lock()
+
+    # -------------------- 状态 --------------------
+    def _current_state(self, now: float) -> BreakerState:
+        """open 冷却到期后惰性转为 half_open（调用方需持有锁）"""
+        if self._state == BreakerState.Open and not self._forced and now >= self._open_until:
+            self._state = BreakerState.HalfOpen
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        return self._state
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            return self._current_state(time.time())
+
+    def is_available(self) -> bool:
+        """是否参与路由（不消耗探测名额）"""
+        with self._lock:
+            state = self._current_state(time.time())
+            if state == BreakerState.HalfOpen:
+                return self._probes_in_flight < self.half_open_max_calls
+            return state == BreakerState.Closed
+
+    def allow_request(self) -> bool:
+        """真正发请求前调用；half_open 时占用一个探测名额"""
+        with self._lock:
+            state = self._current_state(time.time())
+            if state == BreakerState.Closed:
+                return True
+            if state == BreakerState.HalfOpen and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    # -------------------- 结果回报 --------------------
+    def record_success(self) -> None:
+        with self._lock:
+            state = self._current_state(time.time())
+            if state == BreakerState.HalfOpen:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_successes += 1
+                if self._probe_successes >= self.success_threshold:
+                    self._close()
+                return
+            self._consecutive_failures = 0
+            self._window.append(0)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            if state == BreakerState.HalfOpen:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._trip(now)
+                return
+            if state == BreakerState.Open:
+                return
+            self._consecutive_failures += 1
+            self._window.append(1)
+            if self._consecutive_failures >= self.failure_threshold or self._error_rate_exceeded():
+                self._trip(now)
+
+    def release(self) -> None:
+        """请求被取消（如对冲落败）：归还探测名额，不计成功也不计失败"""
+        with self._lock:
+            if self._state == BreakerState.HalfOpen:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _error_rate_exceeded(self) -> bool:
+        if len(self._window) < self.min_requests:
+            return False
+        return sum(self._window) / len(self._window) >= self.error_rate_threshold
+
+    def _trip(self, now: float) -> None:
+        self._trips += 1
+        timeout = min(self.open_timeout * 2 ** (self._trips - 1), self.max_open_timeout)
+        self._state = BreakerState.Open
+        self._open_until = now + timeout
+        self._consecutive_failures = 0
+        self._window.clear()
+        log.warning("circuit_open", model=self.name, retry_in_s=round(timeout, 1), trips=self._trips)
+
+    def _close(self) -> None:
+        self._state = BreakerState.Closed
+        self._trips = 0
+        self._consecutive_failures = 0
+        self._probes_in_flight = 0
+        self._window.clear()
+        log.info("circuit_closed", model=self.name)
+
+    # -------------------- 人工干预 --------------------
+    def force_open(self) -> None:
+        with self._lock:
+            self._forced = True
+            self._state = BreakerState.Open
+
+    def reset(self) -> None:
+        with self._lock:
+            self._forced = False
+            self._close()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            retry_in: Optional[float] = None
+            if state == BreakerState.Open and not self._forced:
+                retry_in = round(self._open_until - now, 1)
+            return {
+                "state": state.value,
+                "forced": self._forced,
+                "trips": self._trips,
+                "consecutive_failures": self._consecutive_failures,
+                "window_error_rate": round(sum(self._window) / len(self._window), 3) if self._window else 0.0,
+                "retry_in_s": retry_in,
+            }
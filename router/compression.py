@@ -0,0 +1,149 @@
+"""
+缓存值压缩与字节计量
+- 超过阈值的文本（或流式块列表）压缩后存放，读取时透明解压
+- zstd 需要 `pip install zstandard`，未安装退回标准库 zlib
+- value_nbytes 给出值在 CPython 里的真实占用（sys.getsizeof），用于按字节预算淘汰
+"""
+import json
+import sys
+import threading
+import zlib
+from typing import Any, Optional
+
+from router.log import get_logger
+
+log = get_logger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codec:
+    name = "none"
+    tag = b""  # 落盘时的一字节前缀，读的一方据此选解压器（与本进程配置无关）
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+    tag = b"z"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    tag = b"s"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+        self._local = threading.local()  # 压缩器/解压器不是线程安全的，每个线程一份
+
+    def _pair(self):
+        pair = getattr(self._local, "pair", None)
+        if pair is None:
+            pair = self._local.pair = (zstandard.ZstdCompressor(level=self.level), zstandard.ZstdDecompressor())
+        return pair
+
+    def compress(self, data: bytes) -> bytes:
+        # 返回的 bytes 底层仍是按 compressBound 分配的大缓冲区，拷一份才真正释放（getsizeof 看不出来）
+        return bytes(memoryview(self._pair()[0].compress(data)))
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._pair()[1].decompress(data)
+
+
+def create_codec(name: str) -> Optional[Codec]:
+    """none → None；zstd 未安装时退回 zlib"""
+    if name == "none":
+        return None
+    if name == "zstd":
+        if zstandard is not None:
+            return ZstdCodec()
+        log.warning("zstd_unavailable", fallback="zlib", hint="pip install zstandard")
+        return ZlibCodec()
+    if name == "zlib":
+        return ZlibCodec()
+    raise ValueError(f"Unknown compression '{name}', choose from ['none', 'zlib', 'zstd']")
+
+
+class Compressed:
+    """压缩后的缓存值；is_list 表示原值是流式块列表（JSON 编码后压缩）"""
+    __slots__ = ("codec", "data", "is_list", "raw_size")
+
+    def __init__(self, codec: Codec, data: bytes, is_list: bool, raw_size: int):
+        self.codec = codec
+        self.data = data
+        self.is_list = is_list
+        self.raw_size = raw_size
+
+
+def compress_value(value: Any, codec: Optional[Codec], threshold: int) -> Any:
+    """文本/块列表编码后超过 threshold 字节才压缩，压缩没变小就存原值"""
+    if codec is None or not isinstance(value, (str, list)):
+        return value
+    is_list = isinstance(value, list)
+    raw = (json.dumps(value, ensure_ascii=False) if is_list else value).encode("utf-8")
+    if len(raw) < threshold:
+        return value
+    data = codec.compress(raw)
+    if len(data) >= len(raw):
+        return value
+    return Compressed(codec, data, is_list, len(raw))
+
+
+def decompress_value(stored: Any) -> Any:
+    if not isinstance(stored, Compressed):
+        return stored
+    text = stored.codec.decompress(stored.data).decode("utf-8")
+    return json.loads(text) if stored.is_list else text
+
+
+# -------------------- 落盘（SQLite）用：JSON 文本或 前缀+压缩字节 --------------------
+_BY_TAG = {}
+
+
+def _codec_for_tag(tag: bytes) -> Codec:
+    codec = _BY_TAG.get(tag)
+    if codec is None:
+        codec = _BY_TAG[tag] = {b"z": ZlibCodec, b"s": ZstdCodec}[tag]()
+    return codec
+
+
+def pack_json(value: Any, codec: Optional[Codec], threshold: int):
+    """JSON 编码；超过阈值且压缩有收益时返回 tag + 压缩字节（bytes），否则返回 str"""
+    text = json.dumps(value, ensure_ascii=False)
+    raw = text.encode("utf-8")
+    if codec is None or len(raw) < threshold:
+        return text
+    data = codec.compress(raw)
+    return codec.tag + data if len(data) + 1 < len(raw) else text
+
+
+def unpack_json(stored) -> Any:
+    if isinstance(stored, bytes):
+        stored = _codec_for_tag(stored[:1]).decompress(stored[1:])
+    return json.loads(stored)
+
+
+def value_nbytes(stored: Any) -> int:
+    """值的真实内存占用（压缩值算压缩后的字节 + 包装对象）"""
+    if isinstance(stored, Compressed):
+        return sys.getsizeof(stored) + sys.getsizeof(stored.data)
+    if isinstance(stored, (list, tuple)):
+        return sys.getsizeof(stored) + sum(sys.getsizeof(v) for v in stored)
+    return sys.getsizeof(stored)
@@ -0,0 +1,194 @@
+"""
+语义缓存的向量化后端
+- openai:               OpenAI Embedding 接口（默认，每次查询一次网络往返，有备忘录兜着）
+- sentence_transformer: 从本地目录加载小模型（需安装 sentence-transformers，可选 onnx 后端）
+- hashing:              进程内字符 n-gram 哈希向量，纯 NumPy，离线可用，单条查询亚毫秒；
+                        只比字面不懂语义（"升序"/"降序" 相似度 0.98），只适合抓近似重复，
+                        生效阈值是 hashing_threshold（默认 0.99）而不是 threshold
+"""
+import sys
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from router.models import SemanticCacheConfig
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)  # 64 位黄金比例常数，打散 n-gram 哈希
+_PRIME = np.uint64(1000003)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    字符 n-gram 特征哈希（hashing trick），只用于近似重复检测，不是语义向量
+    - 文本 → UTF-32 码点数组，n-gram 哈希用滚动多项式在 NumPy 里整体计算
+    - 哈希高位决定维度、最低位决定符号（减少碰撞偏差），最后 L2 归一化
+    - 不依赖 Python hash()，跨进程/重启结果一致，可持久化
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: tuple = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批量编码，返回 (len(texts), dim) 的 float32 矩阵"""
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return out
+
+        # 所有文本拼成一条码点序列，row 记录每个码点属于哪条文本
+        encoded = [np.frombuffer(self._normalize(t).encode("utf-32-le"), dtype=np.uint32) for t in texts]
+        lengths = np.array([len(e) for e in encoded])
+        codes = np.concatenate(encoded).astype(np.uint64) if lengths.sum() else np.zeros(0, np.uint64)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+
+        lo, hi = self.ngram_range
+        with np.errstate(over="ignore"):  # uint64 溢出即取模，正是想要的
+            for n in range(lo, hi + 1):
+                if len(codes) < n:
+                    break
+                count = len(codes) - n + 1
+                h = np.zeros(count, dtype=np.uint64)
+                for j in range(n):
+                    h = h * _PRIME + codes[j:j + count]
+                # 跨文本边界的 n-gram 丢掉
+                valid = rows[:count] == rows[n - 1:]
+                h = (h[valid] + np.uint64(n)) * _MIX
+                h ^= h >> np.uint64(29)
+                cols = ((h >> np.uint64(1)) % np.uint64(self.dim)).astype(np.int64)
+                signs = np.where(h & np.uint64(1), 1.0, -1.0).astype(np.float32)
+                np.add.at(out, (rows[:count][valid], cols), signs)
+
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+    # 纯 CPU 且很快，直接同步算，省掉默认实现的线程池切换
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """本地 sentence-transformers 模型（目录或模型名），可选 backend='onnx'"""
+
+    def __init__(self, model_path: str, batch_size: int = 32, device: str = "cpu",
+                 backend: Optional[str] = None):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "embedding 'sentence_transformer' requires `pip install sentence-transformers`"
+            ) from e
+        kwargs = {"device": device}
+        if backend:
+            kwargs["backend"] = backend
+        self.model = SentenceTransformer(model_path, **kwargs)
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True).astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+class EmbeddingMemo:
+    """
+    查询向量备忘录：规范化文本 → float32 向量，LRU + 字节预算
+    同一条 query 查找和写入只算一次向量，热门问题重复出现也不再重算
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.bytes = 0
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # 只折叠空白：大小写对 sentence_transformer 等后端有意义，不能随便抹掉
+        return " ".join(text.split())
+
+    @staticmethod
+    def _size(key: str, vector: np.ndarray) -> int:
+        return sys.getsizeof(key) + vector.nbytes
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.normalize(text)
+        vector = self._items.get(key)
+        if vector is None:
+            self.miss_count += 1
+            return None
+        self._items.move_to_end(key)
+        self.hit_count += 1
+        return vector
+
+    def put(self, text: str, vector) -> np.ndarray:
+        key = self.normalize(text)
+        vector = np.array(vector, dtype=np.float32)  # 拷贝一份，调用方改不到缓存里的
+        vector.setflags(write=False)
+        size = self._size(key, vector)
+        if size > self.max_bytes:
+            return vector
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= self._size(key, old)
+        self._items[key] = vector
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            k, v = self._items.popitem(last=False)
+            self.bytes -= self._size(k, v)
+        return vector
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_stats(self) -> dict:
+        total = self.hit_count + self.miss_count
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hit_count": self.hit_count,
+            "miss_count": self.miss_count,
+            "hit_rate": f"{self.hit_count / total:.2%}" if total else "0.00%",
+        }
+
+
+def build_embeddings(config: SemanticCacheConfig) -> Embeddings:
+    """按配置创建向量化后端"""
+    if config.embedding == "hashing":
+        return HashingEmbeddings(dim=config.dim)
+    if config.embedding == "sentence_transformer":
+        if not config.model_path:
+            raise ValueError("semantic_cache.model_path is required for sentence_transformer")
+        return SentenceTransformerEmbeddings(config.model_path, batch_size=config.batch_size,
+                                             backend=config.backend)
+    if config.embedding == "openai":
+        from langchain_community.embeddings import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    raise ValueError(f"Unknown embedding backend '{config.embedding}', "
+                     f"choose from ['hashing', 'sentence_transformer', 'openai']")
@@ -1,18 +1,63 @@
-from typing import List
+import threading
+import time
+from typing import Dict, List, Tuple
 
 import yaml
 
-from router.models import Candidate, UserTier, RouterRule, RouterConfig
+from router.log import get_logger
+from router.models import Candidate, UserTier, RouterRule, RouterConfig, RouteDecision
+from router.rule_compiler import CompiledRule, RuleCompileError, build_context, compile_condition
+from router.stats import LatencyTracker
+from router.tokens import estimate_prompt_tokens
 import os
 #获取当前所在文件路径
 dir_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+log = get_logger(__name__)
+
+
+class ContextWindowError(ValueError):
+    """请求（估算提示 + 最大输出）超过了所有可用模型的上下文窗口"""
+
 
 class RouterEngine:
     def __init__(self,config_file:str="/config/router_config.yaml"):
         self.config_file=dir_path+config_file
         self.config: RouterConfig = self.load_config()
         self.candidates = self.get_all_candidates()
+        self._compile_rules()
+        scoring = self.config.scoring
+        # 实时延迟/错误率观测，先验取 YAML 画像延迟
+        self.stats = LatencyTracker({c.name: c.latency_ms for c in self.candidates},
+                                    alpha=scoring.ewma_alpha, window=scoring.window,
+                                    ttft_priors={c.name: c.ttft_ms for c in self.candidates},
+                                    half_life_s=scoring.decay_half_life_s)
+        # 路由决策表：(等级, 意图, 可用模型位图, 命中规则位图, 是否流式) → RouteDecision
+        self._model_bits: Dict[str, int] = {c.name: 1 << i for i, c in enumerate(self.candidates)}
+        self._decisions: Dict[Tuple[UserTier, str, int, int, bool], RouteDecision] = {}
+        self._table_lock = threading.Lock()
+        self.table_version = 0
+        self._table_built_at = time.monotonic()
+
+    def _compile_rules(self, config: RouterConfig = None) -> None:
+        # 规则条件启动时编译，写错或 pool 里有不存在的模型直接抛 RuleCompileError
+        config = config or self.config
+        models = {c.name for c in config.models.values()}
+        for rule in config.rules:
+            unknown = [m for m in rule.pool if m not in models]
+            if unknown:
+                raise RuleCompileError(f"rule '{rule.name}': unknown model(s) in pool {unknown}, "
+                                       f"configured: {sorted(models)}")
+        compiled = [(rule, compile_condition(rule.condition, rule.name)) for rule in config.rules]
+        self.compiled_rules: List[Tuple[RouterRule, CompiledRule]] = compiled
+        self._rule_fields = frozenset().union(*(c.fields for _, c in compiled))
+
+    def reload_config(self) -> None:
+        """重新读取 YAML 中的规则/权重/降级链（模型列表变更需要重启）；新规则编译不过时保留旧配置"""
+        config = self.load_config()
+        self._compile_rules(config)
+        self.config = config
+        self.invalidate()
 
     def load_config(self):
         with open(self.config_file, 'r', encoding='utf-8') as f:
@@ -37,45 +82,148 @@ class RouterEngine:
             ))
         return candidate
 
-    def caculation_score(self,candidate:Candidate,user_tier:UserTier,intent:str)->float:
+    def caculation_score(self,candidate:Candidate,user_tier:UserTier,intent:str,
+                         stream:bool=False)->float:
+        """
+        静态分 = 质量×权重 + 成本效益×权重 + 意图匹配×权重
+        实时系数 = (1 - 错误率EWMA) × min(1, 画像延迟/实测延迟EWMA) ^ 延迟权重
+        流式请求的延迟维度改看首 token：min(1, 画像TTFT/实测TTFT EWMA)
+        模型变慢或开始报错时分数先降，流量在它彻底挂掉前就转走
+        """
         quality_score = candidate.quality_score
         cost_score = 1 / (candidate.price_per_1k + 0.001)
         intent_score = 2.0 if intent in candidate.supported_intents else 0.
-        weights={UserTier.Premium:(0.6,0.2,0.2),
-                 UserTier.Basic:(0.4,0.4,0.2),
-                 UserTier.Free:(0.3,0.5,0.2)}
-        q_w,c_w,i_w=weights.get(user_tier)
-        score=quality_score*q_w+cost_score*c_w+intent_score*i_w
-        return score
-
-    def _evaluate_rule(self, rule: RouterRule, intent: str, user_tier: UserTier) -> bool:
-        cond = rule.condition
-        if "intent == 'medical'" in cond and intent == "medical":
-            return True
-        if "intent == 'code'" in cond and intent == "code":
-            return True
-        if "user_tier == 'free'" in cond and user_tier == UserTier.Free:  # ← 关键！
-            return True
-        return False
-
-    def select_model(self, candidates: List[Candidate], user_tier: UserTier, intent: str) -> str:
-        # 1. 先走规则池
-        for rule in self.config.rules:
-            if self._evaluate_rule(rule, intent, user_tier):
+        w = self.config.scoring.tier_weights[user_tier]
+        score=quality_score*w.quality+cost_score*w.cost+intent_score*w.intent
+
+        stats = self.stats.get(candidate.name)
+        if stream:
+            latency_score = min(1.0, candidate.ttft_ms / max(stats.ewma_ttft_ms, 1.0))
+        else:
+            latency_score = min(1.0, candidate.latency_ms / max(stats.ewma_latency_ms, 1.0))
+        return score * (1 - stats.ewma_error_rate) * latency_score ** w.latency
+
+    def select_model(self, candidates: List[Candidate], user_tier: UserTier, intent: str,
+                     query: str = "", max_tokens: int = 0) -> str:
+        """只在放得下 提示 + max_tokens 的模型里选"""
+        tokens = estimate_prompt_tokens(query) + max_tokens if query else max_tokens
+        return self.route(candidates, user_tier, intent, query, tokens=tokens).primary
+
+    @staticmethod
+    def fit_context(candidates: List[Candidate], tokens: int) -> List[Candidate]:
+        """上下文窗口过滤：tokens（提示 + 最大输出）放不下的模型去掉，全都放不下抛 ContextWindowError"""
+        if not tokens:
+            return candidates
+        fitting = [c for c in candidates if c.max_tokens is None or tokens <= c.max_tokens]
+        if candidates and not fitting:
+            largest = max(c.max_tokens for c in candidates)
+            raise ContextWindowError(f"request needs ~{tokens} tokens, exceeds the largest available "
+                                     f"context window ({largest})")
+        return fitting
+
+    # -------------------- 路由决策表 --------------------
+    def route(self, candidates: List[Candidate], user_tier: UserTier, intent: str,
+              query: str = "", stream: bool = False, tokens: int = 0) -> RouteDecision:
+        """
+        查表路由：结果只取决于等级、意图、哪些模型可用、命中了哪些规则
+        未命中时算一次分并写表；实时打分每 refresh_interval_s 秒整表失效一次
+        tokens（估算提示 + 最大输出）放不下的模型先过滤掉，不进可用位图，主模型和降级链都不会选到它
+        """
+        candidates = self.fit_context(candidates, tokens)
+        if time.monotonic() - self._table_built_at >= self.config.scoring.refresh_interval_s:
+            self.invalidate()
+        ctx = build_context(intent, user_tier, query, self._rule_fields)
+        rule_bits = 0
+        for i, (_, predicate) in enumerate(self.compiled_rules):
+            if predicate(ctx):
+                rule_bits |= 1 << i
+        model_bits = 0
+        for c in candidates:
+            model_bits |= self._model_bits.get(c.name, 0)
+
+        key = (UserTier(user_tier), intent, model_bits, rule_bits, stream)
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = self._decide(candidates, key[0], intent, rule_bits, stream)
+            with self._table_lock:
+                self._decisions[key] = decision
+            log.debug("route_table_miss", tier=key[0].value, intent=intent, stream=stream,
+                      primary=decision.primary, fallbacks=decision.fallbacks, rule=decision.rule)
+        return decision
+
+    def _decide(self, candidates: List[Candidate], user_tier: UserTier, intent: str,
+                rule_bits: int, stream: bool = False) -> RouteDecision:
+        if not candidates:
+            raise ValueError("no candidate models available")
+        # 1. 先走规则池：第一个命中且池内有可用模型的规则
+        pool = candidates
+        matched_rule = None
+        for i, (rule, _) in enumerate(self.compiled_rules):
+            if rule_bits & (1 << i):
                 pool_names = rule.pool or [c.name for c in candidates]
                 available = [c for c in candidates if c.name in pool_names]
                 if available:
-                    scored = [(c, self.caculation_score(c, user_tier, intent)) for c in available]
-                    return max(scored, key=lambda x: x[1])[0].name
+                    pool, matched_rule = available, rule.name
+                    break
 
         # 2. 无规则命中 → 全局打分
-        scored = [(c, self.caculation_score(c, user_tier, intent)) for c in candidates]
-        return max(scored, key=lambda x: x[1])[0].name
+        scored = [(c, self.caculation_score(c, user_tier, intent, stream)) for c in pool]
+        primary = max(scored, key=lambda x: x[1])[0].name
+        available_names = {c.name for c in candidates}
+        fallbacks = [m for m in self.config.fallback_chain if m != primary and m in available_names]
+        return RouteDecision(primary=primary, fallbacks=fallbacks, rule=matched_rule,
+                             version=self.table_version)
+
+    def invalidate(self) -> None:
+        """清空决策表（健康状态、配置或实时打分变化时调用）"""
+        with self._table_lock:
+            self._decisions.clear()
+            self.table_version += 1
+            self._table_built_at = time.monotonic()
+
+    def decision_table(self) -> Dict:
+        """决策表快照，供 /debug/route 查看"""
+        names = [c.name for c in self.candidates]
+        rules = [rule.name for rule, _ in self.compiled_rules]
+        with self._table_lock:
+            items = list(self._decisions.items())
+        return {
+            "version": self.table_version,
+            "age_s": round(time.monotonic() - self._table_built_at, 1),
+            "entries": [
+                {
+                    "user_tier": tier.value,
+                    "intent": intent,
+                    "available": [n for i, n in enumerate(names) if model_bits & (1 << i)],
+                    "matched_rules": [r for i, r in enumerate(rules) if rule_bits & (1 << i)],
+                    "stream": stream,
+                    **decision.model_dump(),
+                }
+                for (tier, intent, model_bits, rule_bits, stream), decision in items
+            ],
+        }
 
     def select_fallback_model(self)->list[str]:
-        print("fallback_chain",self.config.fallback_chain)
         fallback_chain=self.config.fallback_chain
+        log.debug("fallback_chain", chain=fallback_chain)
         return fallback_chain
 
+    def hedge_delay(self, model_name: str) -> float:
+        """模型的对冲延迟（秒）：按模型配置 > 实测 p95（含被对冲取消的下界样本）> 全局默认"""
+        hedging = self.config.hedging
+        if model_name in hedging.model_delay_ms:
+            return hedging.model_delay_ms[model_name] / 1000
+        stats = self.stats.get(model_name)
+        if hedging.adaptive and stats.sample_count >= hedging.min_samples:
+            return max(stats.percentile(95), hedging.min_delay_ms) / 1000
+        return hedging.delay_ms / 1000
+
+    def stream_timeouts(self, model_name: str) -> Tuple[float, float]:
+        """模型的 (首 token 截止, 块间卡顿超时)，单位秒：按模型配置 > 全局默认"""
+        streaming = self.config.streaming
+        ttft = streaming.model_ttft_timeout_ms.get(model_name, streaming.ttft_timeout_ms)
+        stall = streaming.model_stall_timeout_ms.get(model_name, streaming.stall_timeout_ms)
+        return ttft / 1000, stall / 1000
+
     def  get_price(self,model_name:str)->float:
         return self.config.models[model_name].price_per_1k
\ No newline at end of file
@@ -0,0 +1,395 @@
+"""
+缓存淘汰策略 + TTL 时间轮
+所有操作均为 O(1)（LFU 衰减、时间轮推进为均摊 O(1)），
+SmartCache 不再需要在锁内扫描/排序整个字典。
+"""
+import math
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+
+class EvictionPolicy:
+    """
+    淘汰策略接口：只记录 key 的顺序/频率，不保存值
+    - on_insert 返回需要被淘汰的 key 列表（可能包含新 key 本身，表示拒绝准入）
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+
+    def on_access(self, key: str) -> None:
+        raise NotImplementedError
+
+    def on_insert(self, key: str) -> List[str]:
+        raise NotImplementedError
+
+    def on_miss(self, key: str) -> None:
+        """未命中（不存在或已过期）；只有需要统计访问频率的策略关心"""
+
+    def on_remove(self, key: str) -> None:
+        raise NotImplementedError
+
+    def evict(self) -> Optional[str]:
+        """弹出一个淘汰候选（容量之外的额外淘汰，如按字节预算腾空间）"""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError
+
+
+class LRUPolicy(EvictionPolicy):
+    """最近最少使用：OrderedDict 头部最旧、尾部最新"""
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self._order: "OrderedDict[str, None]" = OrderedDict()
+
+    def on_access(self, key: str) -> None:
+        if key in self._order:
+            self._order.move_to_end(key)
+
+    def on_insert(self, key: str) -> List[str]:
+        if key in self._order:
+            self._order.move_to_end(key)
+            return []
+        self._order[key] = None
+        evicted = []
+        while len(self._order) > self.capacity:
+            evicted.append(self._order.popitem(last=False)[0])
+        return evicted
+
+    def on_remove(self, key: str) -> None:
+        self._order.pop(key, None)
+
+    def evict(self) -> Optional[str]:
+        if not self._order:
+            return None
+        return self._order.popitem(last=False)[0]
+
+    def clear(self) -> None:
+        self._order.clear()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._order
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    最不常用：频率桶 {freq: OrderedDict}，同频率内按 LRU 淘汰
+    aging_period 次操作后所有频率减半，避免历史热点永久霸占缓存
+    """
+
+    def __init__(self, capacity: int, aging_period: Optional[int] = None):
+        super().__init__(capacity)
+        self.aging_period = aging_period or self.capacity * 10
+        self._freq: Dict[str, int] = {}
+        self._buckets: Dict[int, "OrderedDict[str, None]"] = {}
+        self._min_freq = 0
+        self._ops = 0
+
+    def _bucket_add(self, key: str, freq: int) -> None:
+        bucket = self._buckets.get(freq)
+        if bucket is None:
+            bucket = self._buckets[freq] = OrderedDict()
+        bucket[key] = None
+
+    def _bucket_remove(self, key: str, freq: int) -> None:
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+
+    def _tick(self) -> None:
+        self._ops += 1
+        if self._ops >= self.aging_period:
+            self._age()
+
+    def _age(self) -> None:
+        """频率整体减半（均摊 O(1)：每 aging_period 次操作执行一次 O(n)）"""
+        self._ops = 0
+        buckets: Dict[int, "OrderedDict[str, None]"] = {}
+        for freq in sorted(self._buckets):
+            new_freq = max(1, freq // 2)
+            target = buckets.setdefault(new_freq, OrderedDict())
+            for key in self._buckets[freq]:
+                target[key] = None
+                self._freq[key] = new_freq
+        self._buckets = buckets
+        self._min_freq = min(buckets) if buckets else 0
+
+    def on_access(self, key: str) -> None:
+        freq = self._freq.get(key)
+        if freq is None:
+            return
+        self._bucket_remove(key, freq)
+        self._freq[key] = freq + 1
+        self._bucket_add(key, freq + 1)
+        if self._min_freq == freq and freq not in self._buckets:
+            self._min_freq = freq + 1
+        self._tick()
+
+    def on_insert(self, key: str) -> List[str]:
+        if key in self._freq:
+            self.on_access(key)
+            return []
+        evicted = []
+        while len(self._freq) >= self.capacity:
+            victim = self.evict()
+            if victim is None:
+                break
+            evicted.append(victim)
+        self._freq[key] = 1
+        self._bucket_add(key, 1)
+        self._min_freq = 1
+        self._tick()
+        return evicted
+
+    def on_remove(self, key: str) -> None:
+        freq = self._freq.pop(key, None)
+        if freq is None:
+            return
+        self._bucket_remove(key, freq)
+        # min_freq 失效时由 evict 惰性修正，删除本身保持 O(1)
+
+    def evict(self) -> Optional[str]:
+        if not self._freq:
+            return None
+        if self._min_freq not in self._buckets:
+            # 只有显式删除打断了 min_freq 时才会走到这里（桶数远小于条目数）
+            self._min_freq = min(self._buckets)
+        key = next(iter(self._buckets[self._min_freq]))
+        self.on_remove(key)
+        return key
+
+    def clear(self) -> None:
+        self._freq.clear()
+        self._buckets.clear()
+        self._min_freq = 0
+        self._ops = 0
+
+    def __len__(self) -> int:
+        return len(self._freq)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._freq
+
+
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class CountMinSketch:
+    """
+    频率草图：depth 行计数器，估计值取各行最小
+    计数上限 15（4bit 语义），总增量达到 sample_size 后全体减半（老化）
+    """
+
+    _SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, capacity: int, depth: int = 4):
+        width = 1 << max(4, math.ceil(math.log2(max(1, capacity))))
+        self._mask = width - 1
+        self._depth = min(depth, len(self._SEEDS))
+        self._rows = [bytearray(width) for _ in range(self._depth)]
+        self._additions = 0
+        self.sample_size = 10 * max(1, capacity)
+
+    def _indexes(self, key: str):
+        h = hash(key)
+        return [((h ^ seed) * 0x01000193 >> 7) & self._mask for seed in self._SEEDS[:self._depth]]
+
+    def increment(self, key: str) -> None:
+        added = False
+        for row, idx in zip(self._rows, self._indexes(key)):
+            if row[idx] < 15:
+                row[idx] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self.sample_size:
+                self._reset()
+
+    def frequency(self, key: str) -> int:
+        return min(row[idx] for row, idx in zip(self._rows, self._indexes(key)))
+
+    def _reset(self) -> None:
+        self._additions //= 2
+        for row in self._rows:
+            row[:] = row.translate(_HALVE)
+
+    def clear(self) -> None:
+        for row in self._rows:
+            row[:] = bytes(len(row))
+        self._additions = 0
+
+
+class WTinyLFUPolicy(EvictionPolicy):
+    """
+    W-TinyLFU：1% 窗口 LRU + 主区分段 LRU（20% 试用区 / 80% 保护区）
+    窗口淘汰出的候选与试用区队头比较草图频率，频率更高者留下
+    草图记的是访问频率：命中、未命中、写入都计数，被拒之门外的热 key 靠未命中攒频率，下次才进得来
+    对突发流量友好（窗口），又能挡住一次性查询污染主区（准入过滤）
+    """
+
+    def __init__(self, capacity: int, window_ratio: float = 0.01, protected_ratio: float = 0.8):
+        super().__init__(capacity)
+        self.window_capacity = max(1, int(self.capacity * window_ratio))
+        self.main_capacity = max(0, self.capacity - self.window_capacity)
+        self.protected_capacity = int(self.main_capacity * protected_ratio)
+        self._window: "OrderedDict[str, None]" = OrderedDict()
+        self._probation: "OrderedDict[str, None]" = OrderedDict()
+        self._protected: "OrderedDict[str, None]" = OrderedDict()
+        self.sketch = CountMinSketch(self.capacity)
+
+    def on_access(self, key: str) -> None:
+        self.sketch.increment(key)
+        if key in self._window:
+            self._window.move_to_end(key)
+        elif key in self._probation:
+            # 试用区再次命中 → 晋升保护区，保护区溢出的降回试用区尾部
+            del self._probation[key]
+            self._protected[key] = None
+            if len(self._protected) > self.protected_capacity:
+                demoted = self._protected.popitem(last=False)[0]
+                self._probation[demoted] = None
+        elif key in self._protected:
+            self._protected.move_to_end(key)
+
+    def on_insert(self, key: str) -> List[str]:
+        if key in self:
+            self.on_access(key)
+            return []
+        self.sketch.increment(key)
+        self._window[key] = None
+        if len(self._window) <= self.window_capacity:
+            return []
+
+        candidate = self._window.popitem(last=False)[0]
+        if len(self._probation) + len(self._protected) < self.main_capacity:
+            self._probation[candidate] = None
+            return []
+
+        victim_queue = self._probation if self._probation else self._protected
+        if not victim_queue:
+            return [candidate]
+        victim = next(iter(victim_queue))
+        if self.sketch.frequency(candidate) > self.sketch.frequency(victim):
+            del victim_queue[victim]
+            self._probation[candidate] = None
+            return [victim]
+        return [candidate]
+
+    def on_miss(self, key: str) -> None:
+        self.sketch.increment(key)
+
+    def on_remove(self, key: str) -> None:
+        for queue in (self._window, self._probation, self._protected):
+            if key in queue:
+                del queue[key]
+                return
+
+    def evict(self) -> Optional[str]:
+        for queue in (self._probation, self._window, self._protected):
+            if queue:
+                return queue.popitem(last=False)[0]
+        return None
+
+    def clear(self) -> None:
+        self._window.clear()
+        self._probation.clear()
+        self._protected.clear()
+        self.sketch.clear()
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._window or key in self._probation or key in self._protected
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "w_tinylfu": WTinyLFUPolicy,
+}
+
+
+def create_policy(name: str, capacity: int) -> EvictionPolicy:
+    """按名字创建淘汰策略，未知名字直接报错（启动即失败，避免静默退化）"""
+    try:
+        policy_cls = POLICIES[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown eviction policy '{name}', choose from {sorted(POLICIES)}")
+    return policy_cls(capacity)
+
+
+class TimerWheel:
+    """
+    TTL 时间轮：按 resolution 秒分桶，{tick: {key}}
+    schedule/cancel O(1)；advance 只访问已到期的桶
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+        self._buckets: Dict[int, Set[str]] = {}
+        self._key_tick: Dict[str, int] = {}
+        self._current_tick: Optional[int] = None
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.resolution)
+
+    def schedule(self, key: str, expires_at: float) -> None:
+        self.cancel(key)
+        tick = self._tick_of(expires_at)
+        if self._current_tick is not None and tick < self._current_tick:
+            tick = self._current_tick  # 已过期的放进当前桶，下次推进即回收
+        self._buckets.setdefault(tick, set()).add(key)
+        self._key_tick[key] = tick
+
+    def cancel(self, key: str) -> None:
+        tick = self._key_tick.pop(key, None)
+        if tick is None:
+            return
+        bucket = self._buckets.get(tick)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[tick]
+
+    def advance(self, now: float) -> List[str]:
+        """推进到 now，返回所有到期的 key（tick < 当前 tick 的桶）"""
+        now_tick = self._tick_of(now)
+        current = self._current_tick
+        if current is None or now_tick - current > len(self._buckets):
+            # 首次推进或长时间空闲：逐 tick 走比直接扫桶更贵，改为扫桶
+            due = [t for t in self._buckets if t < now_tick]
+        else:
+            due = [t for t in range(current, now_tick) if t in self._buckets]
+        self._current_tick = now_tick if current is None else max(current, now_tick)
+
+        expired: List[str] = []
+        for tick in due:
+            for key in self._buckets.pop(tick):
+                self._key_tick.pop(key, None)
+                expired.append(key)
+        return expired
+
+    def count_before(self, timestamp: float) -> int:
+        """timestamp 之前（按桶粒度）到期的 key 数，只遍历桶不遍历 key"""
+        tick = self._tick_of(timestamp)
+        return sum(len(bucket) for t, bucket in self._buckets.items() if t < tick)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+        self._key_tick.clear()
+
+    def __len__(self) -> int:
+        return len(self._key_tick)
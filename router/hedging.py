@@ -0,0 +1,64 @@
+"""
+对冲请求（hedged requests）
+主模型在对冲延迟内没有返回时，并行启动下一个候选；谁先成功用谁，其余取消
+max_parallel=1 时退化为原来的串行降级链
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+async def hedged_race(
+        candidates: List[str],
+        attempt: Callable[[str], Awaitable[Any]],
+        delay_for: Callable[[str], float],
+        max_parallel: int = 2,
+) -> Tuple[str, Any]:
+    """
+    :param candidates: 按优先级排好的模型名（主模型在前）
+    :param attempt: 对单个模型发起调用的协程函数，失败抛异常
+    :param delay_for: 模型名 → 对冲延迟（秒），超过即启动下一个候选
+    :param max_parallel: 同时在途的最大尝试数
+    :return: (成功的模型名, 结果)
+    """
+    if not candidates:
+        raise RuntimeError("no candidate models")
+
+    limit = max(1, max_parallel)
+    queue = list(candidates)
+    pending: Dict[asyncio.Task, str] = {}
+    last_launched = None
+    last_error: BaseException = RuntimeError("all candidate models failed")
+
+    def launch():
+        nonlocal last_launched
+        name = queue.pop(0)
+        pending[asyncio.ensure_future(attempt(name))] = name
+        last_launched = name
+
+    try:
+        launch()
+        while pending:
+            can_hedge = bool(queue) and len(pending) < limit
+            timeout = delay_for(last_launched) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # 对冲延迟到了还没人返回 → 并行拉起下一个候选
+                launch()
+                continue
+
+            for task in done:
+                name = pending.pop(task)
+                if task.exception() is None:
+                    return name, task.result()
+                last_error = task.exception()
+                # 有尝试失败：立刻补位，不再等对冲延迟
+                if queue and len(pending) < limit:
+                    launch()
+        raise last_error
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # 与赢家同一轮完成的失败尝试：取走异常，免得 "Task exception was never retrieved"
@@ -0,0 +1,82 @@
+"""
+上游 HTTP 连接池：同一 base_url 的所有模型客户端共用一个 httpx.AsyncClient
+- 连接数上限 / keep-alive / 超时 / HTTP2 读 YAML（http_pool 段）
+- 通过 httpcore 的 trace 扩展统计新建 TCP 连接和 TLS 握手次数，算出连接复用率
+"""
+from typing import Dict, Optional
+
+import httpx
+
+from router.log import get_logger
+from router.models import HttpPoolConfig
+
+log = get_logger(__name__)
+
+try:
+    import h2  # noqa: F401  HTTP/2 需要 `pip install h2`
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+
+class PoolStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0  # 新建 TCP 连接
+        self.tls_handshakes = 0
+
+    def snapshot(self) -> Dict:
+        reused = max(self.requests - self.connections, 0)
+        return {
+            "requests": self.requests,
+            "new_connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reuse_rate": f"{reused / self.requests:.2%}" if self.requests else "0.00%",
+        }
+
+
+class HttpPool:
+    def __init__(self, config: Optional[HttpPoolConfig] = None):
+        self.config = config or HttpPoolConfig()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, PoolStats] = {}
+        self.http2 = self.config.http2 and _HAS_H2
+        if self.config.http2 and not _HAS_H2:
+            log.warning("http2_unavailable", fallback="http/1.1", hint="pip install h2")
+
+    def client(self, base_url: Optional[str]) -> httpx.AsyncClient:
+        """按 base_url 取共享客户端，第一次用到时创建"""
+        key = base_url or "default"
+        client = self._clients.get(key)
+        if client is None:
+            cfg = self.config
+            stats = self._stats[key] = PoolStats()
+
+            async def trace(event: str, info: dict) -> None:
+                if event == "connection.connect_tcp.complete":
+                    stats.connections += 1
+                elif event == "connection.start_tls.complete":
+                    stats.tls_handshakes += 1
+
+            async def on_request(request: httpx.Request) -> None:
+                stats.requests += 1
+                request.extensions["trace"] = trace
+
+            client = self._clients[key] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=cfg.max_connections,
+                                    max_keepalive_connections=cfg.max_keepalive_connections,
+                                    keepalive_expiry=cfg.keepalive_expiry_s),
+                timeout=httpx.Timeout(cfg.read_timeout_s, connect=cfg.connect_timeout_s,
+                                      pool=cfg.pool_timeout_s),
+                event_hooks={"request": [on_request]},
+            )
+        return client
+
+    def get_stats(self) -> Dict[str, Dict]:
+        return {key: stats.snapshot() for key, stats in self._stats.items()}
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
@@ -1,9 +1,39 @@
 import re
-from typing import Dict
+from typing import Dict, List, Optional, Pattern, Tuple
+
+
+# 纯字面分支（转义只允许非字母数字，如 C\+\+），可以安全转小写
+_LITERAL = re.compile(r'(?:[^\\.^$*+?{}\[\]()|]|\\[^A-Za-z0-9])+')
+_LITERAL_PREFIX = re.compile(r'[^\\.^$*+?{}\[\]()|]|\\[^A-Za-z0-9]')
+
+
+def _split_branches(pattern: str) -> List[str]:
+    """按顶层 | 拆分支（跳过转义、字符类和分组内部的 |）"""
+    branches, depth, in_class, start, i = [], 0, False, 0, 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if in_class:
+            in_class = ch != ']'
+        elif ch == '[':
+            in_class = True
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == '|' and depth == 0:
+            branches.append(pattern[start:i])
+            start = i + 1
+        i += 1
+    branches.append(pattern[start:])
+    return branches
 
 
 class IntentRouter:
     def __init__(self):
+        # 字典顺序即优先级：同时命中多个意图时取靠前的
         self.intent_patterns = {
             "medical": [
                 r'诊断|治疗|症状|医院|医生|手术|药品|疾病|疫情|头疼|发热|痛|难受',
@@ -22,14 +52,78 @@ class IntentRouter:
                 r'紧急|救命|危险|火灾|地震|急救|报警|火'
             ]
         }
-        # 预编译加速
-        self._cache = {k: [p.split('|') for p in v]
-                       for k, v in self.intent_patterns.items()}
+        self._names: List[str] = list(self.intent_patterns)
+        self._priority: Dict[str, int] = {name: i for i, name in enumerate(self._names)}
+        self._compile()
+
+    def _compile(self):
+        """
+        预编译：把所有模式拆成顶层分支，按优先级拼成一条正则
+        - 以字面字符开头的分支（关键词、代码块、def/class）拼在一起：
+          不用分组、不用 re.I（输入已转小写，关键词也转小写），
+          re 引擎可以用首字符集合快速跳过不可能命中的位置
+        - 不以字面字符开头的分支（如连续汉字）每个意图单独一条，按需再查
+        _matchers[k] 只包含前 k 个意图，用于命中后只搜更高优先级的意图
+        """
+        literal_branches: Dict[str, List[str]] = {name: [] for name in self._names}
+        self._other: List[Tuple[str, Pattern]] = []
+        for name in self._names:
+            others = []
+            for pattern in self.intent_patterns[name]:
+                for branch in _split_branches(pattern):
+                    if _LITERAL.fullmatch(branch):
+                        literal_branches[name].append(branch.lower())
+                    elif _LITERAL_PREFIX.match(branch):
+                        literal_branches[name].append(branch)
+                    else:
+                        others.append(branch)
+            if others:
+                self._other.append((name, re.compile('|'.join(others))))
+
+        self._by_intent: Dict[str, Pattern] = {
+            name: re.compile('|'.join(branches)) for name, branches in literal_branches.items() if branches
+        }
+        self._matchers: List[Optional[Pattern]] = [None]
+        for k in range(1, len(self._names) + 1):
+            branches = [b for name in self._names[:k] for b in literal_branches[name]]
+            self._matchers.append(re.compile('|'.join(branches)) if branches else None)
 
     def predict(self, text: str) -> str:
+        """
+        单遍匹配：用合成正则找最左命中，之后只在该位置之后搜索优先级更高的意图，
+        最多搜索"意图数"次（通常一次），结果与逐条 re.search 按优先级取第一个一致
+        """
         text_lower = text.lower()
-        for intent, patterns in self.intent_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text_lower, re.I):
-                    return intent
-        return "general"
+        best = len(self._names)  # general
+        pos = 0
+        while best > 0:
+            matcher = self._matchers[best]
+            m = matcher.search(text_lower, pos) if matcher is not None else None
+            if m is None:
+                break
+            # 同一位置按优先级确认是哪个意图的分支（只在命中时做，最多几次 match）
+            for i, name in enumerate(self._names[:best]):
+                regex = self._by_intent.get(name)
+                if regex is not None and regex.match(text_lower, m.start()):
+                    best = i
+                    break
+            pos = m.start() + 1
+
+        for name, regex in self._other:
+            if self._priority[name] >= best:
+                break
+            if regex.search(text_lower):
+                best = self._priority[name]
+                break
+        return self._names[best] if best < len(self._names) else "general"
+
+    def predict_batch(self, texts: List[str]) -> List[str]:
+        """批量识别，相同文本只算一次"""
+        seen: Dict[str, str] = {}
+        results = []
+        for text in texts:
+            intent = seen.get(text)
+            if intent is None:
+                intent = seen[text] = self.predict(text)
+            results.append(intent)
+        return results
@@ -0,0 +1,79 @@
+"""
+结构化日志：一行一个事件，event + 键值字段
+- format=json：{"ts": ..., "level": ..., "logger": ..., "event": ..., 字段...}，便于日志系统检索
+- format=text：本地调试用，`时间 级别 logger event k=v ...`
+用法：log = get_logger(__name__); log.info("cache_cleanup", expired=12, remaining=300)
+字段只在对应级别开启时才格式化，关掉 debug 后热路径上的 debug 调用只剩一次级别判断
+"""
+import json
+import logging
+import time
+from typing import Any
+
+_FIELDS = "fields"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, _FIELDS, {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, _FIELDS, {}).items())
+        stamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        line = f"{stamp} {record.levelname:<7} {record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructLogger:
+    __slots__ = ("_logger",)
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, event: str, fields: dict, exc_info: bool = False) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={_FIELDS: fields}, exc_info=exc_info)
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info: bool = False, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields, exc_info)
+
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(name)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json") -> None:
+    """给 router / main 的 logger 挂一个 stderr handler（重复调用只换格式和级别）"""
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    for name in ("router", "main", "__main__"):
+        logger = logging.getLogger(name)
+        logger.setLevel(level.upper())
+        logger.propagate = False
+        handler = next((h for h in logger.handlers if getattr(h, "_router_handler", False)), None)
+        if handler is None:
+            handler = logging.StreamHandler()
+            handler._router_handler = True
+            logger.addHandler(handler)
+        handler.setFormatter(formatter)
@@ -1,30 +1,140 @@
-from typing import List, Dict
+import asyncio
+import time
+from typing import List, Dict, Optional, Tuple
 from config.llm_config import MODEL_MAP
 from router.engine import RouterEngine
-from router.models import Candidate
+from router.circuit_breaker import CircuitBreaker
+from router.hedging import hedged_race
+from router.http_pool import HttpPool
+from router.log import get_logger
+from router.metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from router.rate_limiter import ModelRateLimiter, RateLimitedError
+from router.models import Candidate, TokenUsage
+from router.tokens import estimate_prompt_tokens, estimate_tokens, usage_from
+
+log = get_logger(__name__)
 
 class ModelService:
     def __init__(self, candidates: List[Candidate],engine: RouterEngine):
         self.candidates = candidates
-        self.health: Dict[str, bool] = {c.name: True for c in candidates}
         self.engine=engine
+        # 上游连接池：同一 base_url 共用，客户端第一次调用时才创建
+        self.http_pool = HttpPool(engine.config.http_pool)
+        MODEL_MAP.use_pool(self.http_pool)
+        cb = engine.config.circuit_breaker
+        self.breakers: Dict[str, CircuitBreaker] = {
+            c.name: CircuitBreaker(
+                c.name,
+                failure_threshold=cb.failure_threshold,
+                error_rate_threshold=cb.error_rate_threshold,
+                window_size=cb.window_size,
+                min_requests=cb.min_requests,
+                open_timeout=cb.open_timeout_s,
+                max_open_timeout=cb.max_open_timeout_s,
+                half_open_max_calls=cb.half_open_max_calls,
+                success_threshold=cb.success_threshold,
+            ) for c in candidates
+        }
+        rl = engine.config.rate_limit
+        self.limiters: Dict[str, ModelRateLimiter] = {
+            c.name: ModelRateLimiter(c.name, c.max_rpm, c.max_tpm, rl.burst_seconds)
+            for c in candidates
+        } if rl.enabled else {}
+        # 批量接口的按厂商并发上限，第一次用到时创建
+        self.providers: Dict[str, str] = {c.name: c.provider or c.name for c in candidates}
+        self._provider_sems: Dict[str, asyncio.Semaphore] = {}
+        self._provider_limits: Dict[str, int] = {}
     # -------------------- 1. 健康列表 --------------------
     def get_available(self) -> List[Candidate]:
-        return [c for c in self.candidates if self.health.get(c.name, True)]
+        """熔断器未打开（half_open 且还有探测名额的也算）且未限流饱和的模型"""
+        return [c for c in self.candidates
+                if self.breakers[c.name].is_available() and self._has_capacity(c.name)]
+
+    def _has_capacity(self, name: str) -> bool:
+        limiter = self.limiters.get(name)
+        return limiter is None or limiter.has_capacity()
+
+    def limiter_states(self) -> Dict[str, Dict]:
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
 
     def set_health(self, name: str, healthy: bool):
-        if name in self.health:
-            self.health[name] = healthy
+        """人工干预：healthy=False 强制熔断，True 立即恢复"""
+        if name in self.breakers:
+            if healthy:
+                self.breakers[name].reset()
+            else:
+                self.breakers[name].force_open()
+            self.engine.invalidate()
+
+    def breaker_states(self) -> Dict[str, Dict]:
+        return {name: b.snapshot() for name, b in self.breakers.items()}
+
+    def pool_stats(self) -> Dict[str, Dict]:
+        """按 base_url 的连接复用情况（新建连接 / TLS 握手 / 复用率）"""
+        return self.http_pool.get_stats()
+
+    def start_warmup(self) -> None:
+        """后台线程里预建模型客户端（含导入 langchain_openai），首个请求不用等"""
+        def build():
+            for c in self.candidates:
+                if c.name in MODEL_MAP:
+                    MODEL_MAP[c.name]
+
+        async def warmup():
+            try:
+                await asyncio.to_thread(build)
+            except Exception as e:
+                log.warning("model_warmup_failed", error=str(e))  # 首次调用时再创建
+
+        self._warmup_task = asyncio.ensure_future(warmup())
+
+    async def aclose(self) -> None:
+        await self.http_pool.aclose()
+
+    def _acquire(self, name: str, tokens: int) -> CircuitBreaker:
+        """熔断打开或限流饱和直接拒绝，不发请求、不计入延迟统计"""
+        breaker = self.breakers[name]
+        if not breaker.allow_request():
+            UPSTREAM_REQUESTS.inc((name, "circuit_open"))
+            raise RuntimeError(f"Model '{name}' circuit is open")
+        limiter = self.limiters.get(name)
+        if limiter is not None and not limiter.try_acquire(tokens):
+            breaker.release()
+            UPSTREAM_REQUESTS.inc((name, "rate_limited"))
+            raise RateLimitedError(f"Model '{name}' is rate limited locally")
+        return breaker
+
+    @staticmethod
+    def _observe(name: str, outcome: str, start: float) -> None:
+        """上游调用指标：次数 + 耗时，按模型和结果（ok / error / cancelled）"""
+        labels = (name, outcome)
+        UPSTREAM_REQUESTS.inc(labels)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, labels)
+
+    @staticmethod
+    def _estimate_tokens(query: str, max_tokens: int) -> int:
+        """本次请求最多消耗的 tokens（估算提示 + 最大输出），TPM 按它预占，调用结束后按实际用量修正"""
+        return estimate_prompt_tokens(query) + max_tokens
+
+    def _settle(self, name: str, reserved: int, usage: TokenUsage) -> None:
+        limiter = self.limiters.get(name)
+        if limiter is not None:
+            limiter.settle(reserved, usage.total_tokens)
 
     # -------------------- 2. 真调用 --------------------
-    async def call(self, name: str, query: str, max_tokens: int) -> str:
+    async def call(self, name: str, query: str, max_tokens: int) -> Tuple[str, TokenUsage]:
         """
-        直接返回模型文本，失败抛 RuntimeError（供降级链捕获）
+        返回 (模型文本, 用量)，失败抛 RuntimeError（供降级链捕获）
+        用量取上游的 usage_metadata，没有就按提示和回答估算
         """
+        reserved = self._estimate_tokens(query, max_tokens)
+        breaker = self._acquire(name, reserved)
         client = MODEL_MAP[name]
+        start = time.perf_counter()
         try:
 
-            response=client.ainvoke(query, max_tokens=max_tokens).content
+            message = await client.ainvoke(query, max_tokens=max_tokens)
+            response = message.content
             if hasattr(response, "text"):
                 text=response.text
             else:
@@ -32,27 +142,158 @@ class ModelService:
             if not text:
                 raise RuntimeError(f"Model {name} returned empty response")
 
-
-            return text
+            usage = usage_from(message) or TokenUsage(input_tokens=estimate_prompt_tokens(query),
+                                                       output_tokens=estimate_tokens(text), estimated=True)
+            usage.model = name
+            self._settle(name, reserved, usage)
+            self.engine.stats.record(name, (time.perf_counter() - start) * 1000, ok=True)
+            breaker.record_success()
+            self._observe(name, "ok", start)
+            return text, usage
+        except asyncio.CancelledError:
+            breaker.release()  # 对冲落败被取消，不算失败
+            # 耗时是下界：不记的话慢请求都被对冲取消，p95 只剩快的，对冲延迟会越压越低
+            self.engine.stats.record_censored(name, (time.perf_counter() - start) * 1000)
+            self._observe(name, "cancelled", start)
+            raise
         except Exception as e:
+            self.engine.stats.record(name, (time.perf_counter() - start) * 1000, ok=False)
+            breaker.record_failure()
+            self._observe(name, "error", start)
             error_msg = f"Model '{name}' call failed: {str(e)}"
 
             raise   RuntimeError(error_msg) from e
-    async def steam_call(self, name: str, query: str, max_tokens: int) -> str:
+    def provider_semaphore(self, name: str) -> asyncio.Semaphore:
+        provider = self.providers.get(name, name)
+        sem = self._provider_sems.get(provider)
+        if sem is None:
+            batch = self.engine.config.batch
+            limit = batch.provider_concurrency.get(provider, batch.default_provider_concurrency)
+            sem = self._provider_sems[provider] = asyncio.Semaphore(limit)
+            self._provider_limits[provider] = limit
+        return sem
+
+    async def bulk_call(self, name: str, query: str, max_tokens: int) -> Tuple[str, TokenUsage]:
+        """批量接口用：先拿厂商并发名额再调用（排队时间不计入该模型的延迟统计）"""
+        async with self.provider_semaphore(name):
+            return await self.call(name, query, max_tokens)
+
+    def provider_states(self) -> Dict[str, Dict]:
+        """各厂商批量并发名额：上限 / 占用中"""
+        return {provider: {"limit": self._provider_limits[provider],
+                           "in_use": self._provider_limits[provider] - sem._value}
+                for provider, sem in self._provider_sems.items()}
+
+    async def call_with_fallback(self, names: List[str], query: str, max_tokens: int,
+                                 bulk: bool = False) -> Tuple[str, str, TokenUsage]:
+        """
+        沿降级链调用，返回 (实际模型, 文本, 用量)
+        开启对冲时，慢的模型超过对冲延迟会并行拉起下一个候选，先成功者胜出
+        bulk=True 时每次调用受厂商并发上限约束
+        """
+        hedging = self.engine.config.hedging
+        max_parallel = hedging.max_parallel if hedging.enabled else 1
+        call = self.bulk_call if bulk else self.call
+        name, (text, usage) = await hedged_race(
+            names,
+            lambda name: call(name, query, max_tokens),
+            self.engine.hedge_delay,
+            max_parallel=max_parallel,
+        )
+        return name, text, usage
+
+    async def steam_call(self, name: str, query: str, max_tokens: int,
+                         usage: Optional[TokenUsage] = None) -> str:
         """
         异步流式返回生成内容
+        首个非空块超过 TTFT 截止时间、或任意两块之间超过卡顿超时，按失败处理（计入熔断/统计）
+        传入 usage 时，流正常结束后填入实际用量（stream_usage：上游在最后一块带 usage）
         """
+        reserved = self._estimate_tokens(query, max_tokens)
+        breaker = self._acquire(name, reserved)
         client = MODEL_MAP[name]
+        ttft_timeout, stall_timeout = self.engine.stream_timeouts(name)
+        start = time.perf_counter()
+        stream = client.astream(query, max_tokens=max_tokens, stream_usage=True).__aiter__()
+        first = True
+        reported = None
+        output = []
         try:
-            async for chunk in client.astream(query,max_tokens=max_tokens):
+            while True:
+                timeout = stall_timeout
+                if first:
+                    timeout = min(stall_timeout, max(ttft_timeout - (time.perf_counter() - start), 0.0))
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    what = "first token" if first else "next chunk"
+                    raise RuntimeError(f"no {what} within {timeout * 1000:.0f}ms") from None
                 #适配Langchain的消息块格式
                 content=chunk.content if hasattr(chunk, "content") else chunk
+                reported = usage_from(chunk) or reported
+                if first and content:
+                    first = False
+                    self.engine.stats.record_ttft(name, (time.perf_counter() - start) * 1000)
+                if content:
+                    output.append(content)
                 yield  content
+            final = reported or TokenUsage(input_tokens=estimate_prompt_tokens(query),
+                                           output_tokens=estimate_tokens("".join(output)), estimated=True)
+            final.model = name
+            self._settle(name, reserved, final)
+            if usage is not None:
+                for field in TokenUsage.model_fields:
+                    setattr(usage, field, getattr(final, field))
+            self.engine.stats.record(name, (time.perf_counter() - start) * 1000, ok=True)
+            breaker.record_success()
+            self._observe(name, "ok", start)
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release()  # 客户端断开
+            self.engine.stats.record_censored(name, (time.perf_counter() - start) * 1000)
+            self._observe(name, "cancelled", start)
+            raise
         except Exception as e:
+            self.engine.stats.record(name, (time.perf_counter() - start) * 1000, ok=False)
+            breaker.record_failure()
+            self._observe(name, "error", start)
             error_msg = f"Model '{name}' call failed: {str(e)}"
 
             raise   RuntimeError(error_msg) from e
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def stream_with_fallback(self, names: List[str], query: str, max_tokens: int,
+                                   usage: Optional[TokenUsage] = None):
+        """
+        沿降级链流式调用：在第一个字节发给客户端之前失败（熔断/限流/TTFT 超时/卡顿/报错）
+        就换下一个模型；已经输出内容后再失败只能中断，不能换（客户端会收到重复内容）
+        usage 在流正常结束后填入实际模型和用量
+        """
+        last_error = None
+        for name in names:
+            started = False
+            try:
+                async for content in self.steam_call(name, query, max_tokens, usage):
+                    if not content:
+                        continue  # 开头的空块（如只有 role 的块）不算首字节
+                    started = True
+                    yield content
+                if started:
+                    return
+                last_error = RuntimeError(f"Model '{name}' returned empty stream")
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+            log.warning("stream_failover", model=name, error=str(last_error))  # 首字节前失败，换下一个模型
+        raise RuntimeError(f"all candidate models failed: {last_error}")
+
     # -------------------- 3. 真价格（2025-07 官网）--------------------
     def calc_cost(self, name: str, tokens: int) -> float:
+        """tokens 传实际用量（TokenUsage.total_tokens），不是请求的 max_tokens"""
         price_per_1k = self.engine.get_price(model_name= name)  # ← 读 YAML！
         return price_per_1k * tokens / 1000
\ No newline at end of file
@@ -1,7 +1,7 @@
 import time
 from typing import List, Dict, Any, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 from enum import Enum
 class UserTier(str,Enum):
@@ -20,6 +20,35 @@ class ChatResponse(BaseModel):
     cost: float
     latency: float
     intent: Optional[str] = None
+    queue_ms: float = 0.0  # 排队等上游槽位的时间，latency 里包含它；缓存命中为 0
+
+class TokenUsage(BaseModel):
+    """一次上游调用的 token 用量；estimated=True 表示上游没返回 usage，用的本地估算"""
+    model: Optional[str] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    estimated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+
+class BatchItemResult(BaseModel):
+    """批量结果的一项：index 对应请求在 requests 里的下标，失败时 response 为空"""
+    index: int
+    status: int = 200
+    response: Optional[ChatResponse] = None
+    error: Optional[str] = None
+    deduped: bool = False  # 与前面某条缓存键相同，共用了一次计算
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchItemResult]  # 按完成顺序
+    unique: int  # 去重后实际处理的条数
+    total_cost: float
+    latency: float
 
 class Candidate(BaseModel):
     name: str
@@ -27,6 +56,19 @@ class Candidate(BaseModel):
     quality_score: float  # 质量评分 0-1
     supported_intents: List[str]  # 支持的意图
     max_rpm: int  # 最大请求数/分钟
+    latency_ms: int = 1000  # 画像延迟，无实时观测时作为先验
+    ttft_ms: int = 500  # 画像首 token 延迟（流式），同样作为先验
+    max_tpm: Optional[int] = None  # 最大 tokens/分钟，不填不限
+    provider: Optional[str] = None  # 所属厂商，批量接口按厂商限制并发；不填视为独立厂商
+    max_tokens: Optional[int] = None  # 上下文窗口（提示 + 输出），放不下的请求不会路由到它；不填不限
+class RouteDecision(BaseModel):
+    """一次路由的结论：主模型 + 有序降级列表（决策表的值）"""
+    primary: str
+    fallbacks: List[str] = Field(default_factory=list)
+    rule: Optional[str] = None  # 命中的规则名，None 表示全局打分
+    version: int = 0  # 生成时的决策表版本
+
+
 class RouterRule(BaseModel):
     """路由规则（比 Dict 更安全）"""
     name: str
@@ -34,21 +76,195 @@ class RouterRule(BaseModel):
     pool: List[str]
 
 
+class L2CacheConfig(BaseModel):
+    """L2 磁盘缓存：长 TTL 的答案落盘，重启不丢，容量远大于内存"""
+    enabled: bool = False
+    path: str = "data/cache_l2.sqlite3"  # 相对项目根目录
+    min_ttl: int = 6 * 3600  # TTL 不低于这个才写 L2（code 24h / math 12h）
+    max_items: int = 1000000
+    max_mb: float = 1024  # 值的总大小上限
+    mmap_mb: int = 256
+    compact_interval: int = 3600  # 清过期 + 归还空闲页的间隔（秒）
+
+
+class CacheConfig(BaseModel):
+    """精确缓存配置"""
+    max_size: int = 5000
+    default_ttl: int = 1800
+    policy: str = "w_tinylfu"  # lru / lfu / w_tinylfu（sqlite 后端只支持 lru / lfu）
+    cleanup_interval: int = 600
+    backend: str = "memory"  # memory：进程内；sqlite：同机多 worker 共享
+    sqlite_path: str = "data/cache.sqlite3"  # 相对项目根目录
+    sqlite_mmap_mb: int = 64
+    max_mb: Optional[float] = None  # 内存字节预算（MB），不设则只按 max_size 条数限制
+    compression: str = "zstd"  # none / zlib / zstd（未安装 zstandard 退回 zlib）
+    compress_threshold: int = 2048  # 值编码后超过这么多字节才压缩
+    l2: L2CacheConfig = Field(default_factory=L2CacheConfig)
+
+
+class HedgingConfig(BaseModel):
+    """对冲请求配置：主模型超过对冲延迟未返回就并行拉起下一个候选"""
+    enabled: bool = False
+    delay_ms: int = 2000  # 默认对冲延迟
+    max_parallel: int = 2  # 同时在途的最大尝试数
+    model_delay_ms: Dict[str, int] = Field(default_factory=dict)  # 按模型覆盖
+    adaptive: bool = True  # 样本足够时用实测 p95 作为对冲延迟
+    min_samples: int = 20
+    min_delay_ms: int = 200
+
+
+class StreamingConfig(BaseModel):
+    """流式调用的首 token（TTFT）截止时间和块间卡顿超时；首个字节发给客户端之前超时就换下一个模型"""
+    ttft_timeout_ms: int = 5000
+    stall_timeout_ms: int = 15000
+    model_ttft_timeout_ms: Dict[str, int] = Field(default_factory=dict)  # 按模型覆盖
+    model_stall_timeout_ms: Dict[str, int] = Field(default_factory=dict)
+
+
+class BatchConfig(BaseModel):
+    """批量接口：单批上限、按厂商（Candidate.provider）的上游并发上限"""
+    max_items: int = 500
+    default_provider_concurrency: int = 8
+    provider_concurrency: Dict[str, int] = Field(default_factory=dict)  # 按厂商覆盖
+
+
+class TierAdmission(BaseModel):
+    """单个用户等级的准入参数"""
+    weight: float = Field(gt=0)  # 加权公平出队的权重，槽位紧张时按权重比例分配
+    queue_size: int = Field(ge=0)  # 排队上限，满了直接 429
+    max_wait_ms: int = Field(ge=0)  # 排队截止时间，预计或实际等待超过它就 503
+
+
+def _default_tier_admission() -> Dict[UserTier, TierAdmission]:
+    return {
+        UserTier.Premium: TierAdmission(weight=8, queue_size=256, max_wait_ms=10000),
+        UserTier.Basic: TierAdmission(weight=3, queue_size=256, max_wait_ms=5000),
+        UserTier.Free: TierAdmission(weight=1, queue_size=128, max_wait_ms=2000),
+    }
+
+
+class AdmissionConfig(BaseModel):
+    """上游准入：全局在途上限 + 按用户等级的有界队列，槽位空出来时加权公平出队"""
+    enabled: bool = True
+    max_concurrency: int = 64  # 同时在途的上游调用（含流式）
+    service_time_ms: int = 1000  # 单次上游占用时间的先验，有样本后用 EWMA，用于预估排队时间
+    tiers: Dict[UserTier, TierAdmission] = Field(default_factory=_default_tier_admission)
+
+    @field_validator("tiers")
+    @classmethod
+    def _fill_tiers(cls, tiers: Dict[UserTier, TierAdmission]) -> Dict[UserTier, TierAdmission]:
+        """YAML 里只写了部分等级时，其余等级用默认参数，保证每个等级都有队列"""
+        return {**_default_tier_admission(), **tiers}
+
+
+class HttpPoolConfig(BaseModel):
+    """上游连接池：同一 base_url 的模型共用一个 httpx.AsyncClient"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry_s: float = 60.0  # 空闲连接保留时间，热路径上不重复 TLS 握手
+    connect_timeout_s: float = 5.0
+    read_timeout_s: float = 60.0
+    pool_timeout_s: float = 5.0  # 等空闲连接的最长时间
+    http2: bool = True  # 需要安装 h2，未安装退回 HTTP/1.1
+
+
+class TierWeights(BaseModel):
+    """打分权重：质量 / 成本 / 意图匹配 / 延迟"""
+    quality: float
+    cost: float
+    intent: float
+    latency: float = 0.0
+
+
+def _default_tier_weights() -> Dict[UserTier, TierWeights]:
+    return {
+        UserTier.Premium: TierWeights(quality=0.6, cost=0.2, intent=0.2, latency=1.0),
+        UserTier.Basic: TierWeights(quality=0.4, cost=0.4, intent=0.2, latency=0.7),
+        UserTier.Free: TierWeights(quality=0.3, cost=0.5, intent=0.2, latency=0.4),
+    }
+
+
+class ScoringConfig(BaseModel):
+    """实时观测打分配置"""
+    ewma_alpha: float = 0.2  # EWMA 平滑系数，越大越敏感
+    window: int = 256  # 分位数滑动窗口大小
+    decay_half_life_s: float = 300.0  # 没有新观测时 EWMA 回落到先验的半衰期，0 不衰减
+    refresh_interval_s: float = 5.0  # 路由决策表按实时打分重建的间隔
+    tier_weights: Dict[UserTier, TierWeights] = Field(default_factory=_default_tier_weights)
+
+
+class CircuitBreakerConfig(BaseModel):
+    """熔断器配置（每个模型一个熔断器）"""
+    failure_threshold: int = 5  # 连续失败多少次熔断
+    error_rate_threshold: float = 0.5  # 窗口错误率阈值
+    window_size: int = 20
+    min_requests: int = 10  # 窗口内至少多少请求才按错误率判断
+    open_timeout_s: float = 5.0  # 首次熔断冷却时间，之后指数退避
+    max_open_timeout_s: float = 300.0
+    half_open_max_calls: int = 1  # 半开状态允许的并发探测数
+    success_threshold: int = 1  # 探测成功多少次恢复
+
+
+class RateLimitConfig(BaseModel):
+    """按模型 max_rpm / max_tpm 本地限流"""
+    enabled: bool = True
+    burst_seconds: float = 1.0  # 允许的突发量 = 每秒速率 × burst_seconds
+
+
+class LoggingConfig(BaseModel):
+    """结构化日志：json 一行一个事件，text 便于本地看"""
+    level: str = "INFO"
+    format: str = "json"  # json / text
+
+
+class SemanticCacheConfig(BaseModel):
+    """语义缓存配置"""
+    threshold: float = 0.95  # 相似度阈值
+    embedding: str = "openai"  # openai / sentence_transformer / hashing
+    hashing_threshold: float = 0.99  # hashing 只比字面，用更严的阈值，只命中近似重复
+    dim: int = 512  # hashing 向量维度
+    model_path: Optional[str] = None  # sentence_transformer 本地模型目录
+    backend: Optional[str] = None  # sentence_transformer 推理后端，如 onnx
+    batch_size: int = 32
+    persist_dir: Optional[str] = None  # 快照 + 追加日志目录，不填则只在内存
+    snapshot_interval_s: int = 600
+    max_entries: int = 50000  # 所有分区合计的条数上限
+    policy: str = "lru"  # 超限淘汰策略：lru / lfu / w_tinylfu
+    default_ttl: int = 3600  # 不在意图 TTL 表里的意图用这个
+    memo_mb: float = 16  # query → 向量备忘录的内存预算（MB）
+
+    def match_threshold(self) -> float:
+        """实际生效的命中阈值：hashing 后端用 hashing_threshold"""
+        return self.hashing_threshold if self.embedding == "hashing" else self.threshold
+
+
 class RouterConfig(BaseModel):
     """完整的路由配置（YAML 结构）"""
     models: Dict[str, Candidate]
     default_model: str
     fallback_chain: List[str] = Field(default_factory=list)
     rules: List[RouterRule] = Field(default_factory=list)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    hedging: HedgingConfig = Field(default_factory=HedgingConfig)
+    streaming: StreamingConfig = Field(default_factory=StreamingConfig)
+    http_pool: HttpPoolConfig = Field(default_factory=HttpPoolConfig)
+    batch: BatchConfig = Field(default_factory=BatchConfig)
+    admission: AdmissionConfig = Field(default_factory=AdmissionConfig)
+    logging: LoggingConfig = Field(default_factory=LoggingConfig)
+    scoring: ScoringConfig = Field(default_factory=ScoringConfig)
+    circuit_breaker: CircuitBreakerConfig = Field(default_factory=CircuitBreakerConfig)
+    rate_limit: RateLimitConfig = Field(default_factory=RateLimitConfig)
+    semantic_cache: SemanticCacheConfig = Field(default_factory=SemanticCacheConfig)
 
 class CacheItem(BaseModel):
     values: Any
     expires_at: float
     created_at: float
     access_count: int=0
+    size: int=0  # 该项占用的字节数（键 + 值 + 簿记开销），按字节预算淘汰用
 
     def is_expired(self) -> bool:
         return self.expires_at < time.time()
 
     def time_until_expiration(self) -> float:
-        return max(0, self.expire_at - time.time())
+        return max(0, self.expires_at - time.time())
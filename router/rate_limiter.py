@@ -0,0 +1,145 @@
+"""
+按模型限流：RPM 用 GCRA（通用信元速率算法），TPM 用令牌桶
+在本地就拒掉注定会被供应商 429 的请求，路由转向下一个候选
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+
+class RateLimitedError(RuntimeError):
+    """模型已达 RPM/TPM 上限（本地拒绝，没有发出请求）"""
+
+
+class GCRA:
+    """
+    GCRA：只维护一个"理论到达时间" tat，O(1) 且无需后台补充令牌
+    rate_per_min 为稳态速率，burst 为允许的瞬时突发请求数
+    """
+
+    def __init__(self, rate_per_min: float, burst: int = 1):
+        self.rate_per_min = rate_per_min
+        self.burst = max(1, burst)
+        self.emission_interval = 60.0 / rate_per_min
+        self.tolerance = self.emission_interval * (self.burst - 1)
+        self._tat = 0.0
+
+    def _allowed_at(self, now: float) -> float:
+        return max(self._tat, now) - self.tolerance
+
+    def has_capacity(self, now: float) -> bool:
+        return self._allowed_at(now) <= now
+
+    def try_acquire(self, now: float) -> bool:
+        if not self.has_capacity(now):
+            return False
+        self._tat = max(self._tat, now) + self.emission_interval
+        return True
+
+    def refund(self) -> None:
+        self._tat -= self.emission_interval
+
+    def retry_after(self, now: float) -> float:
+        return max(0.0, self._allowed_at(now) - now)
+
+    def remaining(self, now: float) -> int:
+        used = max(0.0, self._tat - now) / self.emission_interval
+        return max(0, int(self.burst - math.ceil(used)))
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 refill_per_sec，按需惰性补充"""
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_sec)
+            self._updated = now
+
+    def has_capacity(self, amount: float, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= min(amount, self.capacity)
+
+    def try_acquire(self, amount: float, now: float) -> bool:
+        if not self.has_capacity(amount, now):
+            return False
+        # 超过桶容量的大请求只要桶满就放行，否则永远发不出去
+        self._tokens -= min(amount, self.capacity)
+        return True
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正预占：delta > 0 退回多扣的，< 0 补扣（可以欠账，之后补充时先还上）"""
+        self._tokens = min(self.capacity, self._tokens + delta)
+
+    def retry_after(self, amount: float, now: float) -> float:
+        self._refill(now)
+        missing = min(amount, self.capacity) - self._tokens
+        return max(0.0, missing / self.refill_per_sec)
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class ModelRateLimiter:
+    """单个模型的 RPM + 可选 TPM 限流，两者都满足才放行"""
+
+    def __init__(self, name: str, max_rpm: int, max_tpm: Optional[int] = None, burst_seconds: float = 1.0):
+        self.name = name
+        self.rpm = GCRA(max_rpm, burst=math.ceil(max_rpm / 60 * burst_seconds)) if max_rpm > 0 else None
+        self.tpm = TokenBucket(max_tpm, max_tpm / 60) if max_tpm else None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def has_capacity(self, tokens: int = 0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self.rpm is not None and not self.rpm.has_capacity(now):
+                return False
+            return self.tpm is None or self.tpm.has_capacity(tokens, now)
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self.rpm is not None and not self.rpm.try_acquire(now):
+                self.rejected += 1
+                return False
+            if self.tpm is not None and not self.tpm.try_acquire(tokens, now):
+                if self.rpm is not None:
+                    self.rpm.refund()
+                self.rejected += 1
+                return False
+            return True
+
+    def settle(self, reserved: int, actual: int) -> None:
+        """调用结束后按上游返回的实际 tokens 修正 TPM 预占（预占用的是估算值）"""
+        if self.tpm is None:
+            return
+        with self._lock:
+            self.tpm.adjust(min(reserved, self.tpm.capacity) - actual)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            state: Dict = {"rejected": self.rejected}
+            if self.rpm is not None:
+                state["rpm"] = {
+                    "limit": self.rpm.rate_per_min,
+                    "burst": self.rpm.burst,
+                    "remaining_burst": self.rpm.remaining(now),
+                    "retry_after_s": round(self.rpm.retry_after(now), 3),
+                }
+            if self.tpm is not None:
+                self.tpm.has_capacity(0, now)
+                state["tpm"] = {
+                    "limit": self.tpm.capacity,
+                    "available_tokens": int(self.tpm.tokens),
+                }
+            return state
@@ -0,0 +1,210 @@
+"""
+路由规则条件编译器
+YAML 里的 condition（如 "intent == 'code' and user_tier in ['free', 'basic']"）
+在加载时用 ast 解析成闭包，只允许白名单里的字段和运算，写错直接启动失败
+
+可用字段：intent / user_tier（别名 tier）/ query_length / language
+可用运算：and / or / not / == / != / in / not in / < / <= / > / >=
+比较两边的类型在编译期检查（query_length 只能和数字比，其余字段只能和字符串比），不会等到请求时才 TypeError
+"""
+import ast
+import operator
+import re
+from typing import Any, Callable, Dict, FrozenSet, List, Set
+
+from router.models import UserTier
+
+RuleContext = Dict[str, Any]
+Predicate = Callable[[RuleContext], bool]
+
+FIELDS = {"intent", "user_tier", "query_length", "language"}
+_NUMBER = "number"
+_STRING = "string"
+FIELD_TYPES = {"intent": _STRING, "user_tier": _STRING, "query_length": _NUMBER, "language": _STRING}
+ALIASES = {"tier": "user_tier"}
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+_TIER_VALUES = {t.value for t in UserTier}
+
+_CJK = re.compile(r'[\u4e00-\u9fff]')
+_KANA = re.compile(r'[\u3040-\u30ff]')
+_HANGUL = re.compile(r'[\uac00-\ud7af]')
+
+
+def detect_language(text: str) -> str:
+    """粗粒度语言识别：日文假名 > 韩文 > 中文 > 其他按英文"""
+    if _KANA.search(text):
+        return "ja"
+    if _HANGUL.search(text):
+        return "ko"
+    if _CJK.search(text):
+        return "zh"
+    return "en"
+
+
+class RuleCompileError(ValueError):
+    """规则条件不合法（语法错误、未知字段、不支持的运算）"""
+
+
+class CompiledRule:
+    def __init__(self, condition: str, predicate: Predicate, fields: FrozenSet[str]):
+        self.condition = condition
+        self.predicate = predicate
+        self.fields = fields  # 条件引用到的字段，用于按需计算上下文
+
+    def __call__(self, ctx: RuleContext) -> bool:
+        return self.predicate(ctx)
+
+
+class _Compiler:
+    def __init__(self, rule_name: str):
+        self.rule_name = rule_name
+        self.fields: Set[str] = set()
+
+    def fail(self, msg: str):
+        raise RuleCompileError(f"rule '{self.rule_name}': {msg}")
+
+    def compile(self, node: ast.AST) -> Predicate:
+        if isinstance(node, ast.BoolOp):
+            parts = [self.compile(v) for v in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda ctx: all(p(ctx) for p in parts)
+            return lambda ctx: any(p(ctx) for p in parts)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            inner = self.compile(node.operand)
+            return lambda ctx: not inner(ctx)
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+        if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+            value = node.value
+            return lambda ctx: value
+        self.fail(f"unsupported expression '{ast.unparse(node)}'")
+
+    def _compare(self, node: ast.Compare) -> Predicate:
+        # a < b < c 拆成 (a < b) and (b < c)
+        checks: List[Predicate] = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            fn = _COMPARE_OPS.get(type(op))
+            if fn is None:
+                self.fail(f"unsupported operator '{type(op).__name__}'")
+            l_operand, r_operand = self._operand(left), self._operand(right)
+            self._check_types(op, l_operand, r_operand, node)
+            checks.append(self._binary(fn, l_operand, r_operand))
+            left = right
+        if len(checks) == 1:
+            return checks[0]
+        return lambda ctx: all(c(ctx) for c in checks)
+
+    @staticmethod
+    def _kind(value) -> str:
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return "other"
+        return _STRING if isinstance(value, str) else _NUMBER
+
+    def _check_types(self, op: ast.cmpop, left, right, node: ast.Compare) -> None:
+        """字段和常量 / 字段和字段的类型要对得上；集合只能出现在 in / not in 右边，元素类型要与字段一致"""
+        (l_const, l_val), (r_const, r_val) = left, right
+        text = ast.unparse(node)
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if r_const and not isinstance(r_val, frozenset):
+                # 字段 in 'abc' 是子串判断，只对字符串字段有意义
+                if self._kind(r_val) != _STRING or (not l_const and FIELD_TYPES[l_val] != _STRING):
+                    self.fail(f"'in' needs a list or a string field/literal on the right: '{text}'")
+                return
+            if not r_const:
+                if FIELD_TYPES[r_val] != _STRING:
+                    self.fail(f"'{r_val}' is a number, cannot be used with 'in': '{text}'")
+                if (self._kind(l_val) if l_const else FIELD_TYPES[l_val]) != _STRING:
+                    self.fail(f"substring check needs a string on the left: '{text}'")
+                return
+            kinds = {self._kind(v) for v in r_val}
+            expected = self._kind(l_val) if l_const else FIELD_TYPES[l_val]
+            if kinds - {expected}:
+                self.fail(f"list items must be {expected}s to compare with "
+                          f"'{l_val if not l_const else repr(l_val)}': '{text}'")
+            return
+        if (l_const and isinstance(l_val, frozenset)) or (r_const and isinstance(r_val, frozenset)):
+            self.fail(f"lists can only be used with 'in' / 'not in': '{text}'")
+        l_kind = self._kind(l_val) if l_const else FIELD_TYPES[l_val]
+        r_kind = self._kind(r_val) if r_const else FIELD_TYPES[r_val]
+        if l_kind != r_kind:
+            self.fail(f"cannot compare {l_kind} with {r_kind}: '{text}'")
+
+    @staticmethod
+    def _binary(fn, left, right) -> Predicate:
+        # 常量在编译期求值，热路径只剩一次取字段和一次比较
+        (l_const, l_val), (r_const, r_val) = left, right
+        if not l_const and r_const:
+            return lambda ctx: fn(ctx[l_val], r_val)
+        if l_const and not r_const:
+            return lambda ctx: fn(l_val, ctx[r_val])
+        if not l_const and not r_const:
+            return lambda ctx: fn(ctx[l_val], ctx[r_val])
+        result = fn(l_val, r_val)
+        return lambda ctx: result
+
+    def _operand(self, node: ast.AST):
+        """返回 (是否常量, 常量值或字段名)"""
+        if isinstance(node, ast.Name):
+            name = ALIASES.get(node.id, node.id)
+            if name not in FIELDS:
+                self.fail(f"unknown field '{node.id}', allowed: {sorted(FIELDS | set(ALIASES))}")
+            self.fields.add(name)
+            return False, name
+        if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float)):
+            return True, node.value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            values = []
+            for elt in node.elts:
+                if not (isinstance(elt, ast.Constant) and isinstance(elt.value, (str, int, float))):
+                    self.fail(f"collection items must be literals: '{ast.unparse(node)}'")
+                values.append(elt.value)
+            return True, frozenset(values)
+        self.fail(f"unsupported operand '{ast.unparse(node)}'")
+
+    def check_tier_literals(self, tree: ast.AST) -> None:
+        """user_tier 只能和已知等级比较，写成 'Free' / 'vip' 之类直接报错"""
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Compare):
+                continue
+            operands = [node.left] + list(node.comparators)
+            if not any(isinstance(o, ast.Name) and ALIASES.get(o.id, o.id) == "user_tier" for o in operands):
+                continue
+            for o in operands:
+                literals = [o] if isinstance(o, ast.Constant) else getattr(o, "elts", [])
+                for lit in literals:
+                    if isinstance(lit, ast.Constant) and lit.value not in _TIER_VALUES:
+                        self.fail(f"unknown user_tier '{lit.value}', allowed: {sorted(_TIER_VALUES)}")
+
+
+def compile_condition(condition: str, rule_name: str = "<rule>") -> CompiledRule:
+    """把条件字符串编译成 CompiledRule，非法条件抛 RuleCompileError"""
+    compiler = _Compiler(rule_name)
+    try:
+        tree = ast.parse(condition.strip(), mode="eval")
+    except SyntaxError as e:
+        raise RuleCompileError(f"rule '{rule_name}': invalid condition '{condition}': {e.msg}") from e
+    compiler.check_tier_literals(tree)
+    predicate = compiler.compile(tree.body)
+    return CompiledRule(condition, predicate, frozenset(compiler.fields))
+
+
+def build_context(intent: str, user_tier: UserTier, query: str, fields: FrozenSet[str]) -> RuleContext:
+    """构造规则上下文，只计算规则里用到的字段"""
+    ctx: RuleContext = {"intent": intent, "user_tier": UserTier(user_tier).value}
+    if "query_length" in fields:
+        ctx["query_length"] = len(query)
+    if "language" in fields:
+        ctx["language"] = detect_language(query)
+    return ctx
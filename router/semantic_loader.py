@@ -0,0 +1,93 @@
+"""
+语义缓存后台加载
+faiss / langchain / 向量化模型 / 持久化快照加载都比较重，放在线程里做，服务先开始接流量；
+加载完成前语义缓存当作未命中、写入直接跳过，精确缓存和模型调用不受影响
+"""
+import asyncio
+import time
+from typing import Optional
+
+from router.log import get_logger
+from router.models import SemanticCacheConfig
+
+log = get_logger(__name__)
+
+
+class BackgroundSemanticMatcher:
+    """与 SemanticMatcherFAISS 接口一致的代理，加载完成后转发"""
+
+    def __init__(self, config: SemanticCacheConfig, persist_dir: Optional[str] = None):
+        self.config = config
+        self.persist_dir = persist_dir
+        self._matcher = None
+        self._task: Optional[asyncio.Task] = None
+        self.status = "pending"  # pending / loading / ready / failed
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._matcher is not None
+
+    def _build(self):
+        # 只在这里导入重依赖
+        from router.embeddings import build_embeddings
+        from router.semantic_utils import SemanticMatcherFAISS
+
+        cfg = self.config
+        return SemanticMatcherFAISS(embeddings=build_embeddings(cfg),
+                                    threshold=cfg.match_threshold(),
+                                    persist_dir=self.persist_dir,
+                                    max_entries=cfg.max_entries,
+                                    policy=cfg.policy,
+                                    default_ttl=cfg.default_ttl,
+                                    memo_bytes=int(cfg.memo_mb * 1024 * 1024))
+
+    def start(self) -> None:
+        """后台加载，完成后启动定期快照"""
+        if self._task is not None:
+            return
+
+        async def load():
+            self.status = "loading"
+            start = time.perf_counter()
+            try:
+                matcher = await asyncio.to_thread(self._build)
+            except Exception as e:
+                self.status, self.error = "failed", str(e)
+                log.error("semantic_cache_load_failed", exc_info=True, error=str(e))  # 仅使用精确缓存
+                return
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            self._matcher, self.status = matcher, "ready"
+            matcher.start_snapshot_task(interval=self.config.snapshot_interval_s)
+            log.info("semantic_cache_ready", load_seconds=self.load_seconds)
+
+        self._task = asyncio.ensure_future(load())
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        if self._task is not None:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        return self.ready
+
+    async def afind_match(self, query: str, intent: Optional[str] = None, user_tier=None) -> Optional[str]:
+        if self._matcher is None:
+            return None
+        return await self._matcher.afind_match(query, intent, user_tier)
+
+    async def aadd(self, query: str, result: str, intent: Optional[str] = None, user_tier=None) -> None:
+        if self._matcher is not None:
+            await self._matcher.aadd(query, result, intent, user_tier)
+
+    def get_stats(self) -> dict:
+        stats = {"status": self.status, "load_seconds": self.load_seconds}
+        if self.error:
+            stats["error"] = self.error
+        if self._matcher is not None:
+            stats.update(self._matcher.get_stats())
+        return stats
+
+    async def aclose(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self._matcher is not None:
+            await self._matcher.aclose()
@@ -1,12 +1,343 @@
 # semantic_cache.py
 import asyncio
-from typing import Optional, List
+import base64
+import json
+import math
+import os
+import re
+import time
+import uuid
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
-from langchain_community.embeddings import OpenAIEmbeddings
-from dotenv import load_dotenv
-load_dotenv()
+
+from router.cache import INTENT_TTL
+from router.embeddings import EmbeddingMemo
+from router.eviction import TimerWheel, create_policy
+from router.log import get_logger
+from router.metrics import stage_timer
+
+log = get_logger(__name__)
+
+try:
+    import fcntl  # 多 worker 共用同一目录时的文件锁（Windows 下退化为单进程）
+except ImportError:
+    fcntl = None
+
+# 只读 mmap 打开快照：多个 worker 共享同一份物理页，启动无需把向量读进内存
+# 老版本 faiss 没有 IO_FLAG_MMAP_IFC，退化为普通读取
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+# 检索时多取几条，跳过已删除/已过期的；这一批全无效就放大 _WIDEN 倍再找，直到翻完整个库
+_FETCH_K = 4
+_WIDEN = 4
+# 增量里的墓碑多于有效条数（且不少于这个数）时重建增量，均摊到每次删除是 O(1)
+_COMPACT_MIN = 1024
+
+
+def _relevance(distance: float) -> float:
+    """L2 距离 → 相关度，与 langchain FAISS 默认的欧氏相关度一致（向量已归一化）"""
+    return 1.0 - distance / math.sqrt(2)
+
+
+def _is_live(meta: dict, now: float) -> bool:
+    return meta.get("expires_at", math.inf) > now
+
+
+class PersistentFAISSStore:
+    """
+    可持久化的 FAISS 向量库 = 只读快照（mmap）+ 内存增量 + 追加日志
+    - 快照：index.faiss + docs.json，启动时 mmap 打开，近乎零拷贝
+    - 增量：快照之后的写入，放在内存 FAISS 里，同时追加到 wal.jsonl
+    - 删除：只记墓碑（O(1)，不动 faiss 索引），日志里记一条删除；快照时真正清掉，
+      增量里的墓碑过半时也会就地重建增量
+    - 启动时先 mmap 快照，再重放 wal.jsonl；snapshot() 把日志合并进新快照（剔除已删除/已过期）并清空日志
+    - 给了 writer 时追加日志提交到该执行器（单线程，顺序与调用顺序一致），事件循环上不拿文件锁
+    - 加载只发生在构造时：snapshot() / maybe_reload() 返回重新加载的新对象，由调用方整体替换，
+      已发布的对象不会被原地重建，检索不需要加锁
+    注意：mmap 打开的索引不可写（faiss 会直接 abort），所有写入只进增量
+    每条记录的 metadata 带 id（全局唯一）和 expires_at（绝对时间戳）
+    """
+
+    INDEX_FILE = "index.faiss"
+    DOCS_FILE = "docs.json"
+    LOG_FILE = "wal.jsonl"
+    LOCK_FILE = ".lock"
+
+    def __init__(self, embeddings: Embeddings, persist_dir: Optional[str] = None,
+                 writer: Optional[Executor] = None):
+        self.embeddings = embeddings
+        self.persist_dir = persist_dir
+        self._writer = writer
+        self._base: Optional[FAISS] = None  # 只读快照
+        self._delta: Optional[FAISS] = None  # 快照之后的写入
+        self._base_ids: Set[str] = set()
+        self._delta_ids: Set[str] = set()
+        self._deleted: Set[str] = set()  # 已删除的 id（墓碑），快照和增量共用
+        self._delta_dead = 0  # 墓碑里属于增量的条数
+        self._base_version: Optional[Tuple[int, int]] = None  # 快照文件 (inode, mtime)，判断别的 worker 是否换了快照
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            self.load()
+
+    # -------------------- 文件 --------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(self.LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _snapshot_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._path(self.INDEX_FILE))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _read_log(self) -> Tuple[List[Tuple[str, dict, np.ndarray]], Set[str]]:
+        """返回 (新增记录, 删除的 id)"""
+        entries, deleted = [], set()
+        try:
+            with open(self._path(self.LOG_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if "d" in record:
+                            deleted.add(record["d"])
+                            continue
+                        vector = np.frombuffer(base64.b64decode(record["v"]), dtype=np.float32)
+                    except (ValueError, KeyError):
+                        continue  # 进程崩溃时写了一半的行，跳过
+                    entries.append((record["q"], record["m"], vector))
+        except FileNotFoundError:
+            pass
+        return entries, deleted
+
+    def _append_log(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._file_lock():
+            with open(self._path(self.LOG_FILE), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _append_behind(self, record: dict) -> None:
+        try:
+            self._append_log(record)
+        except Exception as e:
+            log.warning("semantic_wal_append_failed", partition=os.path.basename(self.persist_dir), error=str(e))
+
+    def _log(self, record: dict) -> None:
+        if not self.persist_dir:
+            return
+        if self._writer is None:
+            self._append_log(record)
+        else:
+            self._writer.submit(self._append_behind, record)
+
+    # -------------------- 内存结构 --------------------
+    def _build_store(self, index, docs: List[dict]) -> FAISS:
+        """用现成的 faiss 索引 + 元数据列表（与向量同序）构造 langchain FAISS"""
+        ids = [meta["id"] for meta in docs]
+        docstore = InMemoryDocstore({
+            doc_id: Document(page_content=meta.get("original_query", ""), metadata=meta)
+            for doc_id, meta in zip(ids, docs)
+        })
+        return FAISS(self.embeddings, index, docstore, dict(enumerate(ids)))
+
+    def _add_to_delta(self, items: List[Tuple[str, dict, np.ndarray]]) -> None:
+        if not items:
+            return
+        if self._delta is None:
+            dim = len(items[0][2])
+            self._delta = FAISS(self.embeddings, faiss.IndexFlatL2(dim), InMemoryDocstore(), {})
+        ids = [m["id"] for _, m, _ in items]
+        self._delta.add_embeddings(
+            [(q, v.tolist()) for q, _, v in items],
+            metadatas=[m for _, m, _ in items],
+            ids=ids,
+        )
+        self._delta_ids.update(ids)
+
+    def _delete_from_memory(self, doc_ids: Set[str]) -> None:
+        """只记墓碑，不调 faiss 删除（IndexFlat remove_ids 和 langchain 的重新编号都是 O(n)）"""
+        for doc_id in doc_ids:
+            if doc_id in self._deleted:
+                continue
+            if doc_id in self._delta_ids:
+                self._delta_dead += 1
+            elif doc_id not in self._base_ids:
+                continue
+            self._deleted.add(doc_id)
+        if self._delta_dead > max(_COMPACT_MIN, len(self._delta_ids) - self._delta_dead):
+            self._compact_delta()
+
+    def _compact_delta(self) -> None:
+        """丢掉增量里的墓碑重建增量（快照是 mmap 只读的，它的墓碑等下次快照再清）"""
+        old = self._delta
+        keep = [(i, doc_id) for i, doc_id in old.index_to_docstore_id.items() if doc_id not in self._deleted]
+        index = faiss.IndexFlatL2(old.index.d)
+        if keep:
+            vectors = old.index.reconstruct_n(0, old.index.ntotal)
+            index.add(np.ascontiguousarray(vectors[[i for i, _ in keep]], dtype=np.float32))
+        self._delta = self._build_store(index, [old.docstore.search(doc_id).metadata for _, doc_id in keep])
+        self._deleted -= self._delta_ids
+        self._delta_ids = {doc_id for _, doc_id in keep}
+        self._delta_dead = 0
+
+    def load(self) -> None:
+        """mmap 打开快照，并重放快照之后的追加日志（只在构造时调用，对象发布后不再原地重建）"""
+        with self._file_lock():
+            version = self._snapshot_version()
+            base = None
+            if version is not None:
+                index = faiss.read_index(self._path(self.INDEX_FILE), _MMAP_FLAGS)
+                with open(self._path(self.DOCS_FILE), "r", encoding="utf-8") as f:
+                    base = self._build_store(index, json.load(f))
+            entries, deleted = self._read_log()
+        self._base, self._base_version, self._delta, self._deleted = base, version, None, set()
+        self._base_ids = set(base.index_to_docstore_id.values()) if base else set()
+        self._delta_ids, self._delta_dead = set(), 0
+        self._add_to_delta(entries)
+        self._delete_from_memory(deleted)
+        log.info("semantic_partition_loaded", partition=os.path.basename(self.persist_dir),
+                 snapshot=len(self._base.index_to_docstore_id) if base else 0, replayed=len(entries),
+                 deleted=len(deleted))
+
+    def _reopen(self) -> "PersistentFAISSStore":
+        return PersistentFAISSStore(self.embeddings, self.persist_dir, self._writer)
+
+    def maybe_reload(self) -> Optional["PersistentFAISSStore"]:
+        """其他 worker 生成了新快照时，返回重新加载的新对象；没变返回 None"""
+        if self.persist_dir and self._snapshot_version() != self._base_version:
+            return self._reopen()
+        return None
+
+    # -------------------- 读写 --------------------
+    def add(self, query: str, vector, metadata: dict) -> None:
+        vec = np.asarray(vector, dtype=np.float32)
+        self._add_to_delta([(query, metadata, vec)])
+        if self.persist_dir:
+            self._log({"q": query, "m": metadata, "v": base64.b64encode(vec.tobytes()).decode("ascii")})
+
+    def delete(self, doc_id: str) -> None:
+        self._delete_from_memory({doc_id})
+        self._log({"d": doc_id})
+
+    def search(self, vector, now: float) -> Optional[Tuple[Document, float]]:
+        """在快照和增量里各找最近的一条（跳过已删除、已过期的），返回 (文档, 相关度)"""
+        best: Optional[Tuple[Document, float]] = None
+        query = np.asarray([vector], dtype=np.float32)
+        for store, dead in ((self._delta, self._delta_dead), (self._base, len(self._deleted) - self._delta_dead)):
+            if store is None or store.index.ntotal == 0 or store.index.d != len(vector):
+                continue
+            found = self._nearest(store, query, now, _FETCH_K + dead)
+            if found is not None:
+                relevance = _relevance(found[1])
+                if best is None or relevance > best[1]:
+                    best = (found[0], relevance)
+        return best
+
+    def _nearest(self, store: FAISS, query: np.ndarray, now: float, k: int) -> Optional[Tuple[Document, float]]:
+        """
+        该库里最近的一条有效记录：先取 k 条（已按墓碑数放大），结果按距离升序，第一条有效的就是最近的
+        这一批全是过期的就放大 k 再找，直到翻完整个库
+        """
+        total, seen = store.index.ntotal, 0
+        while True:
+            k = min(k, total)
+            distances, positions = store.index.search(query, k)
+            for distance, pos in zip(distances[0][seen:], positions[0][seen:]):
+                if pos < 0:
+                    continue
+                doc_id = store.index_to_docstore_id[pos]
+                if doc_id in self._deleted:
+                    continue
+                doc = store.docstore.search(doc_id)
+                if _is_live(doc.metadata, now):
+                    return doc, float(distance)
+            if k >= total:
+                return None
+            seen, k = k, k * _WIDEN
+
+    def entries(self) -> List[dict]:
+        """所有未删除记录的 metadata（含已过期的，由调用方回收）"""
+        metas = []
+        for store in (self._base, self._delta):
+            if store is None:
+                continue
+            for doc_id in store.index_to_docstore_id.values():
+                if doc_id not in self._deleted:
+                    metas.append(store.docstore.search(doc_id).metadata)
+        return metas
+
+    def __len__(self) -> int:
+        return sum(s.index.ntotal for s in (self._base, self._delta) if s is not None) - len(self._deleted)
+
+    # -------------------- 快照 --------------------
+    def snapshot(self) -> Optional["PersistentFAISSStore"]:
+        """
+        把磁盘上的快照 + 追加日志合并成新快照（原子替换），然后清空日志，返回按新快照加载的新对象
+        以磁盘为准而不是内存：多个 worker 各自写的日志都会被合并进去
+        已删除、已过期的记录在这一步真正清掉；没有可合并的内容返回 None
+        与追加日志在同一个写线程里跑，提交在前的日志一定已经落盘
+        """
+        if not self.persist_dir:
+            return None
+        with self._file_lock():
+            entries, deleted = self._read_log()
+            if not entries and not deleted:
+                return None
+            now = time.time()
+            vectors, docs = [], []
+            if self._snapshot_version() is not None:
+                old = faiss.read_index(self._path(self.INDEX_FILE), _MMAP_FLAGS)
+                with open(self._path(self.DOCS_FILE), "r", encoding="utf-8") as f:
+                    docs = json.load(f)
+                if old.ntotal:
+                    vectors = list(old.reconstruct_n(0, old.ntotal))
+            dim = len(entries[-1][2]) if entries else (len(vectors[0]) if vectors else 0)
+            if not dim:  # 只有删除记录、没有任何向量
+                open(self._path(self.LOG_FILE), "w").close()
+                return None
+            if vectors and len(vectors[0]) != dim:
+                log.warning("semantic_snapshot_dim_changed", dim=dim, old_dim=len(vectors[0]))  # 换了向量化后端
+                vectors, docs = [], []
+            for _, meta, vec in entries:
+                if len(vec) == dim:
+                    vectors.append(vec)
+                    docs.append(meta)
+            keep = [i for i, meta in enumerate(docs) if meta["id"] not in deleted and _is_live(meta, now)]
+            docs = [docs[i] for i in keep]
+
+            index = faiss.IndexFlatL2(dim)
+            if keep:
+                index.add(np.ascontiguousarray(np.stack([vectors[i] for i in keep]), dtype=np.float32))
+            tmp_index, tmp_docs = self._path(self.INDEX_FILE + ".tmp"), self._path(self.DOCS_FILE + ".tmp")
+            faiss.write_index(index, tmp_index)
+            with open(tmp_docs, "w", encoding="utf-8") as f:
+                json.dump(docs, f, ensure_ascii=False)
+            # 先换 docs 再换 index：index 的版本号变化是"新快照就绪"的信号
+            os.replace(tmp_docs, self._path(self.DOCS_FILE))
+            os.replace(tmp_index, self._path(self.INDEX_FILE))
+            open(self._path(self.LOG_FILE), "w").close()
+        log.info("semantic_snapshot_done", partition=os.path.basename(self.persist_dir), entries=len(docs))
+        return self._reopen()
+
 
 class SemanticMatcherFAISS:
     """
@@ -14,70 +345,227 @@ class SemanticMatcherFAISS:
     - 使用 query 作为检索 key
     - 缓存 result 作为返回值
     - 相似度 >= threshold 时命中
+    - 按 (意图, 用户等级) 分区：不同等级、不同意图的答案互不串用
+    - 每条带 TTL（与精确缓存同一张意图 TTL 表，TTL 为 0 的意图如 medical 不缓存）
+    - 总条数超过 max_entries 时按淘汰策略（默认 LRU）删除
+    - 指定 persist_dir 时持久化：每个分区一个子目录，快照 mmap 热启动 + 追加日志重放
+      追加日志、快照、重新加载都在一个后台写线程里串行做；新分区的加载放线程池，事件循环上不做文件 IO
     """
 
     def __init__(
             self,
             embeddings: Optional[Embeddings] = None,
             threshold: float = 0.92,
+            persist_dir: Optional[str] = None,
+            max_entries: int = 50000,
+            policy: str = "lru",
+            default_ttl: int = 3600,
+            memo_bytes: int = 16 * 1024 * 1024,
     ):
-        self.embeddings = embeddings or OpenAIEmbeddings()
+        if embeddings is None:
+            from langchain_community.embeddings import OpenAIEmbeddings  # 密钥由 config.env_utils 加载
+            embeddings = OpenAIEmbeddings()
+        self.embeddings = embeddings
+        self.memo = EmbeddingMemo(memo_bytes)  # 查找和写入共用，一条 query 只算一次向量
         self.threshold = threshold
-        self._vectorstore: Optional[FAISS] = None
+        self.persist_dir = persist_dir
+        self.default_ttl = default_ttl
+        self.policy = create_policy(policy, max_entries)
+        self.timer_wheel = TimerWheel(resolution=1.0)
+        self._partitions: Dict[str, PersistentFAISSStore] = {}
+        self._owner: Dict[str, str] = {}  # 记录 id → 分区名
+        self.eviction_count = 0
+        self.expired_count = 0
         self._lock = asyncio.Lock()  # 防止并发写冲突
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-wal") if persist_dir else None
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            for name in self._undiscovered():  # 构造本身在后台线程里（semantic_loader），直接加载
+                self._install(name, self._open(name))
+
+    # -------------------- 分区 --------------------
+    @staticmethod
+    def partition_name(intent: Optional[str], user_tier=None) -> str:
+        tier = getattr(user_tier, "value", user_tier)
+        return re.sub(r"[^\w.-]", "_", f"{intent or 'any'}.{tier or 'all'}")
+
+    def _open(self, name: str) -> PersistentFAISSStore:
+        """新建并加载分区（有持久化时读快照、重放日志，放线程里调用）"""
+        return PersistentFAISSStore(self.embeddings, self.persist_dir and os.path.join(self.persist_dir, name),
+                                    self._writer)
+
+    def _install(self, name: str, store: PersistentFAISSStore) -> None:
+        """在事件循环上整体换上加载好的分区对象，检索拿到的要么是旧对象要么是新对象"""
+        self._partitions[name] = store
+        self._sync(name)
+
+    async def _partition(self, name: str) -> PersistentFAISSStore:
+        store = self._partitions.get(name)
+        if store is None:
+            store = await asyncio.to_thread(self._open, name) if self.persist_dir else self._open(name)
+            self._install(name, store)
+        return store
+
+    def _undiscovered(self) -> List[str]:
+        """磁盘上还没加载的分区（包括其他 worker 新建的）"""
+        return [name for name in sorted(os.listdir(self.persist_dir))
+                if name not in self._partitions and os.path.isdir(os.path.join(self.persist_dir, name))]
+
+    def _sync(self, name: str) -> None:
+        """分区重新加载后，把淘汰策略/时间轮与磁盘上的记录对齐（已有记录保留访问顺序）"""
+        store = self._partitions[name]
+        metas = store.entries()
+        live = {meta["id"] for meta in metas}
+        for doc_id in [d for d, p in self._owner.items() if p == name and d not in live]:
+            self._forget(doc_id)
+        for meta in sorted(metas, key=lambda m: m.get("created_at", 0)):
+            if meta["id"] not in self._owner:
+                self._track(name, meta)
+
+    def _track(self, name: str, meta: dict) -> None:
+        doc_id = meta["id"]
+        self._owner[doc_id] = name
+        self.timer_wheel.schedule(doc_id, meta.get("expires_at", math.inf))
+        for victim in self.policy.on_insert(doc_id):
+            self.eviction_count += 1
+            self._remove(victim)
 
-    async def aadd(self, query: str, result: str) -> None:
-        """异步添加 (query, result) 到语义缓存"""
+    def _forget(self, doc_id: str) -> Optional[str]:
+        self.policy.on_remove(doc_id)
+        self.timer_wheel.cancel(doc_id)
+        return self._owner.pop(doc_id, None)
+
+    def _remove(self, doc_id: str) -> None:
+        name = self._forget(doc_id)
+        if name is not None:
+            self._partitions[name].delete(doc_id)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """回收到期记录，返回回收条数"""
+        expired = self.timer_wheel.advance(now or time.time())
+        for doc_id in expired:
+            self._remove(doc_id)
+        self.expired_count += len(expired)
+        return len(expired)
+
+    # -------------------- 读写 --------------------
+    async def _embed(self, query: str) -> np.ndarray:
+        vector = self.memo.get(query)
+        if vector is None:
+            vector = self.memo.put(query, await self.embeddings.aembed_query(query))
+        return vector
+
+    async def aadd(self, query: str, result: str, intent: Optional[str] = None, user_tier=None) -> None:
+        """异步添加 (query, result) 到语义缓存，TTL 跟随意图"""
+        ttl = INTENT_TTL.get(intent, self.default_ttl) if intent else self.default_ttl
+        if ttl <= 0:
+            return  # 与 SmartCache.set_with_intent 一致：medical / emergency 不缓存
+        # 以 query 建索引（查找时拿 query 比 query），答案放在 metadata 里
+        vector = await self._embed(query)
+        now = time.time()
+        meta = {"id": uuid.uuid4().hex, "original_query": query, "result": result,
+                "created_at": now, "expires_at": now + ttl}
+        name = self.partition_name(intent, user_tier)
         async with self._lock:
-            doc = Document(
-                page_content=result,
-                metadata={"original_query": query}
-            )
-            if self._vectorstore is None:
-                # 首次创建
-                self._vectorstore = await FAISS.afrom_documents(
-                    [doc], self.embeddings
-                )
-            else:
-                # 增量添加
-                self._vectorstore.add_documents([doc])
-
-    async def afind_match(self, query: str) -> Optional[str]:
-        """异步查找语义最相似的缓存结果"""
-        if self._vectorstore is None:
-            return None
+            self.expire(now)
+            (await self._partition(name)).add(query, vector, meta)
+            self._track(name, meta)
 
-        # 使用 similarity_search_with_relevance_scores
-        # 返回 [(doc, score), ...]，score 是余弦相似度（0~1）
-        docs_and_scores = await self._vectorstore.asimilarity_search_with_relevance_scores(
-            query,
-            k=1,
-            score_threshold=self.threshold  # 只返回 >= threshold 的结果
-        )
+    async def afind_match(self, query: str, intent: Optional[str] = None, user_tier=None) -> Optional[str]:
+        """异步查找同分区内语义最相似、未过期的缓存结果"""
+        store = self._partitions.get(self.partition_name(intent, user_tier))
+        if store is None or len(store) == 0:
+            return None
 
-        if docs_and_scores:
-            best_doc, best_score = docs_and_scores[0]
-            print(f"🎯 语义缓存命中！相似度: {best_score:.4f}")
-            return best_doc.page_content
+        with stage_timer("embed"):
+            vector = await self._embed(query)
+        with stage_timer("faiss_search"):
+            best = store.search(vector, time.time())
+        if best is not None and best[1] >= self.threshold:
+            best_doc, best_score = best
+            self.policy.on_access(best_doc.metadata["id"])
+            log.debug("semantic_hit", intent=intent, score=round(best_score, 4))
+            return best_doc.metadata["result"]
 
         return None
 
-    async def ainvoke(self, query: str, generate_func) -> str:
+    async def ainvoke(self, query: str, generate_func, intent: Optional[str] = None, user_tier=None) -> str:
         """
         智能调用：先查缓存，未命中则调用 generate_func 并自动缓存
 
         Args:
             query: 用户查询文本
             generate_func: 异步函数，用于生成结果（当缓存未命中时调用）
+            intent / user_tier: 决定分区和 TTL
 
         Returns:
             缓存结果 或 新生成的结果
         """
-        cached = await self.afind_match(query)
+        cached = await self.afind_match(query, intent, user_tier)
         if cached is not None:
             return cached
 
         # 未命中，生成新结果
         result = await generate_func()
-        await self.aadd(query, result)
-        return result
\ No newline at end of file
+        await self.aadd(query, result, intent, user_tier)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._owner)
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._owner),
+            "max_entries": self.policy.capacity,
+            "eviction_count": self.eviction_count,
+            "expired_count": self.expired_count,
+            "partitions": {name: len(store) for name, store in self._partitions.items()},
+            "embedding_memo": self.memo.get_stats(),
+        }
+
+    # -------------------- 持久化 --------------------
+    async def asnapshot(self) -> bool:
+        """
+        落盘快照，期间暂停写入（检索照常，用的是旧分区对象）
+        快照/重新加载提交到写线程，排在已提交的日志追加之后；加载好的新对象回到事件循环上整体替换
+        """
+        async with self._lock:
+            self.expire()
+            if not self.persist_dir:
+                return False
+            for name in await asyncio.to_thread(self._undiscovered):
+                await self._partition(name)
+            loop = asyncio.get_running_loop()
+            changed = False
+            for name, store in list(self._partitions.items()):
+                fresh = await loop.run_in_executor(self._writer, store.snapshot)
+                if fresh is None:
+                    fresh = await loop.run_in_executor(self._writer, store.maybe_reload)
+                if fresh is not None:
+                    self._install(name, fresh)
+                    changed = True
+            return changed
+
+    def start_snapshot_task(self, interval: int = 600) -> None:
+        """定期快照 + 回收过期记录；同时发现其他 worker 写了新快照就重新加载"""
+        if not self.persist_dir or self._snapshot_task is not None:
+            return
+
+        async def snapshot_worker():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.asnapshot()
+                except Exception as e:
+                    log.error("semantic_snapshot_failed", exc_info=True, error=str(e))
+
+        self._snapshot_task = asyncio.ensure_future(snapshot_worker())
+        log.info("semantic_snapshot_task_started", interval=interval)
+
+    async def aclose(self) -> None:
+        """停机前最后一次快照"""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        await self.asnapshot()
@@ -0,0 +1,356 @@
+"""
+多 worker 共享的精确缓存：同一台机器上的所有进程读写同一个 SQLite 文件
+- WAL 模式 + mmap：读不阻塞写，多个进程并发读基本是内存访问
+- TTL 存在行里（绝对时间戳），任何进程读到过期行都视为未命中，清理任务谁跑都行
+- 容量淘汰在写事务里做（BEGIN IMMEDIATE 跨进程串行）：先删过期，再按策略删最旧/最少访问的
+  条数和字节数由触发器维护在 cache_meta 里，检查容量是 O(1)；可选字节预算（max_bytes）
+- compact()：清过期 + 增量 vacuum 归还空闲页 + WAL checkpoint，控制磁盘占用
+- 命中时的访问时间/次数先攒在本进程内存里，批量写回（读路径不必每次都抢写锁）
+- write_behind=True 时写入/清空交给单线程后台执行器，事件循环上不跑 BEGIN IMMEDIATE（等锁最长 busy_timeout）
+- get_stats 只读内存里的快照，库里的统计（条数、过期数、文件大小）在写线程 / 清理线程 / aget_stats 里刷新
+- 接口与 SmartCache 一致：get / set / set_with_intent / delete / clear / get_stats ...
+值用 JSON 序列化（str 或流式块列表），不用 pickle：缓存文件被篡改也不会执行代码
+超过阈值的值压缩后存 BLOB（首字节标明 zlib/zstd），读的进程不依赖自己的压缩配置
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from router.cache import SmartCache
+from router.compression import create_codec, pack_json, unpack_json
+from router.log import get_logger
+
+log = get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key          TEXT PRIMARY KEY,
+    value        TEXT NOT NULL,
+    expires_at   REAL NOT NULL,
+    created_at   REAL NOT NULL,
+    accessed_at  REAL NOT NULL,
+    access_count INTEGER NOT NULL DEFAULT 0,
+    size         INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at);
+CREATE INDEX IF NOT EXISTS idx_cache_count ON cache(access_count, accessed_at);
+"""
+
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_meta (
+    id    INTEGER PRIMARY KEY CHECK (id = 0),
+    items INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_meta
+    SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM cache;
+CREATE TRIGGER IF NOT EXISTS cache_meta_ins AFTER INSERT ON cache BEGIN
+    UPDATE cache_meta SET items = items + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_meta_del AFTER DELETE ON cache BEGIN
+    UPDATE cache_meta SET items = items - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_meta_upd AFTER UPDATE OF size ON cache BEGIN
+    UPDATE cache_meta SET bytes = bytes + NEW.size - OLD.size WHERE id = 0;
+END;
+"""
+
+# 访问记录攒够这么多条或这么久就批量写回
+_FLUSH_SIZE = 256
+_FLUSH_INTERVAL_S = 1.0
+# 库统计快照最多这么久随写入刷新一次
+_STATS_INTERVAL_S = 1.0
+
+# 淘汰顺序：lru 按最近访问时间，lfu 按访问次数（同次数再按时间）
+_EVICT_ORDER = {
+    "lru": "accessed_at",
+    "lfu": "access_count, accessed_at",
+}
+
+
+class SQLiteCache:
+    def __init__(self, path: str, max_size: int = 1000, default_ttl: int = 3600, policy: str = "lru",
+                 mmap_mb: int = 64, busy_timeout_ms: int = 5000, max_bytes: Optional[int] = None,
+                 compression: str = "none", compress_threshold: int = 2048, write_behind: bool = False):
+        self.path = path
+        self.max_size = max_size
+        self.max_bytes = max_bytes  # 值的总字节数上限，None 只按条数
+        self.default_ttl = default_ttl
+        if policy not in _EVICT_ORDER:
+            # w_tinylfu 需要进程内的频率草图，跨进程共享不了，退化为 lru
+            log.warning("shared_cache_policy_unsupported", policy=policy, fallback="lru")
+            policy = "lru"
+        self.policy_name = policy
+        self._evict_order = _EVICT_ORDER[policy]
+        self.mmap_mb = mmap_mb
+        self.busy_timeout_ms = busy_timeout_ms
+        self.codec = create_codec(compression)
+        self.compress_threshold = compress_threshold
+        # 命中/未命中/淘汰计数是本进程的
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self._local = threading.local()
+        self._pending: Dict[str, Tuple[float, int]] = {}  # key → (最近访问时间, 未写回的访问次数)
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # 独立使用时写入走后台线程；作为 TieredCache 的 L2 时由它自己的写线程调用，不再套一层
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-sqlite") if write_behind else None
+        self._db_stats: Dict[str, Any] = {}
+        self._stats_at = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # 只对新建的库生效，之后 compact() 可以归还空闲页
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+        if "size" not in columns:  # 旧版本建的库，补上 size 列
+            conn.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE cache SET size = length(CAST(value AS BLOB))")
+        conn.executescript(_META_SCHEMA)
+        self.refresh_stats()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接；fork 出来的子进程重新连接（不能共用父进程的连接）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL 下 NORMAL 足够安全，少一次 fsync
+            conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024}")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # -------------------- 读写 --------------------
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """在线程里读，不阻塞事件循环"""
+        return await asyncio.to_thread(self.get, key)
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """返回 (值, 过期时间戳)，供上层缓存按剩余 TTL 回填"""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+        if row is None:
+            self.miss_count += 1
+            return None
+        with self._pending_lock:
+            count = self._pending.get(key, (0.0, 0))[1]
+            self._pending[key] = (now, count + 1)
+            due = len(self._pending) >= _FLUSH_SIZE or time.monotonic() - self._last_flush >= _FLUSH_INTERVAL_S
+        if due:
+            self.flush()
+        self.hit_count += 1
+        return unpack_json(row[0]), row[1]
+
+    def _take_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        return [(accessed_at, count, key) for key, (accessed_at, count) in pending.items()]
+
+    def _write_access(self, conn: sqlite3.Connection, rows) -> None:
+        if rows:
+            conn.executemany("UPDATE cache SET accessed_at = MAX(accessed_at, ?), "
+                             "access_count = access_count + ? WHERE key = ?", rows)
+
+    def flush(self) -> None:
+        """把攒下的访问记录写回（一个事务），淘汰顺序才能反映本进程的访问"""
+        rows = self._take_pending()
+        if not rows:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_access(conn, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    get_cache = get
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """write_behind 时提交给写线程立即返回（同一执行器串行，顺序与调用顺序一致）"""
+        if self._writer is None:
+            self._write(key, value, ttl)
+        else:
+            self._writer.submit(self._write_behind, key, value, ttl)
+
+    def _write_behind(self, key: str, value: Any, ttl: Optional[int]) -> None:
+        try:
+            self._write(key, value, ttl)
+        except Exception as e:
+            log.warning("shared_cache_write_failed", key=key, error=str(e))
+
+    def _write(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        now = time.time()
+        data = pack_json(value, self.codec, self.compress_threshold)
+        size = len(data) if isinstance(data, bytes) else len(data.encode("utf-8"))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # 单条就超过预算，不缓存
+        conn = self._conn()
+        rows = self._take_pending()
+        conn.execute("BEGIN IMMEDIATE")  # 跨进程写锁，容量检查和插入原子完成
+        try:
+            self._write_access(conn, rows)  # 先写回访问记录，淘汰时才不会误删刚命中的热 key
+            conn.execute(
+                "INSERT INTO cache (key, value, expires_at, created_at, accessed_at, access_count, size) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at, "
+                "created_at = excluded.created_at, accessed_at = excluded.accessed_at, size = excluded.size",
+                (key, data, now + (ttl or self.default_ttl), now, now, size))
+            self._evict(conn, key, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if time.monotonic() - self._stats_at >= _STATS_INTERVAL_S:
+            self.refresh_stats()
+
+    def _usage(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        """(条数, 字节数)，触发器维护，O(1)"""
+        return conn.execute("SELECT items, bytes FROM cache_meta WHERE id = 0").fetchone()
+
+    def _over(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        items, size = self._usage(conn)
+        over_bytes = size - self.max_bytes if self.max_bytes is not None else 0
+        return items - self.max_size, over_bytes
+
+    def _evict(self, conn: sqlite3.Connection, keep: str, now: float) -> None:
+        """超出条数/字节预算时：先删过期，再按淘汰顺序删（刚写入的 keep 不删）"""
+        over_items, over_bytes = self._over(conn)
+        if over_items <= 0 and over_bytes <= 0:
+            return
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        over_items, over_bytes = self._over(conn)
+        if over_items > 0:
+            self.eviction_count += conn.execute(
+                f"DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE key != ? "
+                f"ORDER BY {self._evict_order} LIMIT ?)", (keep, over_items)).rowcount
+            over_bytes = self._over(conn)[1]
+        if over_bytes > 0:
+            # 按淘汰顺序累加字节数，删掉刚好够腾出空间的最短前缀
+            self.eviction_count += conn.execute(
+                f"DELETE FROM cache WHERE key IN (SELECT key FROM ("
+                f"SELECT key, size, SUM(size) OVER (ORDER BY {self._evict_order} ROWS UNBOUNDED PRECEDING) AS cum "
+                f"FROM cache WHERE key != ?) WHERE cum - size < ?)", (keep, over_bytes)).rowcount
+
+    def compact(self) -> None:
+        """清过期 + 归还空闲页 + 截断 WAL，控制磁盘占用"""
+        conn = self._conn()
+        self._cleanup()
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # 按意图 TTL 写入、命中率、后台清理线程与 SmartCache 完全相同
+    set_with_intent = SmartCache.set_with_intent
+    get_hit_rate = SmartCache.get_hit_rate
+    start_cleanup_task = SmartCache.start_cleanup_task
+
+    def _cleanup(self, cleanup_size: int = 100):
+        removed = self._conn().execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        if removed:
+            log.info("cache_cleanup", backend="sqlite", expired=removed)
+        self.refresh_stats()
+
+    def cleanup(self, cleanup_size: int = 100):
+        self._cleanup(cleanup_size)
+
+    # -------------------- 辅助方法 --------------------
+    def delete(self, key: str) -> bool:
+        return self._conn().execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self) -> None:
+        if self._writer is None:
+            self._clear()
+        else:
+            self._writer.submit(self._clear)  # 排在已提交的写入之后
+
+    def _clear(self) -> None:
+        self._conn().execute("DELETE FROM cache")
+        self.refresh_stats()
+        log.info("cache_cleared", backend="sqlite")
+
+    def exists(self, key: str) -> bool:
+        row = self._conn().execute("SELECT 1 FROM cache WHERE key = ? AND expires_at > ?",
+                                   (key, time.time())).fetchone()
+        return row is not None
+
+    def get_with_info(self, key: str) -> Optional[Tuple[Any, Dict]]:
+        value = self.get(key)
+        if value is None:
+            return None
+        row = self._conn().execute("SELECT access_count, created_at, expires_at FROM cache WHERE key = ?",
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        access_count, created_at, expires_at = row
+        return value, {
+            "access_count": access_count,
+            "created_at": datetime.fromtimestamp(created_at).strftime("%H:%M:%S"),
+            "expire_at": datetime.fromtimestamp(expires_at).strftime("%H:%M:%S"),
+            "time_until_expire": max(0.0, expires_at - time.time()),
+            "hit_rate": self.get_hit_rate(),
+        }
+
+    # -------------------- 统计 --------------------
+    def refresh_stats(self) -> None:
+        """跑 SQL 刷新库统计快照（会读盘，不要在事件循环上调用）"""
+        now = time.time()
+        conn = self._conn()
+        total_items, total_bytes = self._usage(conn)
+        expired = conn.execute("SELECT COUNT(*) FROM cache WHERE expires_at <= ?", (now,)).fetchone()[0]
+        expiring_soon = conn.execute("SELECT COUNT(*) FROM cache WHERE expires_at > ? AND expires_at < ?",
+                                     (now, now + 300)).fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        self._db_stats = {
+            "total_items": total_items,
+            "value_bytes": total_bytes,
+            "expired_items": expired,
+            "expiring_soon": expiring_soon,
+            "memory_usage": f"{page_count * page_size / 1024:.2f} KB",  # 数据库文件大小
+        }
+        self._stats_at = time.monotonic()
+
+    async def aget_stats(self) -> Dict:
+        """先在线程里刷新库统计再返回（/health 用）"""
+        await asyncio.to_thread(self.refresh_stats)
+        return self.get_stats()
+
+    def get_stats(self) -> Dict:
+        """只读快照和本进程计数，不碰数据库，可以在事件循环 / 指标抓取里直接调"""
+        total = self.hit_count + self.miss_count
+        db = self._db_stats
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "total_items": db.get("total_items", 0),
+            "max_size": self.max_size,
+            "value_bytes": db.get("value_bytes", 0),
+            "max_bytes": self.max_bytes,
+            "compression": self.codec.name if self.codec else "none",
+            "policy": self.policy_name,
+            "write_behind": self._writer is not None,
+            "eviction_count": self.eviction_count,
+            "hit_count": self.hit_count,
+            "miss_count": self.miss_count,
+            "hit_rate": f"{self.hit_count / total:.2%}" if total else "0.00%",
+            "expired_items": db.get("expired_items", 0),
+            "expiring_soon": db.get("expiring_soon", 0),
+            "memory_usage": db.get("memory_usage", "0.00 KB"),
+            "stats_age_s": round(time.monotonic() - self._stats_at, 1),
+        }
@@ -0,0 +1,125 @@
+"""
+单飞（single-flight）合并：相同 key 的并发请求只打一次上游
+- do():     普通调用，后到者等待第一个请求的结果
+- stream(): 流式调用，一个上游流扇出给多个订阅者（后加入者先补发已产生的块）；订阅者全部离开时取消上游
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+
+class _Broadcast:
+    """一个上游流 + 已产生块的缓冲，供多个订阅者按各自进度读取"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.pump: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk: Any) -> None:
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.chunks) or self.done)
+                pending = self.chunks[index:]
+                finished, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._pumps: Set[asyncio.Task] = set()
+        self.shared_count = 0   # 被合并掉的重复请求数
+        self.leader_count = 0   # 真正打到上游的请求数
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        同 key 只执行一次 fn，其余并发调用共享结果（包括异常）
+        上游调用放在独立 task 里，领头请求被取消（客户端断开）也不影响跟随者
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leader_count += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _t: self._calls.pop(key, None))
+        else:
+            self.shared_count += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        同 key 只开一个上游流，所有订阅者收到完整且相同的块序列
+        上游流在独立 task（pump）里跑；最后一个订阅者离开（客户端全断开）就取消它，不再继续计费
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leader_count += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+
+            async def pump():
+                error: Optional[BaseException] = None
+                try:
+                    async for chunk in factory():
+                        await broadcast.publish(chunk)
+                except asyncio.CancelledError:
+                    error = RuntimeError("upstream stream cancelled")
+                    raise
+                except Exception as e:
+                    error = e
+                finally:
+                    if self._streams.get(key) is broadcast:
+                        del self._streams[key]
+                    await broadcast.finish(error)  # 任何结局都通知订阅者，不会有人一直挂着等
+
+            broadcast.pump = asyncio.ensure_future(pump())
+            self._pumps.add(broadcast.pump)  # 事件循环只持有弱引用，不留引用 task 可能被回收
+            broadcast.pump.add_done_callback(self._pumps.discard)
+        else:
+            self.shared_count += 1
+
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.subscribe():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                # 没人听了：摘掉 key（之后同样的请求重新开流），取消上游
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.pump.cancel()
+
+    def streaming(self, key: str) -> bool:
+        """该 key 是否已有上游流在途（再来的请求会作为订阅者加入）"""
+        return key in self._streams
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "leader_count": self.leader_count,
+            "shared_count": self.shared_count,
+        }
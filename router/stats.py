@@ -0,0 +1,167 @@
+"""
+模型实时观测：延迟 EWMA + 滑动窗口分位数 + 错误率 EWMA + 流式首 token 延迟（TTFT）
+由 ModelService 在每次调用后记录，RouterEngine 打分和对冲延迟都读这里
+- EWMA 按墙钟时间衰减：没有新流量时错误率按半衰期回落到 0、延迟回落到画像先验，
+  一次故障不会让一个之后没流量的模型永远被压分
+- 被取消的调用（对冲落败、客户端断开）没有完整耗时，但至少跑了这么久：作为下界样本进分位数窗口，
+  否则慢请求总被对冲取消、尾部被截掉，p95 和对冲延迟会一路往下掉
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+def _percentile(sorted_samples: List[float], q: float) -> float:
+    idx = min(len(sorted_samples) - 1, int(round(q / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[idx]
+
+
+class ModelStats:
+    def __init__(self, prior_latency_ms: float = 1000.0, alpha: float = 0.2, window: int = 256,
+                 prior_ttft_ms: float = 500.0, half_life_s: float = 300.0):
+        self.alpha = alpha
+        self.half_life_s = half_life_s
+        self.prior_latency_ms = float(prior_latency_ms)  # 无观测时用 YAML 里的画像延迟
+        self.prior_ttft_ms = float(prior_ttft_ms)
+        self._latency_ms = self.prior_latency_ms
+        self._ttft_ms = self.prior_ttft_ms
+        self._error_rate = 0.0
+        self._updated = time.monotonic()
+        self.total = 0
+        self.errors = 0
+        self.censored = 0
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None  # 分位数缓存，写入时失效
+        self._ttft_samples: Deque[float] = deque(maxlen=window)
+
+    # -------------------- 按时间衰减的 EWMA --------------------
+    def _weight(self, now: float) -> float:
+        """距上次观测 now - _updated 秒后，旧观测还剩多少权重"""
+        if self.half_life_s <= 0:
+            return 1.0
+        return 0.5 ** ((now - self._updated) / self.half_life_s)
+
+    def _settle(self, now: float) -> None:
+        """把到 now 为止的衰减落到存储值上，再叠加新观测"""
+        w = self._weight(now)
+        self._error_rate *= w
+        self._latency_ms = self.prior_latency_ms + (self._latency_ms - self.prior_latency_ms) * w
+        self._ttft_ms = self.prior_ttft_ms + (self._ttft_ms - self.prior_ttft_ms) * w
+        self._updated = now
+
+    @property
+    def ewma_error_rate(self) -> float:
+        return self._error_rate * self._weight(time.monotonic())
+
+    @property
+    def ewma_latency_ms(self) -> float:
+        return self.prior_latency_ms + (self._latency_ms - self.prior_latency_ms) * self._weight(time.monotonic())
+
+    @property
+    def ewma_ttft_ms(self) -> float:
+        return self.prior_ttft_ms + (self._ttft_ms - self.prior_ttft_ms) * self._weight(time.monotonic())
+
+    # -------------------- 记录 --------------------
+    def record(self, latency_ms: float, ok: bool) -> None:
+        self._settle(time.monotonic())
+        self.total += 1
+        self._error_rate += self.alpha * ((0.0 if ok else 1.0) - self._error_rate)
+        if not ok:
+            self.errors += 1
+            return
+        self._latency_ms += self.alpha * (latency_ms - self._latency_ms)
+        self._samples.append(latency_ms)
+        self._sorted = None
+
+    def record_censored(self, elapsed_ms: float) -> None:
+        """
+        被取消的调用：真实耗时 ≥ elapsed_ms，按下界进分位数窗口（不进 EWMA / 错误率）
+        比中位数还短就取消的（多半是客户端断开）对尾部没有信息量，不记
+        """
+        median = self.percentile(50)
+        if median is not None and elapsed_ms < median:
+            return
+        self.censored += 1
+        self._samples.append(elapsed_ms)
+        self._sorted = None
+
+    def record_ttft(self, ttft_ms: float) -> None:
+        """流式调用收到第一个非空块的耗时"""
+        self._settle(time.monotonic())
+        self._ttft_ms += self.alpha * (ttft_ms - self._ttft_ms)
+        self._ttft_samples.append(ttft_ms)
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """窗口内延迟分位数（q: 0~100），无样本返回 None"""
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return _percentile(self._sorted, q)
+
+    def ttft_percentile(self, q: float) -> Optional[float]:
+        if not self._ttft_samples:
+            return None
+        return _percentile(sorted(self._ttft_samples), q)
+
+    def snapshot(self) -> Dict:
+        return {
+            "ewma_latency_ms": round(self.ewma_latency_ms, 1),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "ewma_ttft_ms": round(self.ewma_ttft_ms, 1),
+            "ttft_p95_ms": self.ttft_percentile(95),
+            "ewma_error_rate": round(self.ewma_error_rate, 4),
+            "total": self.total,
+            "errors": self.errors,
+            "censored": self.censored,
+        }
+
+
+class LatencyTracker:
+    """按模型名聚合的 ModelStats，线程安全"""
+
+    def __init__(self, priors: Dict[str, float], alpha: float = 0.2, window: int = 256,
+                 ttft_priors: Optional[Dict[str, float]] = None, half_life_s: float = 300.0):
+        self.alpha = alpha
+        self.window = window
+        self.half_life_s = half_life_s
+        self._lock = threading.Lock()
+        ttft_priors = ttft_priors or {}
+        self._stats: Dict[str, ModelStats] = {
+            name: ModelStats(prior, alpha, window, ttft_priors.get(name, 500.0), half_life_s)
+            for name, prior in priors.items()
+        }
+
+    def get(self, name: str) -> ModelStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(name, ModelStats(alpha=self.alpha, window=self.window,
+                                                                half_life_s=self.half_life_s))
+        return stats
+
+    def record(self, name: str, latency_ms: float, ok: bool) -> None:
+        stats = self.get(name)
+        with self._lock:
+            stats.record(latency_ms, ok)
+
+    def record_censored(self, name: str, elapsed_ms: float) -> None:
+        stats = self.get(name)
+        with self._lock:
+            stats.record_censored(elapsed_ms)
+
+    def record_ttft(self, name: str, ttft_ms: float) -> None:
+        stats = self.get(name)
+        with self._lock:
+            stats.record_ttft(ttft_ms)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: s.snapshot() for name, s in self._stats.items()}
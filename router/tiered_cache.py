@@ -0,0 +1,124 @@
+"""
+两级响应缓存：L1 进程内存（SmartCache）+ L2 本地磁盘（SQLite）
+- 只有 TTL 足够长的条目（默认 ≥ 6 小时，如 code 24h / math 12h）才写 L2，重启后还在
+- 写 L2 走单线程后台执行器（write-behind），请求路径不等磁盘
+- L1 未命中时 aget 在线程里查 L2，命中按剩余 TTL 回填 L1
+- L2 有独立的条数/字节预算，定期 compact() 清过期、归还空闲页
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from router.cache import SmartCache
+from router.log import get_logger
+from router.shared_cache import SQLiteCache
+
+log = get_logger(__name__)
+
+
+class TieredCache:
+    def __init__(self, l1: SmartCache, l2: SQLiteCache, min_ttl: int = 6 * 3600, compact_interval: int = 3600):
+        self.l1 = l1
+        self.l2 = l2
+        self.min_ttl = min_ttl  # TTL 不低于这个才写 L2
+        self.compact_interval = compact_interval
+        self.default_ttl = l1.default_ttl
+        self.l2_hit_count = 0
+        self.l2_write_count = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-l2")
+
+    # -------------------- 读 --------------------
+    def get(self, key: str) -> Optional[Any]:
+        """同步读（会直接读磁盘）；事件循环里请用 aget"""
+        value = self.l1.get(key)
+        if value is None:
+            value = self._promote(key, self.l2.get_entry(key))
+        return value
+
+    get_cache = get
+
+    async def aget(self, key: str) -> Optional[Any]:
+        value = self.l1.get(key)
+        if value is None:
+            value = self._promote(key, await asyncio.to_thread(self.l2.get_entry, key))
+        return value
+
+    def _promote(self, key: str, entry) -> Optional[Any]:
+        """L2 命中：按剩余 TTL 回填 L1"""
+        if entry is None:
+            return None
+        value, expires_at = entry
+        self.l2_hit_count += 1
+        self.l1.set(key, value, max(1, int(expires_at - time.time())))
+        return value
+
+    # -------------------- 写 --------------------
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = ttl or self.default_ttl
+        self.l1.set(key, value, ttl)
+        if ttl >= self.min_ttl:
+            self.l2_write_count += 1
+            self._writer.submit(self._write_l2, key, value, ttl)
+
+    def _write_l2(self, key: str, value: Any, ttl: int) -> None:
+        try:
+            self.l2.set(key, value, ttl)
+        except Exception as e:
+            log.warning("cache_l2_write_failed", key=key, error=str(e))
+
+    # 按意图 TTL 写入与 SmartCache 相同（走本类的 set，长 TTL 自动进 L2）
+    set_with_intent = SmartCache.set_with_intent
+
+    def delete(self, key: str) -> bool:
+        deleted = self.l1.delete(key)
+        return self.l2.delete(key) or deleted
+
+    def clear(self) -> None:
+        self.l1.clear()
+        self._writer.submit(self.l2.clear)  # 和 L2 写入串行，不在事件循环上跑 SQL
+
+    def exists(self, key: str) -> bool:
+        return self.l1.exists(key) or self.l2.exists(key)
+
+    # -------------------- 维护 --------------------
+    def cleanup(self, cleanup_size: int = 100):
+        self.l1.cleanup(cleanup_size)
+
+    def start_cleanup_task(self, interval: int = 300):
+        """L1 定期回收过期项；L2 每 compact_interval 秒交给写线程压缩（和写入串行，不抢锁）"""
+        self.l1.start_cleanup_task(interval)
+
+        def compact():
+            try:
+                self.l2.compact()
+            except Exception as e:
+                log.warning("cache_l2_compact_failed", error=str(e))
+
+        def compact_worker():
+            while True:
+                time.sleep(self.compact_interval)
+                self._writer.submit(compact)
+
+        threading.Thread(target=compact_worker, daemon=True).start()
+        log.info("cache_l2_compact_task_started", interval=self.compact_interval)
+
+    def get_hit_rate(self) -> float:
+        total = self.l1.hit_count + self.l1.miss_count
+        return (self.l1.hit_count + self.l2_hit_count) / total if total > 0 else 0
+
+    async def aget_stats(self) -> Dict:
+        await asyncio.to_thread(self.l2.refresh_stats)
+        return self.get_stats()
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": "tiered",
+            "hit_rate": f"{self.get_hit_rate():.2%}",
+            "l2_hit_count": self.l2_hit_count,
+            "l2_write_count": self.l2_write_count,
+            "l2_min_ttl": self.min_ttl,
+            "l1": self.l1.get_stats(),
+            "l2": self.l2.get_stats(),
+        }
@@ -0,0 +1,34 @@
+"""
+本地 token 估算 + 上游用量解析
+- 不联网、不加载词表（tiktoken 需要下载 BPE 文件），估算一次只是一遍 C 层的编码计数
+- ASCII（英文 / 代码）约 3.5 字符一个 token；非 ASCII（中日韩等）按一字一个 token，对主流分词器偏保守
+- 宁可略高估：估算用于上下文窗口过滤和 TPM 预占，低估会把超长提示发给会拒绝它的模型
+计费以上游返回的 usage_metadata 为准，上游没给时才退回估算
+"""
+import math
+from typing import Optional
+
+from router.models import TokenUsage
+
+_ASCII_CHARS_PER_TOKEN = 3.5
+_MESSAGE_OVERHEAD = 4  # 聊天格式里角色、分隔符等固定开销
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / _ASCII_CHARS_PER_TOKEN) + (len(text) - ascii_chars)
+
+
+def estimate_prompt_tokens(query: str) -> int:
+    """单条 user 消息作为提示的 token 数"""
+    return estimate_tokens(query) + _MESSAGE_OVERHEAD
+
+
+def usage_from(message) -> Optional[TokenUsage]:
+    """从 LangChain 消息（或流式块）的 usage_metadata 取用量，没有返回 None"""
+    meta = getattr(message, "usage_metadata", None)
+    if not meta:
+        return None
+    return TokenUsage(input_tokens=meta.get("input_tokens", 0), output_tokens=meta.get("output_tokens", 0))